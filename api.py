@@ -1,26 +1,70 @@
 """
 API 调用与 Excel 批处理逻辑
 """
+import os
+import random
+import re
 import time
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Optional, Tuple
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Optional, Tuple
 
 import pandas as pd
-from openai import OpenAI
+from openai import OpenAI, BadRequestError
 
 from config import (
     save_api_config,
     load_api_config,
     DEFAULT_BASE_URL,
     DEFAULT_MODEL,
+    load_profile_usage,
+    save_profile_usage,
 )
+from budget import LIMITS, BudgetGuard, format_limit
+from cascade import REASONS, TIERS, escalation_reason, normalize_cascade_config
+from ensemble import VOTE_RULES, merge_votes, normalize_ensemble_config, votes_agree
+from chunking import DEFAULT_REDUCER, REDUCERS, reduce_chunk_results, split_chunks
+from output_schema import (
+    FALLBACK_DELIMITER,
+    build_request_params,
+    failed_rows_mask,
+    format_parsed,
+    json_instruction,
+    normalize_output_config,
+    repair_prompt,
+    split_output_columns,
+    summarize_fields,
+    validate_output,
+)
+from dedup import DEFAULT_THRESHOLD, NearDuplicateIndex
+from learned_screen import LearnedScreen
+from metrics import DEFAULT_INTERVAL, JobMetrics, MetricsExporter, metrics_paths, output_error_class
+from fingerprint import FINGERPRINT_COLUMN, job_fingerprint, row_fingerprints
+from preprocess import preprocess_values
+from provenance import COLUMNS as PROVENANCE_COLUMNS, add_request, new_trace, provenance_frame, result_source
+from result_cache import ResultCache
+from rules import RuleMatcher, normalize_rules_config
+from template_engine import CompiledTemplate, TemplateError, compile_template
+from tokens import EST_OUTPUT_TOKENS, estimate_tokens
+from tracing import NULL_TRACER, Tracer, trace_path
+from usage import COST_COLUMN, ROW_COLUMNS, UsageMeter, merge_usage, summary_path, write_job_summary
 
 # 全局客户端与当前模型配置，由 init_client 设置
 _client: Optional[OpenAI] = None
 _base_url: str = DEFAULT_BASE_URL
 _model: str = DEFAULT_MODEL
 
+# 运行模式：键为配置值，值为界面显示名
+RUN_MODES = {
+    "full": "全部处理",
+    "retry_failures": "仅重跑失败行",
+    "incremental": "增量更新",
+}
+
+# 各模型不支持的 response_format 类型（服务端报错后记录，后续请求直接降级）
+_unsupported_formats: Dict[str, set] = {}
+
 
 def init_client(api_key: str, base_url: Optional[str] = None, model: Optional[str] = None) -> OpenAI | None:
     """
@@ -87,61 +131,413 @@ def get_current_base_url() -> str:
     return _base_url or DEFAULT_BASE_URL
 
 
-def call_model(prompt: str, max_retries: int = 3, stop_flag=None) -> str:
-    """stop_flag: 可调用对象，若返回 True 则立即中止（用于用户点击停止）。"""
+def _extract_usage(resp) -> Dict[str, int]:
+    """从响应中提取 token 用量；缓存命中数兼容 OpenAI（prompt_tokens_details）与 DeepSeek 字段。"""
+    usage = getattr(resp, "usage", None)
+    if usage is None:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached = getattr(details, "cached_tokens", None) if details is not None else None
+    if cached is None:
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    return {
+        "prompt_tokens": int(getattr(usage, "prompt_tokens", 0) or 0),
+        "completion_tokens": int(getattr(usage, "completion_tokens", 0) or 0),
+        "cached_tokens": int(cached or 0),
+    }
+
+
+def call_model(
+    prompt: str,
+    max_retries: int = 3,
+    stop_flag=None,
+    max_tokens: Optional[int] = None,
+    stop: Optional[List[str]] = None,
+    system: Optional[str] = None,
+    response_format: Optional[Dict] = None,
+    model: Optional[str] = None,
+) -> str:
+    """
+    stop_flag: 可调用对象，若返回 True 则立即中止（用于用户点击停止）。
+    max_tokens / stop: 可选的输出长度上限与停止序列（由模板输出字段推算）。
+    system: 可选的共享前缀，作为 system 消息放在行数据之前，便于服务端复用 Prompt 缓存。
+    response_format: 可选的结构化输出约束；服务端不支持 json_schema 时依次降级为 json_object、不约束。
+    model: 可选，本次调用使用的模型（同一平台），为空时使用当前模型。
+    """
+    return call_model_detailed(
+        prompt,
+        max_retries,
+        stop_flag,
+        max_tokens=max_tokens,
+        stop=stop,
+        system=system,
+        response_format=response_format,
+        model=model,
+    )["content"]
+
+
+def _downgrade_response_format(response_format: Optional[Dict], model: Optional[str] = None) -> Optional[Dict]:
+    """按模型（缺省为当前模型）已记录的不支持类型降级 response_format。"""
+    unsupported = _unsupported_formats.get(model or _model, set())
+    while response_format and response_format.get("type") in unsupported:
+        response_format = {"type": "json_object"} if response_format["type"] == "json_schema" else None
+    return response_format
+
+
+def call_model_detailed(
+    prompt: str,
+    max_retries: int = 3,
+    stop_flag=None,
+    max_tokens: Optional[int] = None,
+    stop: Optional[List[str]] = None,
+    system: Optional[str] = None,
+    response_format: Optional[Dict] = None,
+    model: Optional[str] = None,
+    tracer: Tracer = NULL_TRACER,
+) -> Dict:
+    """
+    与 call_model 相同，但返回详细信息：
+    {"content": 文本（失败为空串）, "usage": {prompt_tokens, completion_tokens, cached_tokens},
+     "attempts": 实际发出的请求次数（含重试与 response_format 降级重发）, "errors": 各次失败的异常类名}
+    """
     if _client is None:
         raise RuntimeError("Client 未初始化")
+    model = model or _model
+
+    messages = []
+    if system:
+        messages.append({"role": "system", "content": system})
+    messages.append({"role": "user", "content": prompt})
+    failed = {"content": "", "usage": {}, "attempts": 0, "errors": []}
+
+    extra = {}
+    if max_tokens:
+        extra["max_tokens"] = max_tokens
+    if stop:
+        extra["stop"] = stop
 
     backoff_base = 2
-    for attempt in range(max_retries):
+    attempt = 0
+    while attempt < max_retries:
         if stop_flag and callable(stop_flag) and stop_flag():
-            return ""
+            return failed
+        fmt = _downgrade_response_format(response_format, model)
+        failed["attempts"] += 1
         try:
-            resp = _client.chat.completions.create(
-                model=_model,
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0,
-            )
-            return (resp.choices[0].message.content or "").strip()
+            with tracer.span("API 请求", "network", model=model, attempt=failed["attempts"]):
+                resp = _client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=0,
+                    **extra,
+                    **({"response_format": fmt} if fmt else {}),
+                )
+            return {
+                "content": (resp.choices[0].message.content or "").strip(),
+                "usage": _extract_usage(resp),
+                "attempts": failed["attempts"],
+                "errors": failed["errors"],
+            }
+        except BadRequestError as e:
+            failed["errors"].append(type(e).__name__)
+            if fmt and "response_format" in str(e):
+                # 服务端不支持该结构化输出类型：记录后降级重发，不计入重试次数
+                _unsupported_formats.setdefault(model, set()).add(fmt["type"])
+                logging.warning(f"模型不支持 response_format={fmt['type']}，已降级: {e}")
+                continue
+            # 请求本身有误（如超出上下文长度），重试无意义，直接返回失败以免白等退避
+            logging.warning(f"模型调用失败（不重试）: {e}")
+            return failed
         except Exception as e:
+            failed["errors"].append(type(e).__name__)
             logging.warning(f"模型调用重试 ({attempt + 1}/{max_retries}): {e}")
             if stop_flag and callable(stop_flag) and stop_flag():
-                return ""
+                return failed
             if attempt < max_retries - 1:
-                time.sleep(backoff_base**attempt)
-            else:
-                return ""
-    return ""
+                with tracer.span("重试等待", "retry", seconds=backoff_base**attempt):
+                    time.sleep(backoff_base**attempt)
+            attempt += 1
+    return failed
 
 
-def process_row(row_index, merged_text, delimiter, prompt_template, cache_key, stop_flag=None):
-    prompt = prompt_template.replace("{merged_text}", merged_text).replace(
-        "{delimiter}", delimiter
-    )
-    result = call_model(prompt, stop_flag=stop_flag)
+def process_row(
+    row_index,
+    merged_text,
+    delimiter,
+    prompt_template,
+    cache_key,
+    stop_flag=None,
+    values=None,
+    request_params=None,
+    output_cfg=None,
+    tracer: Tracer = NULL_TRACER,
+):
+    """
+    prompt_template: 模板字符串或已编译的 CompiledTemplate（批处理时每个任务只编译一次）。
+    values: {列名: 文本}，供 {col:列名} 占位符与条件段使用。
+    request_params: 透传给 call_model 的额外参数（如 max_tokens、stop、system、response_format）。
+    output_cfg: 输出配置；声明了字段时按字段校验输出，不合格则用修复提示重问一次。
+    tracer: 可选的时间线记录（见 tracing），记录本行的处理与各次 API 调用。
+    """
+    if not isinstance(prompt_template, CompiledTemplate):
+        prompt_template = compile_template(prompt_template)
+    started = time.perf_counter()
+    prompt = prompt_template.render(merged_text, delimiter, values)
+    request_params = request_params or {}
+    resp = call_model_detailed(prompt, stop_flag=stop_flag, tracer=tracer, **request_params)
+    result = resp["content"]
+    usage = dict(resp["usage"])
+    attempts = resp.get("attempts", 1)
+    api_errors = list(resp.get("errors", []))
 
     error = False
     error_msg = ""
+    parsed = None
+    repaired = False
+    cfg = normalize_output_config(output_cfg)
+    fields = cfg["fields"]
 
     if not result:
         error = True
         error_msg = "API 返回空"
         result = f"FAIL{delimiter}FAIL"
+    elif fields:
+        fmt = cfg["format"]
+        ok, parsed, err = validate_output(result, fields, fmt, delimiter)
+        if not ok and cfg["repair"]:
+            # 只把不合格输出和格式要求发回去修复，不重复发送原文
+            with tracer.span("格式修复", "repair"):
+                fix = call_model_detailed(
+                    repair_prompt(result, err, fields, fmt, delimiter),
+                    max_retries=1,
+                    stop_flag=stop_flag,
+                    tracer=tracer,
+                    **{k: v for k, v in request_params.items() if k != "system"},
+                )
+            for k, v in fix["usage"].items():
+                usage[k] = usage.get(k, 0) + v
+            attempts += fix.get("attempts", 1)
+            api_errors += fix.get("errors", [])
+            ok, parsed, err2 = validate_output(fix["content"], fields, fmt, delimiter)
+            repaired = ok
+            err = err2 or err
+        if ok:
+            result = format_parsed(parsed, fields, delimiter)
+        else:
+            error = True
+            error_msg = f"输出校验失败: {err}"
+            result = f"FAIL{delimiter}FAIL"
     elif delimiter and delimiter not in result:
         # 仅当分隔符非空时才检查是否包含分隔符
         error = True
         error_msg = "缺少分隔符"
         result = f"FAIL{delimiter}FAIL"
 
+    finished = time.perf_counter()
+    tracer.complete(f"行 {row_index}", "row", started, finished, attempts=attempts, error=error_msg, api_errors=api_errors)
     return {
         "index": row_index,
         "output": result,
+        "fields": parsed,
+        "repaired": repaired,
         "cache_key": cache_key,
         "error": error,
         "error_msg": error_msg,
+        "usage": usage,
+        "attempts": attempts,
+        "api_errors": api_errors,
+        "started": started,
+        "latency": finished - started,
     }
 
 
+def current_job_fingerprint(prompt, delimiter, cols, extra_cols, options=None) -> str:
+    """当前任务指纹：Prompt、分隔符、模型、参与列及影响结果的设置。"""
+    options = options or {}
+    return job_fingerprint(
+        prompt,
+        delimiter,
+        get_current_model(),
+        list(cols) + list(extra_cols),
+        {k: options.get(k) for k in ("preprocess", "chunking", "output", "shared_prefix", "rules", "cascade", "ensemble")},
+    )
+
+
+def prepare_request(
+    template: CompiledTemplate,
+    request_params: Dict,
+    fields: List[Dict],
+    delimiter: str,
+    shared_prefix: bool,
+    log_cb,
+) -> Tuple[CompiledTemplate, Dict]:
+    """
+    按共享前缀与输出格式调整模板与请求参数：
+    - shared_prefix 时模板开头与行无关的部分作为 system 消息单独发送
+    - JSON 模式时输出要求追加到 system 消息末尾（json_object 模式要求提示中出现 JSON 字样）
+    返回：(行级模板, 请求参数)
+    """
+    if shared_prefix:
+        prefix, template = template.split_static_prefix(delimiter)
+        if prefix.strip():
+            request_params = dict(request_params, system=prefix)
+            log_cb(f"共享前缀：约 {estimate_tokens(prefix)} tokens 作为 system 消息单独发送")
+    if "response_format" in request_params:
+        system = request_params.get("system")
+        instruction = json_instruction(fields)
+        request_params = dict(
+            request_params, system=f"{system}\n\n{instruction}" if system else instruction
+        )
+        log_cb("输出格式：JSON 结构化（response_format 约束，不支持时自动降级）")
+    return template, request_params
+
+
+def _missing_columns(df: pd.DataFrame, cols, template: CompiledTemplate) -> str:
+    """所选列与模板引用的列都须在表中（行指纹与取值前检查）；返回错误说明，无缺失时为空串。"""
+    for names, label in ((cols, "所选列"), (template.columns, "模板引用的列")):
+        missing = [c for c in names if c not in df.columns]
+        if missing:
+            return f"{label}不存在: {', '.join(missing)}"
+    return ""
+
+
+def _decided_by(r: Dict) -> str:
+    """AI_Decided_By 列的取值：规则名、本地分类器（附置信度）或模型。"""
+    if r.get("rule"):
+        return f"规则:{r['rule']}"
+    if r.get("learned") is not None:
+        return f"分类器:{r['learned']:.3f}"
+    return "模型"
+
+
+def _run_learned_screen(screen, jobs, submit, collect, results, log_cb, stop_flag) -> List[Dict]:
+    """
+    学习型预筛：随机抽样送模型判定 → 训练本地分类器 → 高置信行本地判定 →
+    最不确定的行分轮送模型判定并加入训练集。本地判定的结果追加到 results（带 learned 置信度）。
+    返回：仍需调用模型的行
+    """
+    cfg = screen.cfg
+    rng = random.Random(0)
+    sample = rng.sample(jobs, min(int(cfg["sample_size"]), len(jobs)))
+    n_holdout = int(len(sample) * float(cfg["holdout"]))
+    holdout = {job["index"] for job in sample[:n_holdout]}
+    sampled = {job["index"] for job in sample}
+    remaining = [job for job in jobs if job["index"] not in sampled]
+    text_of = {job["index"]: job["text"] for job in jobs}
+    log_cb(f"学习型预筛：随机抽取 {len(sample)} 行送模型判定（其中 {n_holdout} 行留作评估）")
+
+    batch = sample
+    settled = 0
+    for round_no in range(int(cfg["rounds"]) + 1):
+        for r in collect(submit(batch)):
+            if not r["error"]:
+                screen.add(text_of[r["index"]], r["output"], holdout=r["index"] in holdout)
+        if stop_flag() or not remaining:
+            break
+        trained = screen.fit()
+        log_cb(f"学习型预筛第 {round_no + 1} 轮：")
+        for line in screen.report_lines():
+            log_cb(f"  {line}")
+        if not trained:
+            break
+        labels, conf = screen.predict([job["text"] for job in remaining])
+        if screen.trusted:
+            confident = conf >= float(cfg["confidence"])
+            for job, label, c in zip(remaining, labels, conf):
+                if c >= float(cfg["confidence"]):
+                    results.append({
+                        "index": job["index"],
+                        "output": screen.answer_for(label),
+                        "learned": float(c),
+                        "error": False,
+                        "error_msg": "",
+                    })
+            settled += int(confident.sum())
+            log_cb(f"  本轮本地判定 {int(confident.sum())} 行")
+            conf = conf[~confident]
+            remaining = [job for job, ok in zip(remaining, confident) if not ok]
+        if round_no == int(cfg["rounds"]) or not remaining:
+            break
+        # 主动学习：最不确定的行优先送模型判定
+        order = sorted(range(len(remaining)), key=lambda i: conf[i])[: int(cfg["round_size"])]
+        picked = set(order)
+        batch = [remaining[i] for i in order]
+        remaining = [job for i, job in enumerate(remaining) if i not in picked]
+
+    log_cb(
+        f"学习型预筛：共 {settled} 行由本地分类器判定（见 AI_Decided_By 列），"
+        f"{len(jobs) - settled - len(remaining)} 行（抽样与主动学习）已由模型判定，其余 {len(remaining)} 行交给模型"
+    )
+    return remaining
+
+
+def _with_field_columns(df: pd.DataFrame, fields: List[Dict], delimiter: str) -> pd.DataFrame:
+    """按字段定义重新生成 AI_<字段名> 类型列（替换文件中已有的同名列）。"""
+    if not fields:
+        return df
+    field_frame = split_output_columns(df["AI_Output"], fields, delimiter)
+    return pd.concat([df.drop(columns=field_frame.columns, errors="ignore"), field_frame], axis=1)
+
+
+def _carry_over_results(
+    df: pd.DataFrame, fingerprints: pd.Series, previous_path: str, log_cb
+) -> pd.Series:
+    """
+    从上次的输出文件中按行指纹沿用成功的结果，写入 df 对应行。
+    返回：已沿用结果的行（布尔 Series）
+    """
+    carried = pd.Series(False, index=df.index)
+    if not previous_path or not os.path.exists(previous_path):
+        log_cb("增量更新：未找到上次的输出文件，将处理全部行")
+        return carried
+    try:
+        prev = pd.read_excel(previous_path)
+    except Exception as e:
+        log_cb(f"[警告] 读取上次的输出文件失败，将处理全部行: {e}")
+        return carried
+    if FINGERPRINT_COLUMN not in prev.columns or "AI_Output" not in prev.columns:
+        log_cb("增量更新：上次的输出文件没有 AI_Fingerprint 列，将处理全部行")
+        return carried
+    keep = [
+        c for c in ("AI_Output", "AI_Truncated", "AI_Chunks", "AI_Decided_By", "AI_Tier", "AI_Votes", "AI_Agreement")
+        if c in prev.columns and c in df.columns
+    ]
+    prev = prev[~failed_rows_mask(prev["AI_Output"])]
+    prev = prev.drop_duplicates(FINGERPRINT_COLUMN).set_index(FINGERPRINT_COLUMN)[keep]
+    carried = fingerprints.isin(prev.index)
+    for c in keep:
+        df.loc[carried, c] = fingerprints[carried].map(prev[c].fillna("").astype(str))
+    return carried
+
+
+def _assign_columns(df: pd.DataFrame, frame: pd.DataFrame) -> None:
+    """把按行号索引的附加列写入 df 对应行（缺少的列先补空；文本写入数值列时先转为 object 列）。"""
+    for c in frame.columns:
+        values = frame[c].dropna()
+        numeric = pd.api.types.is_numeric_dtype(frame[c])
+        if c not in df.columns:
+            df[c] = pd.Series(float("nan") if numeric else None, index=df.index, dtype="float64" if numeric else object)
+        elif not numeric and pd.api.types.is_numeric_dtype(df[c]):
+            df[c] = df[c].astype(object)
+        df.loc[values.index, c] = values
+
+
+def _carried_sources(carried: pd.Series, cache_hits: pd.Series) -> Dict:
+    """沿用结果的行（持久缓存命中 / 增量更新沿用上次结果）的来源。"""
+    return {idx: "persistent_cache" if cache_hits.get(idx, False) else "carried" for idx in carried.index[carried]}
+
+
+def _record_usage(meter: UsageMeter, info: Dict, output_path: str, profile: Optional[str], log_cb) -> None:
+    """写出任务用量摘要，并把本次用量累加到 profile 的累计用量。"""
+    ok, msg = write_job_summary(summary_path(output_path), dict(info, **meter.to_dict()))
+    log_cb(f"用量摘要已保存至: {msg}" if ok else f"[警告] {msg}")
+    if profile:
+        try:
+            save_profile_usage(profile, merge_usage(load_profile_usage(profile), meter.by_model))
+        except Exception as e:
+            log_cb(f"[警告] 累计 profile 用量失败: {e}")
+
+
 def run_processing(
     input_path,
     cols,
@@ -152,37 +548,568 @@ def run_processing(
     log_cb,
     stop_flag,
     max_workers=20,
+    options=None,
+    result_cb=None,
+    usage_cb=None,
 ):
+    """
+    result_cb: 可选，每行得到模型的最终结果时以结果 dict（含 usage、latency）调用，供试运行等统计使用。
+    usage_cb: 可选，每完成一次模型请求时以本任务累计用量（UsageMeter.totals()）调用，供界面实时显示。
+    options: 可选的任务设置（dict），目前支持：
+    - preprocess: {"normalize": bool, "row_budget": int, "column_budgets": {列名: int}}
+    - chunking: {"enabled": bool, "chunk_tokens": int, "overlap_tokens": int, "reducer": str}
+      {merged_text} 超过 chunk_tokens 的行切成重叠分块并发筛选，再按 reducer 归并
+    - output: {"fields": [...], "format": "delimited"|"json", "limit_length": bool,
+      "max_tokens": int, "repair": bool}
+      模板声明的输出字段：用于推算 max_tokens 与换行停止序列、校验输出，
+      并在写出时将 AI_Output 一次性拆分为 AI_<字段名> 类型列；
+      format=json 时以 response_format 约束模型输出 JSON 对象
+    - shared_prefix: bool，将模板开头与行无关的部分作为 system 消息单独发送，
+      行数据放在最后，便于服务端 Prompt 缓存复用相同前缀
+    - mode: 运行模式（见 RUN_MODES）。retry_failures 时 input_path 为之前的输出文件，
+      只处理 AI_Output 为空或失败的行，其余行原样保留；
+      incremental 时与上次的输出文件（previous_output，缺省为 output_path）按 AI_Fingerprint
+      行指纹比对，只处理新增或内容变化的行，其余行沿用上次结果
+    - previous_output: 增量更新时作为比对基准的上次输出文件
+    - persistent_cache: bool，按行指纹读写持久结果缓存（见 result_cache），命中的行不再调用 API
+    - dedup: {"enabled": bool, "threshold": float}，近似重复行（归一化 + MinHash）沿用同簇代表行的结果，
+      并在 AI_DupOf 列记录代表行的 Excel 行号
+    - rules: {"enabled": bool, "rules": [...]}，本地关键词/正则规则（见 rules），命中的行直接写入规则输出，
+      不调用 API，AI_Decided_By 列记录由哪条规则或模型判定
+    - learned: 学习型预筛设置（见 learned_screen.DEFAULT_LEARNED），先抽样送模型判定并训练本地分类器，
+      留出集一致率达标时高置信行在本地判定，其余行分轮送模型（主动学习）
+    - cascade: 模型级联（见 cascade.DEFAULT_CASCADE），所有行先由当前模型作答，格式不合格、评分接近阈值
+      或字段矛盾的行在同一线程池中改由 strong_model 重答，AI_Tier 列记录作答的级别
+    - ensemble: 多模型投票（见 ensemble.DEFAULT_ENSEMBLE），每行同时发给前两个模型，判定不一致时才调用第三个，
+      按投票规则合并；AI_Votes 列记录各模型答案，AI_Agreement 列标记一致 / 分歧（启用时模型级联不生效）
+    - pricing: {模型: {"input", "output", "cached_input"}}（元 / 百万 tokens），用于计算费用；
+      每行的 token 用量写入 AI_Prompt_Tokens 等列（配置了价格时另有 AI_Cost 列），
+      任务合计写入输出文件旁的用量摘要（<输出文件名>_用量.json）
+    - profile: 平台 profile id，任务用量累加到该 profile 的累计用量中
+    - template_name: 模板名称，仅记录在用量摘要中
+    - provenance: bool，写出行明细列（见 provenance）：结果来源（模型 / 缓存 / 规则等）、作答模型、请求与重试次数、
+      排队等待与请求耗时
+    - budget: {"max_requests", "max_tokens", "max_cost"}（0 表示不限，见 budget），每行派发前按已用量与在途估算检查，
+      达到上限即停止派发新行；已派发的行处理完后照常保存，未处理的行 AI_Output 留空，可用「仅重跑失败行」继续
+    - metrics: {"enabled": bool, "dir": str, "interval": 秒, "port": int}，运行期间定期把任务指标（见 metrics）
+      写为 Prometheus 文本文件与 JSON 快照（目录缺省为输出文件所在目录）；port 非 0 时另在 127.0.0.1 提供 HTTP 访问
+    - trace: bool，记录运行时间线（见 tracing）：各阶段、每行与每次 API 调用 / 重试等待的时间段（按线程分轨）、
+      排队等待与在途请求数，结束时（含出错或中断）写出 <输出文件名>_trace.json，可用 Perfetto 或 chrome://tracing 打开
+    """
+    tracer = Tracer(bool((options or {}).get("trace")))
     try:
-        df = pd.read_excel(input_path)
+        with tracer.span("run_processing", input=str(input_path), output=str(output_path)):
+            return _run_processing(
+                input_path, cols, delimiter, output_path, prompt, progress_cb, log_cb, stop_flag,
+                max_workers, options, result_cb, usage_cb, tracer,
+            )
+    finally:
+        if tracer.enabled:
+            ok, msg = tracer.write(trace_path(output_path), {"model": get_current_model(), "max_workers": max_workers})
+            log_cb(f"运行时间线已保存至: {msg}（用 https://ui.perfetto.dev 或 chrome://tracing 打开）" if ok else f"[警告] {msg}")
+
+
+def _run_processing(
+    input_path,
+    cols,
+    delimiter,
+    output_path,
+    prompt,
+    progress_cb,
+    log_cb,
+    stop_flag,
+    max_workers,
+    options,
+    result_cb,
+    usage_cb,
+    tracer,
+):
+    options = options or {}
+    pre = options.get("preprocess") or {}
+    normalize = bool(pre.get("normalize"))
+    column_budgets = pre.get("column_budgets") or {}
+    row_budget = int(pre.get("row_budget") or 0)
+    preprocessing = normalize or bool(column_budgets) or row_budget > 0
+    chunk_cfg = options.get("chunking") or {}
+    chunking = bool(chunk_cfg.get("enabled"))
+    chunk_tokens = int(chunk_cfg.get("chunk_tokens") or 0)
+    overlap_tokens = int(chunk_cfg.get("overlap_tokens") or 0)
+    reducer = chunk_cfg.get("reducer") or DEFAULT_REDUCER
+    output_cfg = normalize_output_config(options.get("output"))
+    fields = output_cfg["fields"]
+    request_params = build_request_params(output_cfg, delimiter)
+    mode = options.get("mode") or "full"
+    # 校验后的输出按此分隔符拼接（JSON 模式未设分隔符时使用 FALLBACK_DELIMITER）
+    out_delimiter = delimiter or (FALLBACK_DELIMITER if fields else "")
+    rules_cfg = normalize_rules_config(options.get("rules"))
+    try:
+        matcher = RuleMatcher(rules_cfg["rules"]) if rules_cfg["enabled"] and rules_cfg["rules"] else None
+    except re.error as e:
+        return False, f"规则中的正则表达式有误: {e}"
+    if matcher and fields:
+        for rule in matcher.rules:
+            ok, _, err = validate_output(rule["output"], fields, "delimited", out_delimiter)
+            if not ok:
+                return False, f"规则「{rule['name']}」的输出不符合输出字段定义: {err}"
+    cascade_cfg = normalize_cascade_config(options.get("cascade"))
+    ensemble_cfg = normalize_ensemble_config(options.get("ensemble"))
+    learned_cfg = options.get("learned") or {}
+    screen = LearnedScreen(learned_cfg, fields, out_delimiter) if learned_cfg.get("enabled") else None
+    dedup_cfg = options.get("dedup") or {}
+    dedup_index = (
+        NearDuplicateIndex(float(dedup_cfg.get("threshold") or DEFAULT_THRESHOLD))
+        if dedup_cfg.get("enabled")
+        else None
+    )
+
+    try:
+        template = compile_template(prompt)
+    except TemplateError as e:
+        return False, f"Prompt 模板有误: {e}"
+
+    try:
+        with tracer.span("读取 Excel"):
+            df = pd.read_excel(input_path)
     except Exception as e:
         return False, f"读取 Excel 失败: {e}"
 
-    df["AI_Output"] = ""
-    total = len(df)
+    template, request_params = prepare_request(
+        template, request_params, fields, delimiter, options.get("shared_prefix"), log_cb
+    )
+    # 各级别 / 各投票模型的请求参数；每行首发的级别为 first_tiers
+    tier_params = {"fast": request_params}
+    first_tiers = ["fast"]
+    if ensemble_cfg["enabled"]:
+        voters = [m or get_current_model() for m in ensemble_cfg["models"]]
+        for i, m in enumerate(voters):
+            tier_params[f"v{i}"] = dict(request_params, model=m)
+        first_tiers = ["v0", "v1"]
+        log_cb(
+            f"多模型投票：{voters[0]} 与 {voters[1]} 同时作答，判定不一致时由 {voters[2]} 仲裁"
+            f"（投票规则: {VOTE_RULES[ensemble_cfg['vote']]}）"
+        )
+        if cascade_cfg["enabled"]:
+            log_cb("[提示] 已启用多模型投票，模型级联不生效")
+            cascade_cfg["enabled"] = False
+    if cascade_cfg["enabled"]:
+        tier_params["strong"] = dict(request_params, model=cascade_cfg["strong_model"])
+        log_cb(
+            f"模型级联：先由 {get_current_model()} 作答，不可靠的行改由 {cascade_cfg['strong_model']} 重答"
+            f"（评分阈值 {cascade_cfg['score_threshold']:g} ± {cascade_cfg['margin']:g}）"
+        )
+
+    err = _missing_columns(df, cols, template)
+    if err:
+        return False, err
+    # 模板单独引用、但未勾选合并的列，需计入缓存键
+    extra_cols = [c for c in template.columns if c not in cols]
+    if chunking and not template.uses_merged_text:
+        log_cb("[提示] 模板未使用 {merged_text}，分块模式不生效")
+        chunking = False
+
+    # 行指纹：参与列内容 + Prompt/模型/设置，用于增量更新与持久缓存
+    job_fp = current_job_fingerprint(prompt, delimiter, cols, extra_cols, options)
+    with tracer.span("行指纹", rows=len(df)):
+        fingerprints = row_fingerprints(df, list(cols) + extra_cols, job_fp)
+    carried = pd.Series(False, index=df.index)
+
+    if mode == "retry_failures":
+        if "AI_Output" not in df.columns:
+            return False, "输入文件中没有 AI_Output 列，请选择之前的输出文件再使用「仅重跑失败行」"
+        todo = failed_rows_mask(df["AI_Output"])
+        log_cb(f"仅重跑失败行：共 {len(df)} 行，其中 {int(todo.sum())} 行为空或失败")
+        if not todo.any():
+            return True, "没有需要重跑的失败行。"
+        # 读回的结果列可能因空值被推断为数值类型，统一转为文本后再回填
+        for c in ("AI_Output", "AI_Truncated", "AI_Chunks", "AI_Decided_By", "AI_Tier", "AI_Votes", "AI_Agreement"):
+            if c in df.columns:
+                df[c] = df[c].fillna("").astype(str)
+                if c != "AI_Output":
+                    df.loc[todo, c] = ""
+        for c in list(ROW_COLUMNS.values()) + [COST_COLUMN] + list(PROVENANCE_COLUMNS.values()):
+            if c in df.columns:
+                df.loc[todo, c] = float("nan")
+        rows = df[todo]
+        if FINGERPRINT_COLUMN not in df.columns:
+            df[FINGERPRINT_COLUMN] = ""
+        df[FINGERPRINT_COLUMN] = df[FINGERPRINT_COLUMN].fillna("").astype(str)
+        df.loc[todo, FINGERPRINT_COLUMN] = fingerprints[todo]
+    else:
+        df["AI_Output"] = ""
+        if preprocessing:
+            df["AI_Truncated"] = ""
+        if chunking:
+            df["AI_Chunks"] = ""
+        df[FINGERPRINT_COLUMN] = fingerprints
+        rows = df
+    if preprocessing and "AI_Truncated" not in df.columns:
+        df["AI_Truncated"] = ""
+    if chunking and "AI_Chunks" not in df.columns:
+        df["AI_Chunks"] = ""
+    if matcher or screen is not None:
+        if "AI_Decided_By" in df.columns:
+            df["AI_Decided_By"] = df["AI_Decided_By"].fillna("").astype(str)
+        else:
+            df["AI_Decided_By"] = ""
+    extra_result_cols = []
+    if cascade_cfg["enabled"]:
+        extra_result_cols.append("AI_Tier")
+    if ensemble_cfg["enabled"]:
+        extra_result_cols += ["AI_Votes", "AI_Agreement"]
+    for c in extra_result_cols:
+        if c in df.columns:
+            df[c] = df[c].fillna("").astype(str)
+        else:
+            df[c] = ""
+    if dedup_index is not None:
+        if "AI_DupOf" in df.columns:
+            df["AI_DupOf"] = df["AI_DupOf"].fillna("").astype(str)
+        else:
+            df["AI_DupOf"] = ""
+
+    if mode == "incremental":
+        previous_path = options.get("previous_output") or output_path
+        with tracer.span("比对上次输出"):
+            carried = _carry_over_results(df, fingerprints, previous_path, log_cb)
+        rows = df[~carried]
+        log_cb(f"增量更新：共 {len(df)} 行，沿用上次结果 {int(carried.sum())} 行，需处理 {len(rows)} 行")
+
+    store = None
+    cache_hits = pd.Series(False, index=df.index)
+    if options.get("persistent_cache") and not rows.empty:
+        try:
+            store = ResultCache()
+            with tracer.span("持久缓存查询", rows=len(rows)):
+                found = store.get_many(fingerprints[rows.index])
+        except Exception as e:
+            log_cb(f"[警告] 打开持久缓存失败，本次不使用: {e}")
+            store, found = None, {}
+        hits = fingerprints.isin(found.keys()) & df.index.isin(rows.index)
+        cache_hits = hits
+        if hits.any():
+            df.loc[hits, "AI_Output"] = fingerprints[hits].map(found)
+            carried = carried | hits
+            rows = rows[~hits[rows.index]]
+            log_cb(f"持久缓存：命中 {int(hits.sum())} 行，节省同样次数的 API 调用")
+
+    if rows.empty:
+        if store:
+            store.close()
+        df = _with_field_columns(df, fields, out_delimiter)
+        if options.get("provenance"):
+            _assign_columns(df, provenance_frame(_carried_sources(carried, cache_hits), {}))
+        try:
+            with tracer.span("保存 Excel", rows=len(df)):
+                df.to_excel(output_path, index=False)
+            log_cb(f"文件已保存至: {output_path}")
+        except Exception as e:
+            return False, f"保存文件失败: {e}"
+        return True, f"完成。共 {len(df)} 行，全部沿用已有结果，无需调用 API。"
+    truncated_rows = 0
+    rule_rows = 0
+    learned_rows = 0
+    repaired_rows = 0
+    chunked_rows = 0
+    chunk_requests = 0
+    total = len(rows)
+    meter = UsageMeter(options.get("pricing"))
+    # 行 -> 该行各次请求（分块、投票、级联）的用量合计与请求明细
+    row_usage = {}
+    row_trace = {}
+    started_at = time.time()
+    guard = BudgetGuard(options.get("budget"), meter)
+    if guard.active:
+        log_cb(f"任务预算：{guard.describe()}（每行派发前按已用量与在途估算检查）")
+        if guard.cfg["max_cost"] and any(
+            (p.get("model") or get_current_model()) not in meter.pricing for p in tier_params.values()
+        ):
+            log_cb("[提示] 价格表中缺少所用模型的价格，费用上限对这些模型的请求不生效")
+    # 单次请求的估算：模板固定部分与 system 消息 + 行文本；输出按 max_tokens（未设置时按常见短答案）
+    prompt_overhead = estimate_tokens(template.render("", delimiter, {})) + estimate_tokens(
+        request_params.get("system", "")
+    )
+    est_output = int(request_params.get("max_tokens") or EST_OUTPUT_TOKENS)
+    # 有预算时分批派发（在途请求不超过该数），使预算检查基于最新的实测用量
+    window = max_workers * 2
+    metrics_cfg = options.get("metrics") or {}
+    metrics = JobMetrics(os.path.splitext(os.path.basename(output_path))[0], bool(metrics_cfg.get("enabled")))
+    metrics.set("job_running", 1)
+    metrics.set("job_start_time_seconds", round(started_at, 3))
+    metrics.set("rows_planned", total)
+    carried_sources = Counter(_carried_sources(carried, cache_hits).values())
+    for source, n in carried_sources.items():
+        metrics.inc("rows_total", n, source=source)
+    exporter = None
+    if metrics.enabled:
+        prom_path, json_path = metrics_paths(output_path, metrics_cfg.get("dir") or "")
+        exporter = MetricsExporter(
+            metrics, prom_path, json_path, metrics_cfg.get("interval") or DEFAULT_INTERVAL, metrics_cfg.get("port") or 0
+        )
+        try:
+            exporter.start()
+            log_cb(
+                f"运行指标：每 {exporter.interval:g} 秒写出 {prom_path}"
+                + (f"，并在 http://127.0.0.1:{exporter.port}/metrics 提供" if exporter.port else "")
+            )
+        except OSError as e:
+            log_cb(f"[警告] 启动指标导出失败，本次不导出: {e}")
+            exporter = None
     cache = {}
     results = []
     error_rows = []
     done_cnt = 0
 
     log_cb(f"开始处理 {total} 行数据... (并发数: {max_workers})")
+    if request_params.get("max_tokens"):
+        log_cb(
+            f"输出长度控制：max_tokens={request_params['max_tokens']}"
+            + ("，遇换行停止" if request_params.get("stop") else "")
+        )
 
     user_stopped = False
     pool = ThreadPoolExecutor(max_workers=max_workers)
     try:
-        tasks = []
-        for idx, row in df.iterrows():
+        # 待调用模型的行：{"index", "chunks", "key", "values", "text"}
+        jobs = []
+        # future -> (行号, 分块序号, 分块总数, 级别)；未分块的行总数为 1
+        task_meta = {}
+        # future -> 提交时刻（perf_counter），用于计算排队等待
+        submitted_at = {}
+        # 行 -> 首次提交时刻，用于时间线上一行从派发到得到最终结果的全过程
+        row_submitted = {}
+        chunk_parts = {}
+        job_of = {}
+        # 级联：升级到强模型的行 -> 原因
+        escalated = {}
+        # 投票：行 -> {级别: 结果}；两票分歧、调用了仲裁模型的行
+        votes = {}
+        disagreed = []
+
+        def submit_tier(job, tier):
+            """提交一行（各分块）给指定级别 / 投票模型。"""
+            futures = []
+            model = tier_params[tier].get("model") or get_current_model()
+            for i, chunk in enumerate(job["chunks"]):
+                future = pool.submit(
+                    process_row,
+                    job["index"],
+                    chunk,
+                    delimiter,
+                    template,
+                    job["key"],
+                    stop_flag,
+                    job["values"],
+                    tier_params[tier],
+                    output_cfg,
+                    tracer,
+                )
+                task_meta[future] = (job["index"], i, len(job["chunks"]), tier)
+                submitted_at[future] = time.perf_counter()
+                row_submitted.setdefault(job["index"], submitted_at[future])
+                if guard.active:
+                    guard.hold(future, guard.estimate(model, prompt_overhead + estimate_tokens(chunk), est_output))
+                futures.append(future)
+            metrics.set("in_flight_requests", len(task_meta))
+            tracer.counter("在途请求", len(task_meta))
+            return futures
+
+        def submit(batch, tier=None):
+            """
+            提交各行；启用预算时每次提交前都检查预算（含级联升级与投票仲裁的追加请求）。
+            预算用尽后不再派发新行；追加请求未通过检查的行不写结果（留空），可用「仅重跑失败行」续跑。
+            """
+            futures = []
+            for job in batch:
+                if guard.active:
+                    estimates = [
+                        guard.estimate(
+                            tier_params[t].get("model") or get_current_model(),
+                            prompt_overhead + estimate_tokens(chunk),
+                            est_output,
+                        )
+                        for t in ([tier] if tier else first_tiers)
+                        for chunk in job["chunks"]
+                    ]
+                    if tier and not guard.admit(estimates):
+                        if not budget_unanswered:
+                            log_cb(
+                                f"[预算] {'仲裁' if ensemble_cfg['enabled'] else '升级'}请求将超出{LIMITS[guard.exhausted]}上限，"
+                                "这些行不写结果（留空），停止派发新行"
+                            )
+                        budget_unanswered.append(job["index"])
+                        budget_stopped.append(job["index"])
+                        continue
+                    if not tier and not guard.admit(estimates):
+                        if not budget_stopped:
+                            budget_stopped.append(job["index"])
+                            log_cb(
+                                f"[预算] 派发下一行将超出{LIMITS[guard.exhausted]}上限"
+                                f"（{format_limit(guard.exhausted, guard.cfg[guard.exhausted])}），"
+                                "停止派发新行，已派发的行处理完后保存"
+                            )
+                            tracer.instant("预算用尽", row=str(job["index"]), limit=guard.exhausted)
+                        break
+                job_of[job["index"]] = job
+                for t in [tier] if tier else first_tiers:
+                    futures += submit_tier(job, t)
+            return futures
+
+        def collect(futures, backlog=None):
+            """
+            等待一批任务完成并登记结果，返回本批完成的行结果。
+            级联模式下不可靠的行、投票模式下两票分歧的行在此追加提交，并在同一批中等待其完成。
+            backlog: 可选的待派发行迭代器，在途请求少于 window 时逐行补充派发（预算检查在 submit 中进行）。
+            """
+            nonlocal repaired_rows, user_stopped
+            finished = []
+            pending = set(futures)
+            while pending and not user_stopped:
+                completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    if stop_flag():
+                        user_stopped = True
+                        tracer.instant("用户中断")
+                        break
+                    r = future.result()
+                    if r.get("repaired"):
+                        repaired_rows += 1
+                    idx, part, n_parts, tier = task_meta.pop(future)
+                    usage = r.get("usage", {})
+                    model = tier_params[tier].get("model") or get_current_model()
+                    cost = meter.add(model, usage)
+                    guard.settle(future, usage)
+                    queued = submitted_at.pop(future)
+                    add_request(row_trace.setdefault(idx, new_trace()), model, r, r.get("started", queued) - queued)
+                    attempts = int(r.get("attempts", 1))
+                    metrics.set("in_flight_requests", len(task_meta))
+                    tracer.counter("在途请求", len(task_meta))
+                    tracer.async_span("排队", "queue", queued, r.get("started", queued), row=str(idx), tier=tier)
+                    metrics.inc("requests_total", model=model)
+                    metrics.inc("api_calls_total", attempts, model=model)
+                    metrics.inc("retries_total", max(0, attempts - 1), model=model)
+                    for error_class in r.get("api_errors", []):
+                        metrics.inc("errors_total", error_class=error_class)
+                    for k in ROW_COLUMNS:
+                        metrics.inc("tokens_total", usage.get(k, 0), type=k.split("_")[0])
+                    metrics.inc("cost_yuan_total", cost or 0)
+                    metrics.observe("request_latency_seconds", float(r.get("latency", 0.0)), model=model)
+                    metrics.observe("queue_wait_seconds", max(0.0, r.get("started", queued) - queued))
+                    spent = row_usage.setdefault(idx, dict.fromkeys(ROW_COLUMNS, 0))
+                    for k in ROW_COLUMNS:
+                        spent[k] += usage.get(k, 0)
+                    if cost is not None:
+                        spent["cost"] = spent.get("cost", 0.0) + cost
+                    if usage_cb:
+                        usage_cb(meter.totals())
+                    if n_parts > 1:
+                        parts = chunk_parts.setdefault((idx, tier), {})
+                        parts[part] = r
+                        if len(parts) < n_parts:
+                            continue
+                        r = reduce_chunk_results([parts[i] for i in range(n_parts)], out_delimiter, reducer)
+                        del chunk_parts[(idx, tier)]
+                    if ensemble_cfg["enabled"]:
+                        got = votes.setdefault(idx, {})
+                        got[tier] = r
+                        if len(got) < 2:
+                            continue
+                        if len(got) == 2 and not votes_agree(list(got.values()), fields, out_delimiter):
+                            arbitration = submit([job_of[idx]], tier="v2")
+                            if arbitration:
+                                disagreed.append(idx)
+                            pending.update(arbitration)
+                            continue
+                        ballots = [got[t] for t in sorted(got)]
+                        r = merge_votes(ballots, out_delimiter, ensemble_cfg["vote"])
+                        r["votes"] = [(tier_params[t]["model"], got[t]) for t in sorted(got)]
+                    if cascade_cfg["enabled"]:
+                        if tier == "fast":
+                            reason = escalation_reason(r, fields, out_delimiter, cascade_cfg)
+                            if reason:
+                                escalation = submit([job_of[idx]], tier="strong")
+                                if escalation:
+                                    escalated[idx] = reason
+                                pending.update(escalation)
+                                continue
+                        r["tier"] = tier
+                    finish(r)
+                    finished.append(r)
+                while backlog is not None and len(task_meta) < window and not budget_stopped and not user_stopped:
+                    job = next(backlog, None)
+                    if job is None:
+                        break
+                    pending.update(submit([job]))
+            return finished
+
+        def finish(r):
+            """登记一行的最终结果。"""
+            nonlocal done_cnt
+            results.append(r)
+            if r["index"] in row_submitted:
+                tracer.async_span(
+                    f"行 {r['index']}（派发→完成）", "row", row_submitted.pop(r["index"]), time.perf_counter(),
+                    error=r["error_msg"],
+                )
+            cache[r["cache_key"]] = {
+                "output": r["output"],
+                "error": r["error"],
+                "error_msg": r["error_msg"],
+            }
+            metrics.inc("rows_total", source="model")
+            if r["error"]:
+                error_rows.append(r["index"])
+                metrics.inc("errors_total", error_class=output_error_class(r["error_msg"]))
+                log_cb(f"[警告] 行 {r['index']} 失败: {r['error_msg']}")
+            if result_cb:
+                result_cb(r)
+
+            done_cnt += 1
+            progress_cb(done_cnt, total)
+
+        # 预算用尽时未派发的第一行，以及追加请求（升级 / 仲裁）未通过检查的行
+        budget_stopped = []
+        budget_unanswered = []
+        # 近似重复行 -> 代表行
+        dup_of = {}
+        build_started = time.perf_counter()
+        for idx, row in rows.iterrows():
             if stop_flag():
                 user_stopped = True
                 break
 
-            row_vals = []
-            for c in cols:
+            values = {}
+            for c in list(cols) + extra_cols:
                 val = row.get(c, "")
-                row_vals.append(str(val) if pd.notna(val) else "")
+                values[c] = str(val) if pd.notna(val) else ""
+
+            if matcher:
+                rule = matcher.match("\n".join(values.values()))
+                if rule:
+                    results.append({
+                        "index": idx,
+                        "output": rule["output"],
+                        "rule": rule["name"],
+                        "error": False,
+                        "error_msg": "",
+                    })
+                    rule_rows += 1
+                    metrics.inc("rows_total", source="rule")
+                    done_cnt += 1
+                    progress_cb(done_cnt, total)
+                    continue
+
+            if preprocessing:
+                values, truncated = preprocess_values(
+                    values, cols, normalize, column_budgets, row_budget
+                )
+                if truncated:
+                    df.at[idx, "AI_Truncated"] = ",".join(truncated)
+                    truncated_rows += 1
 
-            merged_text = "\n".join(row_vals)
+            merged_text = "\n".join(values[c] for c in cols)
             key = f"{merged_text}|{delimiter}|{prompt}"
+            if extra_cols:
+                key = "\x1f".join([key] + [values[c] for c in extra_cols])
 
             if key in cache:
                 cached = cache[key]
@@ -192,51 +1119,228 @@ def run_processing(
                     "cache_key": key,
                     "error": cached["error"],
                     "error_msg": cached["error_msg"],
+                    "source": "run_cache",
                 }
                 results.append(r)
+                metrics.inc("rows_total", source="run_cache")
                 if r["error"]:
                     error_rows.append(idx)
                 done_cnt += 1
                 progress_cb(done_cnt, total)
-            else:
-                future = pool.submit(
-                    process_row, idx, merged_text, delimiter, prompt, key, stop_flag
-                )
-                tasks.append(future)
+                continue
 
-        for future in as_completed(tasks):
-            if stop_flag():
-                user_stopped = True
-                break
-            r = future.result()
-            results.append(r)
-            cache[r["cache_key"]] = {
-                "output": r["output"],
-                "error": r["error"],
-                "error_msg": r["error_msg"],
-            }
-            if r["error"]:
-                error_rows.append(r["index"])
-                log_cb(f"[警告] 行 {r['index']} 失败: {r['error_msg']}")
+            if dedup_index is not None:
+                dedup_text = merged_text
+                if extra_cols:
+                    dedup_text = "\n".join([merged_text] + [values[c] for c in extra_cols])
+                rep_idx = dedup_index.find_or_add(idx, dedup_text)
+                if rep_idx is not None:
+                    dup_of[idx] = rep_idx
+                    # 记录代表行的 Excel 行号（表头占第 1 行）
+                    df.at[idx, "AI_DupOf"] = str(rep_idx + 2) if pd.api.types.is_integer(rep_idx) else str(rep_idx)
+                    metrics.inc("rows_total", source="dedup")
+                    done_cnt += 1
+                    progress_cb(done_cnt, total)
+                    continue
+                df.at[idx, "AI_DupOf"] = ""
 
-            done_cnt += 1
+            chunks = [merged_text]
+            if chunking and estimate_tokens(merged_text) > chunk_tokens:
+                chunks = split_chunks(merged_text, chunk_tokens, overlap_tokens)
+                df.at[idx, "AI_Chunks"] = str(len(chunks))
+                chunked_rows += 1
+                chunk_requests += len(chunks)
+            jobs.append({"index": idx, "chunks": chunks, "key": key, "values": values, "text": merged_text})
+        tracer.complete("构建行", "phase", build_started, time.perf_counter(), rows=len(rows), jobs=len(jobs))
+
+        if matcher:
+            log_cb(f"本地规则：{rule_rows} 行由规则直接判定，未调用 API（见 AI_Decided_By 列）")
+            log_cb(f"  各规则命中行数：{'；'.join(matcher.hit_summary())}")
+        if truncated_rows:
+            log_cb(f"预处理：{truncated_rows} 行超出 token 预算已截断（见 AI_Truncated 列）")
+        if dup_of:
+            log_cb(f"近似去重：{len(dup_of)} 行与前面的行近似重复，沿用代表行结果（见 AI_DupOf 列）")
+        if chunked_rows:
+            log_cb(
+                f"分块：{chunked_rows} 行超长，共拆分为 {chunk_requests} 段并发筛选"
+                f"（归并规则: {REDUCERS.get(reducer, reducer)}）"
+            )
+
+        if screen is not None and len(jobs) >= int(screen.cfg["min_rows"]) and not user_stopped:
+            with tracer.span("学习型预筛"):
+                jobs = _run_learned_screen(screen, jobs, submit, collect, results, log_cb, stop_flag)
+            learned_rows = sum(1 for r in results if r.get("learned") is not None)
+            metrics.inc("rows_total", learned_rows, source="learned")
+            done_cnt += learned_rows
             progress_cb(done_cnt, total)
+        elif screen is not None:
+            log_cb(f"学习型预筛：需调用模型的行少于 {screen.cfg['min_rows']} 行，本次不启用")
+
+        if not user_stopped and not stop_flag():
+            with tracer.span("派发与等待模型结果", jobs=len(jobs), max_workers=max_workers):
+                if guard.active:
+                    collect(submit(jobs[:window]), backlog=iter(jobs[window:]))
+                else:
+                    collect(submit(jobs))
     finally:
         # 用户停止时不等待未完成任务，尽快返回；否则正常等待所有任务结束
-        pool.shutdown(wait=not user_stopped)
+        with tracer.span("关闭线程池"):
+            pool.shutdown(wait=not user_stopped)
+        metrics.set("in_flight_requests", 0)
+        metrics.set("job_running", 0)
+        if exporter:
+            try:
+                exporter.stop()
+            except OSError as e:
+                log_cb(f"[警告] 写出运行指标失败: {e}")
+
+    if dup_of:
+        by_index = {r["index"]: r for r in results}
+        for idx, rep_idx in dup_of.items():
+            if rep_idx in by_index:
+                results.append(dict(by_index[rep_idx], index=idx, usage={}, source="dedup"))
+                if by_index[rep_idx]["error"]:
+                    error_rows.append(idx)
 
+    write_started = time.perf_counter()
     for r in results:
         df.at[r["index"], "AI_Output"] = r["output"]
+        if matcher or screen is not None:
+            df.at[r["index"], "AI_Decided_By"] = _decided_by(r)
+        if cascade_cfg["enabled"] and r.get("tier"):
+            df.at[r["index"], "AI_Tier"] = TIERS[r["tier"]]
+        if r.get("votes"):
+            df.at[r["index"], "AI_Votes"] = " / ".join(
+                f"{model.split('/')[-1]}: {v['output'] if not v['error'] else '失败'}" for model, v in r["votes"]
+            )
+            df.at[r["index"], "AI_Agreement"] = "一致" if len(r["votes"]) == 2 else "分歧"
+    tracer.complete("写回结果", "phase", write_started, time.perf_counter(), rows=len(results))
+    if votes:
+        voted = len([r for r in results if r.get("votes")])
+        calls = sum(len(v) for v in votes.values())
+        log_cb(
+            f"多模型投票：{voted} 行中两模型判定一致 {voted - len(disagreed)} 行"
+            f"（一致率 {(voted - len(disagreed)) / max(voted, 1):.1%}），分歧 {len(disagreed)} 行由仲裁模型投票；"
+            f"共调用模型 {calls} 次，约为单模型的 {calls / max(len(votes), 1):.2f} 倍"
+        )
+        if disagreed:
+            rows_text = "、".join(str(i + 2) if pd.api.types.is_integer(i) else str(i) for i in disagreed[:20])
+            log_cb(f"  分歧行（Excel 行号）：{rows_text}{' 等' if len(disagreed) > 20 else ''}（见 AI_Agreement 列）")
+    if escalated:
+        reasons = Counter(escalated.values())
+        log_cb(
+            f"模型级联：{len(escalated)} 行改由强模型作答（"
+            + "；".join(f"{REASONS[k]} {n}" for k, n in reasons.items())
+            + "，见 AI_Tier 列）"
+        )
+    if store:
+        try:
+            with tracer.span("持久缓存写入"):
+                store.put_many(
+                    # 只缓存模型对本行内容的直接作答；规则、分类器与近似重复沿用的结果不是本行指纹的精确答案
+                    (
+                        (fingerprints[r["index"]], r["output"])
+                        for r in results
+                        if not r["error"]
+                        and not r.get("rule")
+                        and r.get("learned") is None
+                        and r.get("source") != "dedup"
+                    ),
+                    source=input_path,
+                    job=job_fp,
+                    model=get_current_model(),
+                    base_url=get_current_base_url(),
+                )
+        except Exception as e:
+            log_cb(f"[警告] 写入持久缓存失败: {e}")
+        finally:
+            store.close()
+    if fields:
+        with tracer.span("结果分列"):
+            df = _with_field_columns(df, fields, out_delimiter)
+        if repaired_rows:
+            log_cb(f"输出校验：{repaired_rows} 行格式不合格，经修复提示重问后通过")
+        summary_index = [r["index"] for r in results] + list(df.index[carried])
+        log_cb("结果摘要：")
+        for line in summarize_fields(df.loc[summary_index, [f"AI_{f['name']}" for f in fields]], fields):
+            log_cb(f"  {line}")
+
+    if row_usage:
+        _assign_columns(
+            df, pd.DataFrame.from_dict(row_usage, orient="index").rename(columns=dict(ROW_COLUMNS, cost=COST_COLUMN))
+        )
+    if options.get("provenance"):
+        sources = _carried_sources(carried, cache_hits)
+        sources.update({r["index"]: result_source(r) for r in results})
+        _assign_columns(df, provenance_frame(sources, row_trace))
+    totals = meter.totals()
+    if totals["prompt_tokens"]:
+        cached = totals["cached_tokens"]
+        log_cb(
+            f"Token 用量：输入 {totals['prompt_tokens']}（其中缓存命中 {cached}，"
+            f"{cached / totals['prompt_tokens']:.0%}），输出 {totals['completion_tokens']}"
+            + (f"，费用约 ¥{totals['cost']:.4f}" if totals["cost"] else "")
+            + f"；平均每行 {(totals['prompt_tokens'] + totals['completion_tokens']) / len(row_usage):.0f} tokens"
+        )
+        if len(meter.by_model) > 1 or meter.pricing:
+            for line in meter.summary_lines():
+                log_cb(f"  {line}")
 
     try:
-        df.to_excel(output_path, index=False)
+        with tracer.span("保存 Excel", rows=len(df)):
+            df.to_excel(output_path, index=False)
         log_cb(f"文件已保存至: {output_path}")
     except Exception as e:
         return False, f"保存文件失败: {e}"
 
     processed_count = len(results)
+    resume = None
     if stop_flag():
-        return False, f"用户中断。处理 {processed_count}/{total} 行。"
+        ok, status = False, f"用户中断。处理 {processed_count}/{total} 行。"
+    elif budget_stopped:
+        # 仍为空或失败占位的行（retry_failures 时未派发的行保留着原来的 FAIL|...），即下次「仅重跑失败行」要处理的行
+        remaining = failed_rows_mask(df.loc[rows.index, "AI_Output"])
+        first = remaining.idxmax() if remaining.any() else budget_stopped[0]
+        resume = {
+            "remaining_rows": int(remaining.sum()),
+            "first_row": first + 2 if pd.api.types.is_integer(first) else str(first),
+            "how": "以本输出文件为输入、运行模式选择「仅重跑失败行」即可继续",
+        }
+        ok, status = False, (
+            f"预算已用完（{guard.report()}）。处理 {total - resume['remaining_rows']}/{total} 行，剩余 {resume['remaining_rows']} 行"
+            f"（从 Excel 第 {resume['first_row']} 行起）未处理或失败；{resume['how']}。"
+        )
+    elif mode == "retry_failures":
+        ok, status = True, f"完成。重跑 {total} 行（共 {len(df)} 行），仍失败 {len(error_rows)} 行。"
+    elif carried.any():
+        ok, status = True, (
+            f"完成。共 {len(df)} 行，沿用已有结果 {int(carried.sum())} 行，"
+            f"新处理 {total} 行，失败 {len(error_rows)} 行。"
+        )
     else:
-        status = f"完成。共 {total} 行，失败 {len(error_rows)} 行。"
-        return True, status
+        ok, status = True, f"完成。共 {total} 行，失败 {len(error_rows)} 行。"
+
+    if meter.by_model:
+        _record_usage(
+            meter,
+            {
+                "status": status,
+                "started_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started_at)),
+                "elapsed_seconds": round(time.time() - started_at, 1),
+                "input": input_path,
+                "output": output_path,
+                "template": options.get("template_name") or "",
+                "model": get_current_model(),
+                "profile": options.get("profile") or "",
+                "rows": len(df),
+                "processed_rows": processed_count,
+                "model_rows": len(row_usage),
+                "failed_rows": len(error_rows),
+                "budget": guard.cfg if guard.active else None,
+                "resume": resume,
+            },
+            output_path,
+            options.get("profile"),
+            log_cb,
+        )
+    return ok, status
@@ -0,0 +1,206 @@
+"""
+并发测速：用当前模板渲染的真实长度 Prompt，按递增的并发级别（1、5、10、20、50…）各发一小批请求
+- 每级统计延迟 p50/p95/p99、吞吐（请求/秒）与失败率；请求只尝试一次，限流等错误不被重试退避掩盖
+- 某一级失败率过高（服务端已明显限流）时不再尝试更高的并发
+- 推荐并发数：失败率与 p95 延迟都在可接受范围内、吞吐接近最高的最小并发级别
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from api import call_model_detailed, prepare_request
+from output_schema import build_request_params, normalize_output_config
+from pilot import probe_options, stratified_sample
+from preprocess import preprocess_values
+from template_engine import TemplateError, compile_template
+from tokens import estimate_tokens
+
+DEFAULT_LEVELS = (1, 5, 10, 20, 50)
+MAX_LEVEL = 100  # 与界面并发线程数上限一致
+SAMPLE_ROWS = 20  # 抽取的真实行数（按文本长度分层），各请求轮流使用
+REQUESTS_PER_WORKER = 2  # 每级请求数 = 并发数 × 该倍数（至少 MIN_REQUESTS）
+MIN_REQUESTS = 10
+MAX_ERROR_RATE = 0.02  # 推荐级别允许的最高失败率
+MAX_P95_GROWTH = 2.0  # 推荐级别的 p95 延迟不超过单并发时的倍数
+ABORT_ERROR_RATE = 0.2  # 失败率超过该值时停止更高级别的测速
+PLATEAU = 0.95  # 吞吐达到最高吞吐的该比例即视为已饱和
+
+
+def parse_levels(text: str) -> List[int]:
+    """解析「1, 5, 10」形式的并发级别（去重、升序、限制在 1..MAX_LEVEL）。"""
+    levels = set()
+    for part in str(text).replace("，", ",").split(","):
+        part = part.strip()
+        if part:
+            levels.add(min(MAX_LEVEL, max(1, int(part))))
+    return sorted(levels)
+
+
+def requests_for_level(level: int) -> int:
+    return max(MIN_REQUESTS, level * REQUESTS_PER_WORKER)
+
+
+def build_probe_prompts(
+    df: pd.DataFrame, cols: List[str], delimiter: str, prompt: str, options: Dict[str, Any], log_cb
+) -> Tuple[List[str], Dict[str, Any]]:
+    """按当前模板与预处理设置渲染抽样行的 Prompt。返回：(Prompt 列表, 请求参数)"""
+    options = options or {}
+    template = compile_template(prompt)
+    all_cols = list(cols) + [c for c in template.columns if c not in cols]
+    output_cfg = normalize_output_config(options.get("output"))
+    template, params = prepare_request(
+        template,
+        build_request_params(output_cfg, delimiter),
+        output_cfg["fields"],
+        delimiter,
+        options.get("shared_prefix"),
+        log_cb,
+    )
+    pre = options.get("preprocess") or {}
+    normalize = bool(pre.get("normalize"))
+    column_budgets = pre.get("column_budgets") or {}
+    row_budget = int(pre.get("row_budget") or 0)
+    preprocessing = normalize or bool(column_budgets) or row_budget > 0
+
+    prompts = []
+    for _, row in stratified_sample(df, list(cols), SAMPLE_ROWS).iterrows():
+        values = {c: str(row[c]) if pd.notna(row[c]) else "" for c in all_cols}
+        if preprocessing:
+            values, _ = preprocess_values(values, cols, normalize, column_budgets, row_budget)
+        prompts.append(template.render("\n".join(values[c] for c in cols), delimiter, values))
+    return prompts, params
+
+
+def measure_level(prompts: List[str], params: Dict[str, Any], level: int, n_requests: int, stop_flag, done_cb) -> Dict:
+    """以 level 个并发发送 n_requests 个请求（轮流使用 prompts），返回该级统计。"""
+
+    def probe(prompt):
+        started = time.perf_counter()
+        resp = call_model_detailed(prompt, max_retries=1, stop_flag=stop_flag, **params)
+        return bool(resp["content"]), time.perf_counter() - started
+
+    latencies, errors = [], 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=level) as pool:
+        futures = [pool.submit(probe, prompts[i % len(prompts)]) for i in range(n_requests)]
+        for future in as_completed(futures):
+            ok, latency = future.result()
+            if ok:
+                latencies.append(latency)
+            else:
+                errors += 1
+            done_cb()
+    wall = time.perf_counter() - started
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (float("nan"),) * 3
+    return {
+        "level": level,
+        "requests": n_requests,
+        "errors": errors,
+        "error_rate": errors / n_requests,
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+        "throughput": len(latencies) / wall if wall > 0 else 0.0,
+    }
+
+
+def recommend_workers(stats: List[Dict]) -> int:
+    """失败率不超过 MAX_ERROR_RATE、p95 不超过单并发 MAX_P95_GROWTH 倍的级别中，吞吐达到最高吞吐 PLATEAU 的最小级别。"""
+    if not stats:
+        return 1
+    baseline = stats[0]["p95"]
+    eligible = [
+        s for s in stats
+        if s["error_rate"] <= MAX_ERROR_RATE
+        and s["throughput"] > 0
+        and (not np.isfinite(baseline) or s["p95"] <= baseline * MAX_P95_GROWTH)
+    ]
+    if not eligible:
+        return 1
+    best = max(s["throughput"] for s in eligible)
+    return min(s["level"] for s in eligible if s["throughput"] >= best * PLATEAU)
+
+
+def format_table(stats: List[Dict]) -> List[str]:
+    """测速结果表（各行文本），最后一列为相对最高吞吐的条形图。"""
+    best = max((s["throughput"] for s in stats), default=0) or 1
+    lines = [f"{'并发':>4} {'请求':>4} {'失败率':>6} {'p50':>7} {'p95':>7} {'p99':>7} {'吞吐/秒':>7}"]
+    for s in stats:
+        bar = "█" * int(round(20 * s["throughput"] / best))
+        lines.append(
+            f"{s['level']:>6} {s['requests']:>6} {s['error_rate']:>8.1%} {s['p50']:>6.2f}s {s['p95']:>6.2f}s "
+            f"{s['p99']:>6.2f}s {s['throughput']:>9.2f} {bar}"
+        )
+    return lines
+
+
+def run_sweep(
+    input_path: str,
+    cols: List[str],
+    delimiter: str,
+    prompt: str,
+    progress_cb,
+    log_cb,
+    stop_flag,
+    levels: List[int] = DEFAULT_LEVELS,
+    options: Dict[str, Any] = None,
+) -> Tuple[bool, str, int]:
+    """对各并发级别测速。返回：(是否成功, 报告, 推荐并发数；失败时为 0)"""
+    try:
+        df = pd.read_excel(input_path)
+    except Exception as e:
+        return False, f"读取 Excel 失败: {e}", 0
+    missing = [c for c in cols if c not in df.columns]
+    if missing:
+        return False, f"所选列不存在: {', '.join(missing)}", 0
+    if df.empty:
+        return False, "输入文件没有数据行", 0
+    try:
+        prompts, params = build_probe_prompts(df, list(cols), delimiter, prompt, probe_options(options), log_cb)
+    except TemplateError as e:
+        return False, f"Prompt 模板有误: {e}", 0
+
+    levels = sorted({min(MAX_LEVEL, max(1, int(level))) for level in levels})
+    total = sum(requests_for_level(level) for level in levels)
+    avg_tokens = np.mean([estimate_tokens(p) for p in prompts])
+    log_cb(
+        f"并发测速：{len(prompts)} 行真实数据渲染的 Prompt（平均约 {avg_tokens:.0f} tokens），"
+        f"并发级别 {', '.join(map(str, levels))}，共 {total} 个请求"
+    )
+
+    stats = []
+    done = 0
+
+    def done_cb():
+        nonlocal done
+        done += 1
+        progress_cb(done, total)
+
+    for level in levels:
+        if stop_flag():
+            break
+        s = measure_level(prompts, params, level, requests_for_level(level), stop_flag, done_cb)
+        stats.append(s)
+        log_cb(
+            f"并发 {level}：p50 {s['p50']:.2f}s，p95 {s['p95']:.2f}s，p99 {s['p99']:.2f}s，"
+            f"吞吐 {s['throughput']:.2f} 请求/秒，失败率 {s['error_rate']:.1%}"
+        )
+        if s["error_rate"] > ABORT_ERROR_RATE:
+            log_cb(f"失败率超过 {ABORT_ERROR_RATE:.0%}（服务端可能已限流），不再测试更高的并发")
+            break
+    if stop_flag():
+        return False, f"用户中断。完成 {done}/{total} 个请求。", 0
+    if not stats or all(s["throughput"] == 0 for s in stats):
+        return False, "测速请求全部失败，请先检查 API 连接", 0
+
+    recommended = recommend_workers(stats)
+    lines = format_table(stats)
+    log_cb("并发测速结果：")
+    for line in lines:
+        log_cb(f"  {line}")
+    lines.append(f"推荐并发线程数：{recommended}（失败率 ≤ {MAX_ERROR_RATE:.0%}、p95 不超过单并发的 {MAX_P95_GROWTH:g} 倍、吞吐接近最高）")
+    log_cb(lines[-1])
+    return True, "\n".join(lines), recommended
@@ -0,0 +1,132 @@
+"""
+任务预算：请求数、token 数与费用上限（0 表示不限）
+- 每个请求提交前检查：已用量（UsageMeter 实测）+ 在途请求的估算量 + 本次的估算量不超过上限，否则停止派发新行；
+  级联升级与投票仲裁的追加请求同样检查
+- 在途请求按 Prompt 长度与输出上限估算，并用已完成请求的实测/估算比例逐步校准
+- 已派发的请求照常处理完；未派发的行、以及追加请求未通过检查的行 AI_Output 留空，
+  之后用「仅重跑失败行」打开输出文件即可从断点继续
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+from tokens import format_tokens
+from usage import UsageMeter, request_cost
+
+DEFAULT_BUDGET = {
+    "max_requests": 0,
+    "max_tokens": 0,
+    "max_cost": 0.0,  # 元；需在价格表中配置所用模型的价格
+}
+
+# 上限项：键为配置值，值为显示名
+LIMITS = {
+    "max_requests": "请求数",
+    "max_tokens": "token 数",
+    "max_cost": "费用",
+}
+
+# 实测请求数达到该值后才用实测/估算比例校准估算
+CALIBRATION_MIN_REQUESTS = 5
+
+
+def normalize_budget(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """补全缺省字段；负数视为不限。"""
+    out = dict(DEFAULT_BUDGET)
+    out.update(cfg or {})
+    out["max_requests"] = max(0, int(out.get("max_requests") or 0))
+    out["max_tokens"] = max(0, int(out.get("max_tokens") or 0))
+    out["max_cost"] = max(0.0, float(out.get("max_cost") or 0))
+    return out
+
+
+def format_limit(key: str, value: float) -> str:
+    if key == "max_cost":
+        return f"¥{value:.2f}"
+    if key == "max_tokens":
+        return format_tokens(value)
+    return str(int(value))
+
+
+class BudgetGuard:
+    """按预算决定是否派发新行（单线程使用：由 run_processing 的派发与结果收集循环调用）。"""
+
+    def __init__(self, cfg: Dict[str, Any], meter: UsageMeter):
+        self.cfg = normalize_budget(cfg)
+        self.meter = meter
+        # 在途请求 -> (未校准的估算 token, 校准后的估算 token, 估算费用)
+        self.in_flight: Dict[Any, Tuple[float, float, float]] = {}
+        self.estimated = 0.0
+        self.actual = 0.0
+        self.calibrated_requests = 0
+        # 触发停止派发的上限项（LIMITS 的键）；未触发时为 None
+        self.exhausted: Optional[str] = None
+
+    @property
+    def active(self) -> bool:
+        return any(self.cfg[k] for k in LIMITS)
+
+    def describe(self) -> str:
+        return "，".join(f"{LIMITS[k]} ≤ {format_limit(k, self.cfg[k])}" for k in LIMITS if self.cfg[k])
+
+    def _scale(self) -> float:
+        if self.calibrated_requests < CALIBRATION_MIN_REQUESTS or self.estimated <= 0:
+            return 1.0
+        return self.actual / self.estimated
+
+    def estimate(self, model: str, prompt_tokens: float, completion_tokens: float) -> Tuple[float, float, float]:
+        """单次请求的估算：(未校准 token, 校准后 token, 费用)。"""
+        scale = self._scale()
+        usage = {"prompt_tokens": prompt_tokens * scale, "completion_tokens": completion_tokens * scale}
+        cost = request_cost(model, usage, self.meter.pricing) or 0.0
+        raw = prompt_tokens + completion_tokens
+        return raw, raw * scale, cost
+
+    def committed(self) -> Dict[str, float]:
+        """已用量 + 在途估算量。"""
+        spent = self.meter.totals()
+        return {
+            "max_requests": spent["requests"] + len(self.in_flight),
+            "max_tokens": spent["prompt_tokens"] + spent["completion_tokens"]
+            + sum(e[1] for e in self.in_flight.values()),
+            "max_cost": spent["cost"] + sum(e[2] for e in self.in_flight.values()),
+        }
+
+    def admit(self, estimates: List[Tuple[float, float, float]]) -> bool:
+        """派发一行（estimates 为该行各请求的估算）前检查预算；超出时记录原因并返回 False。"""
+        if self.exhausted:
+            return False
+        committed = self.committed()
+        need = {
+            "max_requests": committed["max_requests"] + len(estimates),
+            "max_tokens": committed["max_tokens"] + sum(e[1] for e in estimates),
+            "max_cost": committed["max_cost"] + sum(e[2] for e in estimates),
+        }
+        for k in LIMITS:
+            if self.cfg[k] and need[k] > self.cfg[k]:
+                self.exhausted = k
+                return False
+        return True
+
+    def hold(self, key, estimate: Tuple[float, float, float]) -> None:
+        """登记一个在途请求。"""
+        self.in_flight[key] = estimate
+
+    def settle(self, key, usage: Dict[str, int]) -> None:
+        """请求完成：移出在途，并以实测用量校准后续估算（失败请求没有用量，不参与校准）。"""
+        estimate = self.in_flight.pop(key, None)
+        actual = usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0)
+        if estimate and actual:
+            self.estimated += estimate[0]
+            self.actual += actual
+            self.calibrated_requests += 1
+
+    def report(self) -> str:
+        """预算用尽时的说明。"""
+        spent = self.meter.totals()
+        used = {
+            "max_requests": spent["requests"],
+            "max_tokens": spent["prompt_tokens"] + spent["completion_tokens"],
+            "max_cost": spent["cost"],
+        }
+        return "；".join(
+            f"{LIMITS[k]} {format_limit(k, used[k])} / {format_limit(k, self.cfg[k])}" for k in LIMITS if self.cfg[k]
+        )
@@ -0,0 +1,88 @@
+"""
+模型级联（每个模板单独配置）
+- 所有行先交给快速、便宜的模型（当前选择的模型，如 THUDM/GLM-4-9B-0414）
+- 答案不可靠的行（格式不合格、评分接近阈值、字段互相矛盾）在同一线程池中改由强模型重答
+- 输出文件的 AI_Tier 列记录每行由哪一级模型作答
+"""
+import re
+from typing import Any, Dict, List, Optional
+
+from chunking import POSITIVE_VALUES
+from output_schema import validate_output
+
+DEFAULT_CASCADE = {
+    "enabled": False,
+    "strong_model": "deepseek-ai/DeepSeek-V3",  # 与当前模型同一平台（同一 API Key）的强模型
+    "score_threshold": 60,  # 评分（最后一个数值字段）的判定阈值
+    "margin": 10,  # 评分与阈值相差不超过该值视为接近阈值
+}
+
+# 级别：键为内部值，值为 AI_Tier 列的显示名
+TIERS = {
+    "fast": "快速模型",
+    "strong": "强模型",
+}
+
+# 升级原因
+REASONS = {
+    "malformed": "格式不合格或失败",
+    "near_threshold": "评分接近阈值",
+    "conflict": "字段互相矛盾",
+}
+
+_NUMBER_RE = re.compile(r"^-?\d+(?:\.\d+)?$")
+
+
+def normalize_cascade_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """补全缺省字段，返回可直接写入模板 JSON 的级联配置。"""
+    out = dict(DEFAULT_CASCADE)
+    out.update(cfg or {})
+    out["enabled"] = bool(out.get("enabled")) and bool(str(out.get("strong_model") or "").strip())
+    out["strong_model"] = str(out.get("strong_model") or "").strip()
+    out["score_threshold"] = float(out.get("score_threshold") or 0)
+    out["margin"] = max(0.0, float(out.get("margin") or 0))
+    return out
+
+
+def _polarity(value: Any) -> Optional[bool]:
+    """肯定 / 否定取值；无法判断时为 None。"""
+    text = str(value).strip().lower()
+    if text in POSITIVE_VALUES:
+        return True
+    if text in {"否", "不保留", "no", "n", "false", "exclude", "排除", "不纳入"}:
+        return False
+    return None
+
+
+def escalation_reason(
+    result: Dict[str, Any], fields: List[Dict[str, Any]], delimiter: str, cfg: Dict[str, Any]
+) -> Optional[str]:
+    """快速模型的答案需要升级时返回原因（REASONS 的键），否则返回 None。"""
+    if result.get("error"):
+        return "malformed"
+    output = result.get("output", "")
+    if fields:
+        ok, parsed, _ = validate_output(output, fields, "delimited", delimiter)
+        if not ok:
+            return "malformed"
+        score = None
+        for f in reversed(fields):
+            if f.get("type") in ("int", "number") and parsed.get(f["name"]) is not None:
+                score = float(parsed[f["name"]])
+                break
+        polarities = [_polarity(parsed[f["name"]]) for f in fields if f.get("type") == "enum"]
+    else:
+        values = [v.strip() for v in output.split(delimiter)] if delimiter else [output.strip()]
+        numbers = [float(v) for v in values if _NUMBER_RE.match(v)]
+        score = numbers[-1] if numbers else None
+        polarities = [_polarity(v) for v in values]
+    polarities = [p for p in polarities if p is not None]
+
+    threshold = cfg["score_threshold"]
+    if score is not None and abs(score - threshold) <= cfg["margin"]:
+        return "near_threshold"
+    if score is not None:
+        polarities.append(score >= threshold)
+    if len(set(polarities)) > 1:
+        return "conflict"
+    return None
@@ -0,0 +1,125 @@
+"""
+超长行的分块筛选（map-reduce）
+- split_chunks：按 token 预算把 {merged_text} 切成有重叠的若干段
+- 每段作为独立请求进入同一线程池，全部返回后由归并规则合成一行答案
+- 归并规则：max_score（评分最高）、any_yes（任一段判定为是）、majority（逐字段多数）
+"""
+import bisect
+import re
+import statistics
+from collections import Counter
+from typing import Dict, List, Optional
+
+from tokens import cumulative_tokens, snap_to_boundary
+
+DEFAULT_CHUNK_TOKENS = 3000
+DEFAULT_OVERLAP_TOKENS = 200
+
+# 归并规则：键为配置值，值为界面显示名
+REDUCERS = {
+    "any_yes": "任一段为「是」",
+    "max_score": "评分最高",
+    "majority": "逐字段多数",
+}
+DEFAULT_REDUCER = "any_yes"
+
+# 视为「肯定」的字段取值
+POSITIVE_VALUES = {"是", "保留", "yes", "y", "true", "include", "纳入"}
+
+_NUMBER_RE = re.compile(r"^-?\d+(?:\.\d+)?$")
+
+
+def split_chunks(
+    text: str,
+    chunk_tokens: int = DEFAULT_CHUNK_TOKENS,
+    overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+) -> List[str]:
+    """按约 chunk_tokens 个 token 切分文本，相邻两段重叠约 overlap_tokens 个 token。"""
+    if not text:
+        return [text]
+    chunk_tokens = max(1, int(chunk_tokens))
+    overlap_tokens = max(0, min(int(overlap_tokens), chunk_tokens // 2))
+    cum = cumulative_tokens(text)
+    n = len(text)
+    chunks = []
+    start = 0
+    while start < n:
+        end = bisect.bisect_right(cum, cum[start] + chunk_tokens) - 1
+        if end >= n:
+            chunks.append(text[start:])
+            break
+        end = max(start + 1, snap_to_boundary(text, end))
+        chunks.append(text[start:end])
+        # 下一段从距本段末尾约 overlap_tokens 处开始
+        next_start = bisect.bisect_left(cum, cum[end] - overlap_tokens)
+        start = max(start + 1, min(next_start, end))
+    return chunks
+
+
+def _fields(output: str, delimiter: str) -> List[str]:
+    if not delimiter:
+        return [output.strip()]
+    return [f.strip() for f in output.split(delimiter)]
+
+
+def _score(fields: List[str]) -> Optional[float]:
+    """取最后一个数值字段作为评分。"""
+    for f in reversed(fields):
+        if _NUMBER_RE.match(f):
+            return float(f)
+    return None
+
+
+def reduce_outputs(outputs: List[str], delimiter: str, reducer: str = DEFAULT_REDUCER) -> str:
+    """将各分块的分隔答案合成一条。outputs 按分块顺序排列且均已通过校验。"""
+    if len(outputs) == 1:
+        return outputs[0]
+    parsed = [_fields(o, delimiter) for o in outputs]
+
+    if reducer == "max_score":
+        scored = [(s, i) for i, s in enumerate(_score(p) for p in parsed) if s is not None]
+        if scored:
+            return outputs[max(scored, key=lambda t: (t[0], -t[1]))[1]]
+        return outputs[0]
+
+    if reducer == "any_yes":
+        positives = [i for i, p in enumerate(parsed) if p and p[0].lower() in POSITIVE_VALUES]
+        if positives:
+            return outputs[max(positives, key=lambda i: (_score(parsed[i]) or 0, -i))]
+        reducer = "majority"
+
+    # majority：逐字段多数；数值字段取中位数；并列时取靠前分块的取值
+    width = max(len(p) for p in parsed)
+    merged = []
+    for j in range(width):
+        column = [p[j] for p in parsed if j < len(p)]
+        if all(_NUMBER_RE.match(v) for v in column):
+            med = statistics.median(float(v) for v in column)
+            merged.append(str(int(round(med))) if all("." not in v for v in column) else f"{med:g}")
+        else:
+            counts = Counter(column)
+            best = max(counts.values())
+            merged.append(next(v for v in column if counts[v] == best))
+    return (delimiter or "").join(merged)
+
+
+def reduce_chunk_results(parts: List[Dict], delimiter: str, reducer: str = DEFAULT_REDUCER) -> Dict:
+    """
+    合并同一行各分块的 process_row 结果（parts 按分块顺序排列）。
+    全部分块成功时按 reducer 归并；任一分块失败时整行记为失败（失败的分块可能正是决定结果的一段，
+    例如 any_yes 下唯一判「是」的一段），沿用第一个失败分块的错误结果，以便「仅重跑失败行」重新处理。
+    """
+    failed = [(i, p) for i, p in enumerate(parts) if p["error"]]
+    if failed:
+        i, p = failed[0]
+        return dict(
+            p,
+            index=parts[0]["index"],
+            error_msg=f"{p['error_msg']}（分块 {len(failed)}/{len(parts)} 段失败，首个为第 {i + 1} 段）",
+        )
+    return dict(
+        parts[0],
+        output=reduce_outputs([p["output"] for p in parts], delimiter, reducer),
+        error=False,
+        error_msg="",
+    )
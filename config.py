@@ -8,6 +8,8 @@ import logging
 from typing import Dict, Any
 
 CONFIG_PATH = os.path.join(os.path.expanduser("~"), ".autoscreen_config.json")
+# 持久结果缓存（SQLite），按行指纹保存成功的结果，跨任务、跨文件复用
+CACHE_PATH = os.path.join(os.path.expanduser("~"), ".autoscreen_cache.sqlite3")
 
 # 模板目录：放在项目根目录下，随项目一起迁移/备份
 _PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
@@ -47,6 +49,21 @@ def _write_raw_config(data: Dict[str, Any]) -> None:
         logging.error(f"保存配置失败：{e}")
 
 
+def _save_section(name: str, values: Dict[str, Any]) -> None:
+    data = _read_raw_config()
+    data[name] = values
+    _write_raw_config(data)
+
+
+def _load_section(name: str, defaults: Dict[str, Any]) -> Dict[str, Any]:
+    data = _read_raw_config()
+    settings = dict(defaults)
+    stored = data.get(name)
+    if isinstance(stored, dict):
+        settings.update(stored)
+    return settings
+
+
 # === 多 API Profile 支持 ===
 
 def save_api_profile(
@@ -64,11 +81,13 @@ def save_api_profile(
     """
     data = _read_raw_config()
     profiles = data.get("profiles", {})
-    profiles[profile_id] = {
-        "api_key": encode_key(api_key) if api_key else "",
-        "base_url": base_url,
-        "model": model,
-    }
+    # 保留该 profile 的价格表与累计用量等其他字段
+    profiles[profile_id] = dict(
+        profiles.get(profile_id) or {},
+        api_key=encode_key(api_key) if api_key else "",
+        base_url=base_url,
+        model=model,
+    )
     data["profiles"] = profiles
     if set_current:
         data["current_profile"] = profile_id
@@ -169,6 +188,44 @@ def clear_api_profile(profile_id: str) -> None:
         _write_raw_config(data)
 
 
+def save_profile_pricing(profile_id: str, pricing: Dict[str, Any]) -> None:
+    """
+    保存指定 profile 的价格表。
+    - pricing: {模型名: {"input": 价格, "output": 价格, "cached_input": 价格（可选）}}，单位 元 / 百万 tokens
+    """
+    data = _read_raw_config()
+    profiles = data.get("profiles", {})
+    profiles.setdefault(profile_id, {})["pricing"] = pricing
+    data["profiles"] = profiles
+    _write_raw_config(data)
+
+
+def load_profile_pricing(profile_id: str) -> Dict[str, Any]:
+    """读取指定 profile 的价格表，未配置时返回空 dict。"""
+    p = _read_raw_config().get("profiles", {}).get(profile_id) or {}
+    pricing = p.get("pricing")
+    return pricing if isinstance(pricing, dict) else {}
+
+
+def save_profile_usage(profile_id: str, usage: Dict[str, Any]) -> None:
+    """
+    保存指定 profile 的累计用量。
+    - usage: {模型名: {prompt_tokens, completion_tokens, cached_tokens, requests, cost}}
+    """
+    data = _read_raw_config()
+    profiles = data.get("profiles", {})
+    profiles.setdefault(profile_id, {})["usage"] = usage
+    data["profiles"] = profiles
+    _write_raw_config(data)
+
+
+def load_profile_usage(profile_id: str) -> Dict[str, Any]:
+    """读取指定 profile 的累计用量，没有记录时返回空 dict。"""
+    p = _read_raw_config().get("profiles", {}).get(profile_id) or {}
+    usage = p.get("usage")
+    return usage if isinstance(usage, dict) else {}
+
+
 # === 并发设置 ===
 
 DEFAULT_MAX_WORKERS = 20
@@ -194,3 +251,195 @@ def load_max_workers() -> int:
     # 确保返回值在合理范围内
     return max(1, min(100, max_workers))
 
+
+
+# === 输入预处理设置 ===
+
+DEFAULT_PREPROCESS = {
+    "normalize": False,  # 清洗 HTML/空白/版权声明
+    "row_budget": 0,  # 每行 token 上限，0 表示不限
+    "column_budgets": {},  # {列名: token 上限}
+}
+
+
+def save_preprocess_settings(settings: Dict[str, Any]) -> None:
+    """
+    保存输入预处理设置。
+    - settings: normalize / row_budget / column_budgets
+    """
+    _save_section("preprocess", {
+        "normalize": bool(settings.get("normalize", False)),
+        "row_budget": max(0, int(settings.get("row_budget", 0) or 0)),
+        "column_budgets": {
+            str(k): int(v) for k, v in (settings.get("column_budgets") or {}).items() if int(v) > 0
+        },
+    })
+
+
+def load_preprocess_settings() -> Dict[str, Any]:
+    """
+    读取输入预处理设置，缺失字段使用默认值。
+    """
+    return _load_section("preprocess", DEFAULT_PREPROCESS)
+
+
+# === 超长行分块设置 ===
+
+DEFAULT_CHUNKING = {
+    "enabled": False,
+    "chunk_tokens": 3000,  # 每段 token 数，超过该值的行才会分块
+    "overlap_tokens": 200,  # 相邻分块重叠的 token 数
+    "reducer": "any_yes",  # 归并规则：any_yes / max_score / majority
+}
+
+
+def save_chunking_settings(settings: Dict[str, Any]) -> None:
+    """
+    保存超长行分块设置。
+    - settings: enabled / chunk_tokens / overlap_tokens / reducer
+    """
+    _save_section("chunking", {
+        "enabled": bool(settings.get("enabled", False)),
+        "chunk_tokens": max(100, int(settings.get("chunk_tokens") or DEFAULT_CHUNKING["chunk_tokens"])),
+        "overlap_tokens": max(0, int(settings.get("overlap_tokens") or 0)),
+        "reducer": settings.get("reducer") or DEFAULT_CHUNKING["reducer"],
+    })
+
+
+def load_chunking_settings() -> Dict[str, Any]:
+    """
+    读取超长行分块设置，缺失字段使用默认值。
+    """
+    return _load_section("chunking", DEFAULT_CHUNKING)
+
+
+# === 持久结果缓存设置 ===
+
+DEFAULT_CACHE = {
+    "enabled": False,  # 是否按行指纹读写持久缓存
+}
+
+
+def save_cache_settings(settings: Dict[str, Any]) -> None:
+    """
+    保存持久结果缓存设置。
+    - settings: enabled
+    """
+    _save_section("cache", {"enabled": bool(settings.get("enabled", False))})
+
+
+def load_cache_settings() -> Dict[str, Any]:
+    """
+    读取持久结果缓存设置，缺失字段使用默认值。
+    """
+    return _load_section("cache", DEFAULT_CACHE)
+
+
+# === 近似重复行设置 ===
+
+DEFAULT_DEDUP = {
+    "enabled": False,
+    "threshold": 0.9,  # MinHash 相似度阈值（0.5-1.0）
+}
+
+
+def save_dedup_settings(settings: Dict[str, Any]) -> None:
+    """
+    保存近似重复行设置。
+    - settings: enabled / threshold
+    """
+    _save_section("dedup", {
+        "enabled": bool(settings.get("enabled", False)),
+        "threshold": max(0.5, min(1.0, float(settings.get("threshold") or DEFAULT_DEDUP["threshold"]))),
+    })
+
+
+def load_dedup_settings() -> Dict[str, Any]:
+    """
+    读取近似重复行设置，缺失字段使用默认值。
+    """
+    return _load_section("dedup", DEFAULT_DEDUP)
+
+
+# === 学习型预筛设置 ===
+
+DEFAULT_LEARNED = {
+    "enabled": False,
+    "sample_size": 300,  # 首轮随机抽样送模型判定的行数
+    "confidence": 0.95,  # 分类器概率达到该值的行在本地判定
+}
+
+
+def save_learned_settings(settings: Dict[str, Any]) -> None:
+    """
+    保存学习型预筛设置（其余参数使用 learned_screen.DEFAULT_LEARNED 的默认值）。
+    - settings: enabled / sample_size / confidence
+    """
+    _save_section("learned", {
+        "enabled": bool(settings.get("enabled", False)),
+        "sample_size": max(50, int(settings.get("sample_size") or DEFAULT_LEARNED["sample_size"])),
+        "confidence": max(0.5, min(0.999, float(settings.get("confidence") or DEFAULT_LEARNED["confidence"]))),
+    })
+
+
+def load_learned_settings() -> Dict[str, Any]:
+    """
+    读取学习型预筛设置，缺失字段使用默认值。
+    """
+    return _load_section("learned", DEFAULT_LEARNED)
+
+
+# === 任务预算 ===
+
+DEFAULT_BUDGET = {
+    "max_requests": 0,  # 0 表示不限
+    "max_tokens": 0,
+    "max_cost": 0.0,  # 元
+}
+
+
+def save_budget_settings(settings: Dict[str, Any]) -> None:
+    """
+    保存任务预算（每个任务的上限，0 表示不限）。
+    - settings: max_requests / max_tokens / max_cost
+    """
+    _save_section("budget", {
+        "max_requests": max(0, int(settings.get("max_requests") or 0)),
+        "max_tokens": max(0, int(settings.get("max_tokens") or 0)),
+        "max_cost": max(0.0, float(settings.get("max_cost") or 0)),
+    })
+
+
+def load_budget_settings() -> Dict[str, Any]:
+    """
+    读取任务预算，缺失字段使用默认值。
+    """
+    return _load_section("budget", DEFAULT_BUDGET)
+
+
+# === 诊断输出 ===
+
+DEFAULT_DIAGNOSTICS = {
+    "provenance": False,  # 输出文件中写出行明细列（来源、模型、重试、排队与耗时）
+    "metrics": False,  # 运行期间导出任务指标（Prometheus 文本文件与 JSON 快照）
+    "metrics_dir": "",  # 指标文件目录；空表示输出文件所在目录
+    "metrics_interval": 15,  # 指标写出间隔（秒）
+    "trace": False,  # 记录运行时间线，导出 Chrome Trace / Perfetto JSON
+}
+
+
+def save_diagnostics_settings(settings: Dict[str, Any]) -> None:
+    """
+    保存诊断输出设置。
+    - settings: provenance / metrics / metrics_dir / metrics_interval / trace
+    """
+    _save_section(
+        "diagnostics", {k: type(v)(settings.get(k, v) or v) for k, v in DEFAULT_DIAGNOSTICS.items()}
+    )
+
+
+def load_diagnostics_settings() -> Dict[str, Any]:
+    """
+    读取诊断输出设置，缺失字段使用默认值。
+    """
+    return _load_section("diagnostics", DEFAULT_DIAGNOSTICS)
@@ -0,0 +1,92 @@
+"""
+近似重复行检测（MinHash + LSH）
+- 先做归一化：全半角统一、小写、去掉 DOI、标点与空白，只因这些差异不同的记录视为完全重复
+- 再对归一化文本的字符 4-gram 求 MinHash 签名，分段（LSH）找候选，签名一致率达到阈值即判为近似重复
+- 近似重复行沿用同簇代表行（最先出现的一行）的结果，不再调用 API
+"""
+import re
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.9
+NUM_PERM = 64
+BANDS = 16
+SHINGLE = 4
+
+_PRIME = (1 << 31) - 1
+_BASE = 1000003
+_DOI_RE = re.compile(r"(?:https?://(?:dx\.)?doi\.org/|doi:\s*)?\b10\.\d{4,9}/\S+", re.IGNORECASE)
+_NON_WORD_RE = re.compile(r"[\W_]+", re.UNICODE)
+
+_rng = np.random.RandomState(20240607)
+_A = _rng.randint(1, _PRIME, size=NUM_PERM).astype(np.int64)
+_B = _rng.randint(0, _PRIME, size=NUM_PERM).astype(np.int64)
+
+
+def normalize_for_dedup(text: str) -> str:
+    """归一化：NFKC、小写、去除 DOI / 标点 / 空白。"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = _DOI_RE.sub(" ", text)
+    return _NON_WORD_RE.sub("", text)
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    """字符 SHINGLE-gram 的滚动哈希（向量化计算，去重后返回）。"""
+    codes = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32).astype(np.int64)
+    if len(codes) < SHINGLE:
+        h = 0
+        for c in codes:
+            h = (h * _BASE + int(c)) % _PRIME
+        return np.array([h], dtype=np.int64)
+    h = np.zeros(len(codes) - SHINGLE + 1, dtype=np.int64)
+    for k in range(SHINGLE):
+        h = (h * _BASE + codes[k:len(codes) - SHINGLE + 1 + k]) % _PRIME
+    return np.unique(h)
+
+
+def minhash(text: str) -> np.ndarray:
+    """归一化文本的 MinHash 签名（NUM_PERM 个 int64）。"""
+    h = _shingle_hashes(text)
+    return ((_A[:, None] * h[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+class NearDuplicateIndex:
+    """
+    按输入顺序逐行查询 / 登记：
+    find_or_add 返回该行所属簇的代表行号；该行自身成为新代表时返回 None。
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD):
+        self.threshold = threshold
+        self._exact: Dict[str, object] = {}
+        self._signatures: Dict[object, np.ndarray] = {}
+        self._buckets: List[Dict[bytes, List[object]]] = [{} for _ in range(BANDS)]
+        self._rows = NUM_PERM // BANDS
+
+    def find_or_add(self, row_id, text: str) -> Optional[object]:
+        norm = normalize_for_dedup(text)
+        if not norm:
+            return None
+        if norm in self._exact:
+            return self._exact[norm]
+        sig = minhash(norm)
+        keys = [sig[b * self._rows:(b + 1) * self._rows].tobytes() for b in range(BANDS)]
+        best, best_sim = None, self.threshold
+        seen = set()
+        for b, key in enumerate(keys):
+            for cand in self._buckets[b].get(key, ()):
+                if cand in seen:
+                    continue
+                seen.add(cand)
+                sim = float(np.mean(self._signatures[cand] == sig))
+                if sim >= best_sim:
+                    best, best_sim = cand, sim
+        if best is not None:
+            return best
+        self._exact[norm] = row_id
+        self._signatures[row_id] = sig
+        for b, key in enumerate(keys):
+            self._buckets[b].setdefault(key, []).append(row_id)
+        return None
@@ -0,0 +1,71 @@
+"""
+多模型投票（每个模板单独配置）
+- 每行同时发给前两个模型；两者的判定一致时直接合并，不一致（或有一方失败）时才调用第三个模型
+- 判定是否一致只比较枚举字段（评分等数值字段允许不同）；合并按投票规则进行
+- 输出文件的 AI_Votes 列记录各模型的答案，AI_Agreement 列标记一致 / 分歧
+"""
+from typing import Any, Dict, List, Tuple
+
+from chunking import reduce_outputs
+from output_schema import validate_output
+
+DEFAULT_ENSEMBLE = {
+    "enabled": False,
+    # 依次为两个首发模型与仲裁模型（同一平台、同一 API Key）；留空表示当前选择的模型
+    "models": ["", "Qwen/Qwen2.5-72B-Instruct", "deepseek-ai/DeepSeek-V3"],
+    "vote": "majority",
+}
+
+# 投票规则：键为配置值，值为界面显示名（合并方式与分块归并规则相同）
+VOTE_RULES = {
+    "majority": "逐字段多数",
+    "any_yes": "任一模型为「是」",
+    "max_score": "评分最高",
+}
+
+VOTERS = 3
+
+
+def normalize_ensemble_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """补全缺省字段，返回可直接写入模板 JSON 的投票配置。"""
+    out = dict(DEFAULT_ENSEMBLE)
+    out.update(cfg or {})
+    models = [str(m or "").strip() for m in (out.get("models") or [])][:VOTERS]
+    out["models"] = models + [""] * (VOTERS - len(models))
+    out["enabled"] = bool(out.get("enabled"))
+    if out.get("vote") not in VOTE_RULES:
+        out["vote"] = DEFAULT_ENSEMBLE["vote"]
+    return out
+
+
+def vote_key(output: str, fields: List[Dict[str, Any]], delimiter: str) -> Tuple:
+    """比较判定是否一致所用的键：各枚举字段的取值；没有枚举字段时为首个字段。"""
+    if fields:
+        ok, parsed, _ = validate_output(output, fields, "delimited", delimiter)
+        if ok:
+            enums = [str(parsed[f["name"]]) for f in fields if f.get("type") == "enum"]
+            if enums:
+                return tuple(enums)
+    first = output.split(delimiter)[0] if delimiter else output
+    return (first.strip().lower(),)
+
+
+def votes_agree(votes: List[Dict], fields: List[Dict[str, Any]], delimiter: str) -> bool:
+    """各票均成功且判定一致。"""
+    if any(v["error"] for v in votes):
+        return False
+    return len({vote_key(v["output"], fields, delimiter) for v in votes}) == 1
+
+
+def merge_votes(votes: List[Dict], delimiter: str, rule: str) -> Dict:
+    """按投票规则合并各模型的 process_row 结果；全部失败时沿用第一票的错误结果。"""
+    ok = [v for v in votes if not v["error"]]
+    first = votes[0]
+    if not ok:
+        return dict(first, error_msg=f"{first['error_msg']}（{len(votes)} 个模型均失败）")
+    return dict(
+        first,
+        output=reduce_outputs([v["output"] for v in ok], delimiter, rule),
+        error=False,
+        error_msg="",
+    )
@@ -0,0 +1,241 @@
+"""
+A/B 实验：在同一输入上同时比较多个 Prompt 模板和/或模型
+- 输入文件只读取、预处理一次；所有（行 × 变体）请求进入同一个线程池，按行交错提交，各变体进度同步
+- 每个变体写出一列 AI_Output[变体名]；另写「实验统计」工作表：各变体的失败数、判定分布、token 用量、费用与平均耗时，
+  以及变体两两之间的判定一致率
+- 实验只做基本的逐行调用（不分块、不去重、不读写缓存），用于快速比较模板与模型
+"""
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import combinations
+from typing import Any, Dict, List, Tuple
+
+import pandas as pd
+
+from api import get_current_model, prepare_request, process_row
+from ensemble import vote_key
+from output_schema import FALLBACK_DELIMITER, build_request_params, normalize_output_config
+from preprocess import preprocess_values
+from template_engine import TemplateError, compile_template
+from usage import normalize_pricing, request_cost
+
+MAX_VARIANTS = 8
+STATS_SHEET = "实验统计"
+
+
+def build_variants(templates: List[Dict[str, Any]], models: List[str]) -> List[Dict[str, Any]]:
+    """
+    模板 × 模型的全部组合。
+    - templates: [{"name", "content", "delimiter", "output", "shared_prefix"}]（与模板 JSON 相同）
+    - models: 模型名列表，空串表示当前模型；只有一个模型时变体名即模板名
+    """
+    models = models or [""]
+    variants = []
+    for t in templates:
+        for m in models:
+            name = t["name"] if len(models) == 1 else f"{t['name']}@{(m or get_current_model()).split('/')[-1]}"
+            variants.append(dict(t, name=name, model=m))
+    return variants
+
+
+def output_column(name: str) -> str:
+    return f"AI_Output[{name}]"
+
+
+def _agreement_table(keys: Dict[str, Dict[Any, Any]], names: List[str]) -> pd.DataFrame:
+    """变体两两之间的判定一致率（只统计两者都成功的行）。"""
+    table = pd.DataFrame(index=names, columns=names, dtype=object)
+    for a in names:
+        table.loc[a, a] = "100%"
+    for a, b in combinations(names, 2):
+        both = keys[a].keys() & keys[b].keys()
+        rate = sum(keys[a][i] == keys[b][i] for i in both) / len(both) if both else None
+        text = f"{rate:.1%}（{len(both)} 行）" if rate is not None else "-"
+        table.loc[a, b] = table.loc[b, a] = text
+    return table
+
+
+def run_experiment(
+    input_path: str,
+    cols: List[str],
+    variants: List[Dict[str, Any]],
+    output_path: str,
+    progress_cb,
+    log_cb,
+    stop_flag,
+    max_workers: int = 20,
+    options: Dict[str, Any] = None,
+) -> Tuple[bool, str]:
+    """
+    variants: build_variants 的结果；options 目前只使用 preprocess 与 pricing（与 run_processing 相同）。
+    返回：(是否成功, 状态说明)
+    """
+    options = options or {}
+    pricing = normalize_pricing(options.get("pricing"))
+    if not variants:
+        return False, "请至少选择一个变体"
+    if len(variants) > MAX_VARIANTS:
+        return False, f"变体过多（{len(variants)} 个），最多 {MAX_VARIANTS} 个"
+    names = [v["name"] for v in variants]
+    if len(set(names)) != len(names):
+        return False, "变体名称重复"
+
+    try:
+        df = pd.read_excel(input_path)
+    except Exception as e:
+        return False, f"读取 Excel 失败: {e}"
+    missing = [c for c in cols if c not in df.columns]
+    if missing:
+        return False, f"所选列不存在: {', '.join(missing)}"
+
+    # 各变体：编译模板、推算请求参数
+    prepared = []
+    all_cols = list(cols)
+    for v in variants:
+        try:
+            template = compile_template(v.get("content", ""))
+        except TemplateError as e:
+            return False, f"变体「{v['name']}」的 Prompt 模板有误: {e}"
+        missing = [c for c in template.columns if c not in df.columns]
+        if missing:
+            return False, f"变体「{v['name']}」引用的列不存在: {', '.join(missing)}"
+        all_cols += [c for c in template.columns if c not in all_cols]
+        delimiter = v.get("delimiter", "|")
+        output_cfg = normalize_output_config(v.get("output"))
+        fields = output_cfg["fields"]
+        log_cb(f"变体「{v['name']}」：模型 {v.get('model') or get_current_model()}")
+        template, params = prepare_request(
+            template,
+            build_request_params(output_cfg, delimiter),
+            fields,
+            delimiter,
+            v.get("shared_prefix"),
+            lambda msg: log_cb(f"  {msg}"),
+        )
+        if v.get("model"):
+            params = dict(params, model=v["model"])
+        prepared.append({
+            "name": v["name"],
+            "prompt": v.get("content", ""),
+            "template": template,
+            "delimiter": delimiter,
+            "out_delimiter": delimiter or (FALLBACK_DELIMITER if fields else ""),
+            "fields": fields,
+            "output_cfg": output_cfg,
+            "params": params,
+        })
+
+    pre = options.get("preprocess") or {}
+    normalize = bool(pre.get("normalize"))
+    column_budgets = pre.get("column_budgets") or {}
+    row_budget = int(pre.get("row_budget") or 0)
+    preprocessing = normalize or bool(column_budgets) or row_budget > 0
+
+    total = len(df) * len(prepared)
+    log_cb(f"A/B 实验：{len(df)} 行 × {len(prepared)} 个变体 = {total} 个请求，共用一个线程池（并发数: {max_workers}）")
+
+    outputs = {p["name"]: {} for p in prepared}
+    stats = {
+        p["name"]: {"errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "cost": None, "latency": 0.0, "done": 0}
+        for p in prepared
+    }
+    model_of = {p["name"]: p["params"].get("model") or get_current_model() for p in prepared}
+    done_cnt = 0
+    user_stopped = False
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        task_meta = {}
+        for idx, row in df.iterrows():
+            if stop_flag():
+                user_stopped = True
+                break
+            values = {c: str(row[c]) if pd.notna(row[c]) else "" for c in all_cols}
+            if preprocessing:
+                values, _ = preprocess_values(values, cols, normalize, column_budgets, row_budget)
+            merged_text = "\n".join(values[c] for c in cols)
+            # 按行交错提交各变体，使各变体进度同步，实验时长接近最慢的变体
+            for p in prepared:
+                future = pool.submit(
+                    process_row,
+                    idx,
+                    merged_text,
+                    p["delimiter"],
+                    p["template"],
+                    None,
+                    stop_flag,
+                    values,
+                    p["params"],
+                    p["output_cfg"],
+                )
+                task_meta[future] = (idx, p["name"])
+
+        for future in as_completed(task_meta):
+            if stop_flag():
+                user_stopped = True
+                break
+            r = future.result()
+            idx, name = task_meta[future]
+            outputs[name][idx] = r
+            s = stats[name]
+            s["done"] += 1
+            s["errors"] += int(r["error"])
+            s["latency"] += r.get("latency", 0.0)
+            for k in ("prompt_tokens", "completion_tokens"):
+                s[k] += r.get("usage", {}).get(k, 0)
+            cost = request_cost(model_of[name], r.get("usage", {}), pricing)
+            if cost is not None:
+                s["cost"] = (s["cost"] or 0.0) + cost
+            done_cnt += 1
+            progress_cb(done_cnt, total)
+    finally:
+        pool.shutdown(wait=not user_stopped)
+
+    keys = {}
+    summary_rows = []
+    for p in prepared:
+        name = p["name"]
+        results = outputs[name]
+        df[output_column(name)] = pd.Series({idx: r["output"] for idx, r in results.items()}, dtype=object)
+        keys[name] = {
+            idx: vote_key(r["output"], p["fields"], p["out_delimiter"])[0]
+            for idx, r in results.items()
+            if not r["error"]
+        }
+        s = stats[name]
+        dist = Counter(keys[name].values()).most_common(5)
+        summary_rows.append({
+            "变体": name,
+            "模型": model_of[name],
+            "完成行数": s["done"],
+            "失败行数": s["errors"],
+            "判定分布": " / ".join(f"{k}:{n}" for k, n in dist),
+            "输入 tokens": s["prompt_tokens"],
+            "输出 tokens": s["completion_tokens"],
+            "费用(元)": round(s["cost"], 4) if s["cost"] is not None else None,
+            "平均耗时(秒)": round(s["latency"] / s["done"], 3) if s["done"] else None,
+        })
+        log_cb(
+            f"变体「{name}」：完成 {s['done']} 行，失败 {s['errors']} 行；判定分布 "
+            + (summary_rows[-1]["判定分布"] or "-")
+            + f"；平均耗时 {summary_rows[-1]['平均耗时(秒)'] or 0}s"
+            + (f"；费用约 ¥{s['cost']:.4f}" if s["cost"] is not None else "")
+        )
+
+    agreement = _agreement_table(keys, [p["name"] for p in prepared])
+    if len(prepared) > 1:
+        log_cb("变体两两判定一致率：")
+        for a, b in combinations(agreement.index, 2):
+            log_cb(f"  {a} vs {b}：{agreement.loc[a, b]}")
+
+    try:
+        with pd.ExcelWriter(output_path) as writer:
+            df.to_excel(writer, index=False)
+            pd.DataFrame(summary_rows).to_excel(writer, sheet_name=STATS_SHEET, index=False)
+            agreement.to_excel(writer, sheet_name=STATS_SHEET, startrow=len(summary_rows) + 3)
+        log_cb(f"文件已保存至: {output_path}")
+    except Exception as e:
+        return False, f"保存文件失败: {e}"
+
+    if user_stopped or stop_flag():
+        return False, f"用户中断。完成 {done_cnt}/{total} 个请求。"
+    return True, f"实验完成。共 {len(df)} 行 × {len(prepared)} 个变体，结果与一致率见「{STATS_SHEET}」工作表。"
@@ -0,0 +1,49 @@
+"""
+行内容指纹与任务指纹（增量更新用）
+- job_fingerprint：Prompt、分隔符、模型、参与列及影响结果的设置的摘要；任一变化都会使旧结果失效
+- row_fingerprints：以任务指纹为密钥，对各行参与列的文本整列（向量化）求哈希
+- 每次运行把行指纹写入输出文件的 AI_Fingerprint 列，下次增量运行据此判断哪些行是新增或修改的
+"""
+import hashlib
+import json
+from typing import Any, Dict, List
+
+import pandas as pd
+
+FINGERPRINT_COLUMN = "AI_Fingerprint"
+
+
+def job_fingerprint(
+    prompt: str,
+    delimiter: str,
+    model: str,
+    cols: List[str],
+    settings: Dict[str, Any] = None,
+) -> str:
+    """任务指纹（40 位十六进制）。settings 为影响输出的其他设置（预处理、分块、输出字段等）。"""
+    payload = json.dumps(
+        {
+            "prompt": prompt,
+            "delimiter": delimiter,
+            "model": model,
+            "cols": list(cols),
+            "settings": settings or {},
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def row_texts(df: pd.DataFrame, cols: List[str]) -> pd.DataFrame:
+    """与批处理时相同的取值方式：空值为空串，其余转为文本。"""
+    return df[list(cols)].astype(object).where(df[list(cols)].notna(), "").astype(str)
+
+
+def row_fingerprints(df: pd.DataFrame, cols: List[str], job_fp: str) -> pd.Series:
+    """各行的内容指纹（16 位十六进制字符串），同一任务指纹下内容相同的行指纹相同。"""
+    if not cols:
+        return pd.Series(job_fp[:16], index=df.index, dtype=object)
+    hashed = pd.util.hash_pandas_object(row_texts(df, cols), index=False, hash_key=job_fp[:16])
+    return hashed.map("{:016x}".format)
@@ -0,0 +1,141 @@
+"""
+无界面运行：在服务器或定时任务中按已保存的模板与设置处理一个 Excel 文件
+- API、预处理、分块、缓存、去重、学习型预筛、预算与价格表沿用界面保存的本地配置
+- 模板按名称（templates 目录）或 JSON 文件路径指定，包含 Prompt、分隔符、输出字段、规则、级联与投票设置
+- 可导出运行指标（见 metrics），并在本机 HTTP 端口提供 /metrics 供 Prometheus 抓取
+
+示例：
+    python headless.py 输入.xlsx 输出.xlsx --template 论文筛选 --cols 标题 --cols 摘要 --metrics-port 9108
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+from typing import Any, Dict, Tuple
+
+from api import RUN_MODES, restore_client_from_config, run_processing
+from config import (
+    TEMPLATE_DIR,
+    load_budget_settings,
+    load_cache_settings,
+    load_chunking_settings,
+    load_current_profile_id,
+    load_dedup_settings,
+    load_diagnostics_settings,
+    load_learned_settings,
+    load_max_workers,
+    load_preprocess_settings,
+    load_profile_pricing,
+)
+from metrics import DEFAULT_INTERVAL
+
+
+def load_template(name_or_path: str) -> Tuple[Dict[str, Any], str]:
+    """按 JSON 文件路径或模板名称读取模板。返回：(模板数据, 模板名称)"""
+    if os.path.isfile(name_or_path):
+        path = name_or_path
+    else:
+        path = os.path.join(TEMPLATE_DIR, f"{name_or_path}.json")
+        if not os.path.isfile(path) and os.path.isdir(TEMPLATE_DIR):
+            # 文件名与模板名称不一致时按 JSON 内的 name 字段查找
+            for filename in sorted(os.listdir(TEMPLATE_DIR)):
+                if not filename.endswith(".json"):
+                    continue
+                candidate = os.path.join(TEMPLATE_DIR, filename)
+                try:
+                    with open(candidate, "r", encoding="utf-8") as f:
+                        if json.load(f).get("name") == name_or_path:
+                            path = candidate
+                            break
+                except (json.JSONDecodeError, OSError):
+                    continue
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data, data.get("name") or os.path.splitext(os.path.basename(path))[0]
+
+
+def build_options(template: Dict[str, Any], args) -> Dict[str, Any]:
+    """模板设置 + 本地保存的设置 + 命令行参数 -> run_processing 的 options。"""
+    profile = load_current_profile_id("default")
+    diagnostics = load_diagnostics_settings()
+    return {
+        "preprocess": load_preprocess_settings(),
+        "chunking": load_chunking_settings(),
+        "output": template.get("output"),
+        "shared_prefix": bool(template.get("shared_prefix")),
+        "rules": template.get("rules"),
+        "cascade": template.get("cascade"),
+        "ensemble": template.get("ensemble"),
+        "mode": args.mode,
+        "persistent_cache": bool(load_cache_settings().get("enabled")),
+        "dedup": load_dedup_settings(),
+        "learned": load_learned_settings(),
+        "budget": load_budget_settings(),
+        "provenance": bool(args.provenance or diagnostics.get("provenance")),
+        "metrics": {
+            "enabled": bool(args.metrics_dir or args.metrics_port or args.metrics or diagnostics.get("metrics")),
+            "dir": args.metrics_dir or diagnostics.get("metrics_dir") or "",
+            "interval": args.metrics_interval or diagnostics.get("metrics_interval") or DEFAULT_INTERVAL,
+            "port": args.metrics_port,
+        },
+        "trace": bool(args.trace or diagnostics.get("trace")),
+        "profile": profile,
+        "pricing": load_profile_pricing(profile),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="无界面批处理 Excel（沿用界面保存的 API 与各项设置）")
+    parser.add_argument("input", help="输入 Excel 文件")
+    parser.add_argument("output", help="输出 Excel 文件")
+    parser.add_argument("--template", required=True, help="模板名称（templates 目录）或模板 JSON 文件路径")
+    parser.add_argument("--cols", action="append", default=[], help="参与合并的列，可重复指定")
+    parser.add_argument("--workers", type=int, default=0, help="并发线程数（缺省为界面保存的设置）")
+    parser.add_argument("--mode", choices=list(RUN_MODES), default="full", help="运行模式")
+    parser.add_argument("--provenance", action="store_true", help="写出行明细列")
+    parser.add_argument("--trace", action="store_true", help="记录运行时间线（<输出文件名>_trace.json）")
+    parser.add_argument("--metrics", action="store_true", help="导出运行指标（Prometheus 文本文件与 JSON 快照）")
+    parser.add_argument("--metrics-dir", default="", help="指标文件目录（缺省为输出文件所在目录；指定即启用导出）")
+    parser.add_argument("--metrics-interval", type=float, default=0, help=f"指标写出间隔秒数（缺省 {DEFAULT_INTERVAL}）")
+    parser.add_argument("--metrics-port", type=int, default=0, help="在 127.0.0.1 的该端口提供 /metrics（指定即启用导出）")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    try:
+        template, template_name = load_template(args.template)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"读取模板失败: {e}", file=sys.stderr)
+        return 2
+    client, model = restore_client_from_config()
+    if client is None:
+        print("未配置 API Key，请先在界面中保存 API 设置", file=sys.stderr)
+        return 2
+    options = build_options(template, args)
+    options["template_name"] = template_name
+    print(f"模板「{template_name}」，模型 {model}", flush=True)
+    # Ctrl+C 与界面的「停止」相同：不再派发新请求，已有结果照常保存
+    stopped = threading.Event()
+    signal.signal(signal.SIGINT, lambda *_: stopped.set())
+
+    ok, msg = run_processing(
+        args.input,
+        args.cols,
+        template.get("delimiter", ""),
+        args.output,
+        template.get("content", ""),
+        lambda done, total: None,
+        lambda text: print(text, flush=True),
+        stopped.is_set,
+        max_workers=args.workers or load_max_workers(),
+        options=options,
+    )
+    print(msg, flush=True)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
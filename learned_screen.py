@@ -0,0 +1,254 @@
+"""
+本地学习型预筛（主动学习）
+- 先随机抽样一批行交给模型判定，以模型的答案为标签训练本地线性分类器（TF-IDF + 多类逻辑回归，纯 numpy，仅用 CPU）
+- 抽样中留出一部分不参与训练，用于评估分类器与模型答案的一致率；一致率达标时，置信度极高的行直接在本地判定
+- 其余行按置信度从低到高分轮送模型判定并加入训练集，最后一轮后仍不确定的行全部交给模型
+"""
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from output_schema import validate_output
+
+DEFAULT_LEARNED = {
+    "enabled": False,
+    "min_rows": 1000,  # 待处理行数达到该值才启用（行数少时抽样与训练不划算）
+    "sample_size": 300,  # 首轮随机抽样行数
+    "holdout": 0.2,  # 首轮抽样中留作评估、不参与训练的比例
+    "rounds": 2,  # 主动学习轮数（每轮把最不确定的 round_size 行送模型判定后重新训练）
+    "round_size": 200,
+    "confidence": 0.95,  # 分类器概率达到该值的行在本地判定
+    "min_agreement": 0.97,  # 留出集中高置信行与模型答案的一致率低于该值时不在本地判定任何行
+}
+
+MIN_CONFIDENT_HOLDOUT = 10  # 留出集中高置信行少于该数时一致率不可信
+
+_LATIN_RE = re.compile(r"[a-z0-9]+")
+_CJK_RE = re.compile(r"[\u3400-\u9fff]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """特征词：拉丁词及相邻词对、汉字单字及相邻字对。"""
+    text = (text or "").lower()
+    words = _LATIN_RE.findall(text)
+    tokens = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for run in _CJK_RE.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def choose_label_field(fields: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """分类目标：第一个枚举字段；没有枚举字段时为 None（以完整答案为类别）。"""
+    for f in fields or []:
+        if f.get("type") == "enum":
+            return f
+    return None
+
+
+class TfidfVectorizer:
+    """
+    词表只取自训练样本；特征矩阵以 CSR 三元组 (indptr, indices, data) 表示。
+    第 0 列为恒为 1 的偏置特征，保证每行至少有一个非零项。
+    """
+
+    def __init__(self):
+        self.vocab: Dict[str, int] = {}
+        self.idf = np.ones(1)
+
+    def fit(self, token_lists: Sequence[List[str]]) -> "TfidfVectorizer":
+        df = Counter()
+        for tokens in token_lists:
+            df.update(set(tokens))
+        self.vocab = {t: i + 1 for i, t in enumerate(sorted(df))}
+        n = len(token_lists)
+        self.idf = np.ones(len(self.vocab) + 1)
+        for t, i in self.vocab.items():
+            self.idf[i] = np.log((1 + n) / (1 + df[t])) + 1.0
+        return self
+
+    def transform(self, token_lists: Sequence[List[str]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        indptr = [0]
+        indices: List[int] = []
+        data: List[float] = []
+        for tokens in token_lists:
+            counts = Counter(self.vocab[t] for t in tokens if t in self.vocab)
+            cols = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+            vals = (1.0 + np.log(np.fromiter(counts.values(), dtype=float, count=len(counts)))) * self.idf[cols]
+            norm = np.sqrt(np.sum(vals ** 2))
+            if norm > 0:
+                vals = vals / norm
+            indices.append(0)
+            data.append(1.0)
+            indices.extend(cols.tolist())
+            data.extend(vals.tolist())
+            indptr.append(len(indices))
+        return np.asarray(indptr), np.asarray(indices, dtype=np.int64), np.asarray(data)
+
+
+class SoftmaxClassifier:
+    """带 L2 正则的多类逻辑回归（全批量梯度下降 + Adam）。"""
+
+    def __init__(self, l2: float = 1e-4, iterations: int = 300, lr: float = 0.5):
+        self.l2 = l2
+        self.iterations = iterations
+        self.lr = lr
+        self.W = np.zeros((1, 1))
+
+    @staticmethod
+    def _scores(X, W) -> np.ndarray:
+        indptr, indices, data = X
+        return np.add.reduceat(data[:, None] * W[indices], indptr[:-1], axis=0)
+
+    def fit(self, X, y: np.ndarray, n_features: int, n_classes: int) -> "SoftmaxClassifier":
+        indptr, indices, data = X
+        n = len(indptr) - 1
+        rows = np.repeat(np.arange(n), np.diff(indptr))
+        target = np.zeros((n, n_classes))
+        target[np.arange(n), y] = 1.0
+        W = np.zeros((n_features, n_classes))
+        m, v = np.zeros_like(W), np.zeros_like(W)
+        for t in range(1, self.iterations + 1):
+            P = self._softmax(self._scores(X, W))
+            G = (P - target) / n
+            weights = data[:, None] * G[rows]
+            grad = np.stack(
+                [np.bincount(indices, weights=weights[:, k], minlength=n_features) for k in range(n_classes)],
+                axis=1,
+            )
+            grad[1:] += self.l2 * W[1:]
+            m = 0.9 * m + 0.1 * grad
+            v = 0.999 * v + 0.001 * grad ** 2
+            W -= self.lr * (m / (1 - 0.9 ** t)) / (np.sqrt(v / (1 - 0.999 ** t)) + 1e-8)
+        self.W = W
+        return self
+
+    @staticmethod
+    def _softmax(S: np.ndarray) -> np.ndarray:
+        S = S - S.max(axis=1, keepdims=True)
+        E = np.exp(S)
+        return E / E.sum(axis=1, keepdims=True)
+
+    def predict_proba(self, X) -> np.ndarray:
+        return self._softmax(self._scores(X, self.W))
+
+
+class LearnedScreen:
+    """
+    收集模型对各行的答案（add），训练并评估分类器（fit），对其余行给出类别与置信度（predict）。
+    本地判定的行写入该类别在已标注行中最常见的完整答案。
+    """
+
+    def __init__(self, cfg: Dict[str, Any], fields: List[Dict[str, Any]], delimiter: str):
+        self.cfg = dict(DEFAULT_LEARNED, **(cfg or {}))
+        self.fields = fields
+        self.delimiter = delimiter
+        self.label_field = choose_label_field(fields)
+        self._tokens: List[List[str]] = []
+        self._labels: List[str] = []
+        self._outputs: List[str] = []
+        self._holdout: List[bool] = []
+        self.classes: List[str] = []
+        self.vectorizer: Optional[TfidfVectorizer] = None
+        self.model: Optional[SoftmaxClassifier] = None
+        self.report: Dict[str, Any] = {}
+
+    def label_of(self, output: str) -> Optional[str]:
+        """从模型答案中取分类标签；答案不合格时返回 None。"""
+        if not self.fields:
+            return output.strip() or None
+        ok, parsed, _ = validate_output(output, self.fields, "delimited", self.delimiter)
+        if not ok:
+            return None
+        if self.label_field is None:
+            return output.strip()
+        return str(parsed[self.label_field["name"]])
+
+    def add(self, text: str, output: str, holdout: bool = False) -> bool:
+        label = self.label_of(output)
+        if label is None:
+            return False
+        self._tokens.append(tokenize(text))
+        self._labels.append(label)
+        self._outputs.append(output)
+        self._holdout.append(holdout)
+        return True
+
+    @property
+    def labelled(self) -> int:
+        return len(self._labels)
+
+    @property
+    def trusted(self) -> bool:
+        return bool(self.report.get("trusted"))
+
+    def fit(self) -> bool:
+        """用非留出行训练；训练行不足或只有一个类别时返回 False。"""
+        train = [i for i, h in enumerate(self._holdout) if not h]
+        classes = sorted({self._labels[i] for i in train})
+        if len(train) < 20 or len(classes) < 2:
+            self.report = {"trusted": False, "reason": "已标注行过少或模型答案只有一个类别"}
+            return False
+        self.classes = classes
+        class_index = {c: k for k, c in enumerate(classes)}
+        self.vectorizer = TfidfVectorizer().fit([self._tokens[i] for i in train])
+        X = self.vectorizer.transform([self._tokens[i] for i in train])
+        y = np.array([class_index[self._labels[i]] for i in train])
+        self.model = SoftmaxClassifier().fit(X, y, len(self.vectorizer.vocab) + 1, len(classes))
+        self._evaluate(len(train))
+        return True
+
+    def _evaluate(self, n_train: int):
+        held = [i for i, h in enumerate(self._holdout) if h]
+        report = {"train": n_train, "holdout": len(held), "trusted": False}
+        if held:
+            labels, conf = self.predict([self._tokens[i] for i in held], tokenized=True)
+            truth = np.array([self._labels[i] for i in held], dtype=object)
+            agree = labels == truth
+            confident = conf >= self.cfg["confidence"]
+            report["agreement"] = float(agree.mean())
+            report["coverage"] = float(confident.mean())
+            report["confident"] = int(confident.sum())
+            if confident.any():
+                report["confident_agreement"] = float(agree[confident].mean())
+            report["trusted"] = (
+                report["confident"] >= MIN_CONFIDENT_HOLDOUT
+                and report.get("confident_agreement", 0.0) >= self.cfg["min_agreement"]
+            )
+            if not report["trusted"]:
+                report["reason"] = (
+                    f"留出集中高置信行少于 {MIN_CONFIDENT_HOLDOUT} 行"
+                    if report["confident"] < MIN_CONFIDENT_HOLDOUT
+                    else f"高置信行一致率低于 {self.cfg['min_agreement']:.0%}"
+                )
+        else:
+            report["reason"] = "没有留出行，无法评估一致率"
+        self.report = report
+
+    def predict(self, texts: Sequence, tokenized: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 (类别数组, 置信度数组)。"""
+        token_lists = texts if tokenized else [tokenize(t) for t in texts]
+        if not token_lists:
+            return np.array([], dtype=object), np.array([])
+        proba = self.model.predict_proba(self.vectorizer.transform(token_lists))
+        best = proba.argmax(axis=1)
+        return np.array(self.classes, dtype=object)[best], proba[np.arange(len(best)), best]
+
+    def answer_for(self, label: str) -> str:
+        """该类别在已标注行中最常见的完整答案。"""
+        return Counter(o for o, l in zip(self._outputs, self._labels) if l == label).most_common(1)[0][0]
+
+    def report_lines(self) -> List[str]:
+        r = self.report
+        lines = [f"训练 {r.get('train', self.labelled)} 行，留出评估 {r.get('holdout', 0)} 行"]
+        if "agreement" in r:
+            lines.append(
+                f"留出集：整体一致率 {r['agreement']:.1%}；置信度 ≥ {self.cfg['confidence']:.2f} 的行占 "
+                f"{r['coverage']:.1%}（{r['confident']} 行）"
+                + (f"，其一致率 {r['confident_agreement']:.1%}" if "confident_agreement" in r else "")
+            )
+        if not r.get("trusted"):
+            lines.append(f"暂不在本地判定：{r.get('reason', '')}")
+        return lines
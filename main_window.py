@@ -4,6 +4,7 @@
 - API Key 显隐、列全选/取消全选、快捷键与状态提示
 """
 import os
+import re
 import sys
 import json
 import time
@@ -20,6 +21,7 @@ from PyQt5.QtWidgets import (
     QLineEdit,
     QPushButton,
     QTextEdit,
+    QPlainTextEdit,
     QFileDialog,
     QMessageBox,
     QProgressBar,
@@ -32,24 +34,67 @@ from PyQt5.QtWidgets import (
     QScrollArea,
     QSplitter,
     QSpinBox,
+    QDoubleSpinBox,
+    QCheckBox,
+    QComboBox,
     QShortcut,
     QMenu,
+    QDialog,
+    QDialogButtonBox,
 )
 from PyQt5.QtCore import Qt, QEvent, QRect, QPoint, QSettings, QByteArray
 from PyQt5.QtGui import QKeySequence, QCursor
 
 from config import (
     TEMPLATE_DIR,
+    CACHE_PATH,
     load_api_profile,
     load_current_profile_id,
     save_api_profile,
     clear_api_profile,
     load_max_workers,
     save_max_workers,
+    load_preprocess_settings,
+    save_preprocess_settings,
+    load_chunking_settings,
+    save_chunking_settings,
+    load_cache_settings,
+    save_cache_settings,
+    load_dedup_settings,
+    save_dedup_settings,
+    load_learned_settings,
+    save_learned_settings,
+    load_profile_pricing,
+    save_profile_pricing,
+    load_profile_usage,
+    save_profile_usage,
+    load_budget_settings,
+    save_budget_settings,
+    load_diagnostics_settings,
+    save_diagnostics_settings,
 )
-from api import init_client
+from chunking import REDUCERS
+from output_schema import (
+    OUTPUT_FORMATS,
+    estimate_output_tokens,
+    format_fields,
+    normalize_output_config,
+    parse_fields,
+)
+from preprocess import parse_column_budgets, format_column_budgets
+from rules import format_rules, normalize_rules_config, parse_rules
+from cascade import DEFAULT_CASCADE, normalize_cascade_config
+from ensemble import VOTE_RULES, normalize_ensemble_config
+from result_cache import PACK_EXTENSION, ResultCache, export_pack, import_pack, read_pack_manifest
+from api import RUN_MODES, init_client
+from template_engine import TemplateError, compile_template
+from tokens import project_job, format_tokens, format_duration
 from widgets import CustomTitleBar, QEditTextLogger
-from workers import Worker, ApiTestThread
+from workers import Worker, PilotWorker, ExperimentWorker, ConcurrencySweepWorker, ApiTestThread, ColumnStatsThread, CacheImportThread
+from experiment import MAX_VARIANTS, build_variants
+from pilot import DEFAULT_PILOT_ROWS, probe_options
+from benchmark import DEFAULT_LEVELS, parse_levels
+from usage import PRICE_UNIT, format_live, format_pricing, parse_pricing
 
 
 # 布局常量，便于统一调整
@@ -101,6 +146,9 @@ DEFAULT_PROMPT = (
     "{merged_text}"
 )
 
+# 默认模板的输出字段（用于推算 max_tokens，随模板保存）
+DEFAULT_OUTPUT_FIELDS = "是否属于=是/否; 是否保留=保留/不保留; 评分=int:0-100"
+
 
 class MainWindow(QMainWindow):
     def __init__(self):
@@ -125,6 +173,12 @@ class MainWindow(QMainWindow):
 
         self.worker = None
         self.api_test_thread = None
+        self.col_stats_thread = None
+        self.cache_import_thread = None
+        self._retired_threads = []
+        # 列 token 统计：{列名: 平均 token 数}，以及统计时的总行数
+        self._col_token_stats = {}
+        self._col_stats_rows = 0
 
         self.setup_ui()
 
@@ -355,6 +409,9 @@ class MainWindow(QMainWindow):
         if hasattr(self, "api_test_thread") and self.api_test_thread and self.api_test_thread.isRunning():
             self.api_test_thread.terminate()
             self.api_test_thread.wait(1000)
+        if self.col_stats_thread and self.col_stats_thread.isRunning():
+            self.col_stats_thread.terminate()
+            self.col_stats_thread.wait(1000)
         for attr in ("left_panel_animation", "content_animation"):
             if hasattr(self, attr):
                 o = getattr(self, attr, None)
@@ -482,6 +539,19 @@ class MainWindow(QMainWindow):
         self.test_api_btn.clicked.connect(self.test_api)
         api_layout.addWidget(self.test_api_btn)
 
+        self.sweep_btn = QPushButton("并发测速…")
+        self.sweep_btn.setToolTip(
+            "用当前模板与输入文件渲染的真实长度 Prompt，按 1、5、10、20、50 等并发级别各发一小批请求，\n"
+            "统计延迟 p50/p95/p99、吞吐与失败率，并推荐并发线程数（可一键应用）"
+        )
+        self.sweep_btn.clicked.connect(self.start_concurrency_sweep)
+        api_layout.addWidget(self.sweep_btn)
+
+        self.usage_btn = QPushButton("用量与价格…")
+        self.usage_btn.setToolTip("查看当前平台的累计 token 用量与费用，编辑各模型的价格表")
+        self.usage_btn.clicked.connect(self.edit_usage_and_pricing)
+        api_layout.addWidget(self.usage_btn)
+
         self.clear_api_btn = QPushButton("清除保存的 API")
         self.clear_api_btn.setObjectName("DangerBtn")
         self.clear_api_btn.setToolTip("清除当前平台保存的 API Key")
@@ -500,11 +570,45 @@ class MainWindow(QMainWindow):
         self.max_workers_spin.setToolTip("设置同时处理的线程数（1-100），影响处理速度")
         self.max_workers_spin.setMinimumWidth(80)
         self.max_workers_spin.valueChanged.connect(self._on_max_workers_changed)
+        self.max_workers_spin.valueChanged.connect(self._update_token_projection)
         workers_row.addWidget(self.max_workers_spin)
         workers_row.addWidget(QLabel("（建议值：10-30）"))
         workers_row.addStretch()
         api_layout.addLayout(workers_row)
 
+        # 任务预算
+        lbl_budget = QLabel("任务预算（每个任务的上限）")
+        lbl_budget.setObjectName("ApiFieldLabel")
+        api_layout.addWidget(lbl_budget)
+        budget_cfg = load_budget_settings()
+        budget_row = QHBoxLayout()
+        self.budget_requests_spin = QSpinBox()
+        self.budget_requests_spin.setRange(0, 10_000_000)
+        self.budget_requests_spin.setSingleStep(1000)
+        self.budget_requests_spin.setSpecialValueText("请求不限")
+        self.budget_requests_spin.setSuffix(" 次")
+        self.budget_requests_spin.setValue(int(budget_cfg.get("max_requests") or 0))
+        self.budget_requests_spin.setToolTip("最多发送的模型请求数，0 表示不限")
+        self.budget_tokens_spin = QSpinBox()
+        self.budget_tokens_spin.setRange(0, 1_000_000)
+        self.budget_tokens_spin.setSingleStep(10)
+        self.budget_tokens_spin.setSpecialValueText("token 不限")
+        self.budget_tokens_spin.setSuffix(" 万tok")
+        self.budget_tokens_spin.setValue(int(budget_cfg.get("max_tokens") or 0) // 10_000)
+        self.budget_tokens_spin.setToolTip("最多消耗的输入 + 输出 token（单位：万），0 表示不限")
+        self.budget_cost_spin = QDoubleSpinBox()
+        self.budget_cost_spin.setRange(0, 1_000_000)
+        self.budget_cost_spin.setDecimals(2)
+        self.budget_cost_spin.setSingleStep(1)
+        self.budget_cost_spin.setSpecialValueText("费用不限")
+        self.budget_cost_spin.setPrefix("¥")
+        self.budget_cost_spin.setValue(float(budget_cfg.get("max_cost") or 0))
+        self.budget_cost_spin.setToolTip("最多花费的金额（按「用量与价格」中的价格表计算），0 表示不限")
+        for spin in (self.budget_requests_spin, self.budget_tokens_spin, self.budget_cost_spin):
+            spin.valueChanged.connect(self._on_budget_changed)
+            budget_row.addWidget(spin)
+        api_layout.addLayout(budget_row)
+
         api_box.setLayout(api_layout)
         left_content_layout.addWidget(api_box)
 
@@ -540,6 +644,32 @@ class MainWindow(QMainWindow):
         h2.addWidget(self.output_edit)
         h2.addWidget(btn_out)
         file_layout.addLayout(h2)
+        self.provenance_check = QCheckBox("写出行明细列（来源、模型、重试与耗时）")
+        self.provenance_check.setChecked(bool(load_diagnostics_settings().get("provenance")))
+        self.provenance_check.setToolTip(
+            "在输出文件中为每行写出 AI_Source（模型 / 缓存 / 规则等）、AI_Model、AI_Requests、AI_Attempts、\n"
+            "AI_Queue_Wait_s 与 AI_Latency_s 列，便于运行后用 pandas 分析慢行与高开销行"
+        )
+        self.provenance_check.toggled.connect(self._on_diagnostics_changed)
+        file_layout.addWidget(self.provenance_check)
+        self.metrics_check = QCheckBox("导出运行指标（Prometheus / JSON）")
+        self.metrics_check.setChecked(bool(load_diagnostics_settings().get("metrics")))
+        self.metrics_check.setToolTip(
+            "运行期间定期在输出文件旁写出 autoscreen_<输出文件名>.prom 与 .json：\n"
+            "请求、重试、按类别的错误、各来源行数、在途请求、耗时分布与 token 用量，\n"
+            "可由 node_exporter 的 textfile collector 采集（目录与间隔见配置文件 diagnostics 段）"
+        )
+        self.metrics_check.toggled.connect(self._on_diagnostics_changed)
+        file_layout.addWidget(self.metrics_check)
+        self.trace_check = QCheckBox("记录运行时间线（Perfetto / chrome://tracing）")
+        self.trace_check.setChecked(bool(load_diagnostics_settings().get("trace")))
+        self.trace_check.setToolTip(
+            "结束时在输出文件旁写出 <输出文件名>_trace.json：读取、构建行、等待结果、保存 Excel 等阶段，\n"
+            "以及每个工作线程上各行的处理、每次 API 调用与重试等待、排队等待与在途请求数，\n"
+            "用 https://ui.perfetto.dev 或 Chrome 的 chrome://tracing 打开，可看出线程池是否占满、重试是否集中、保存是否卡住"
+        )
+        self.trace_check.toggled.connect(self._on_diagnostics_changed)
+        file_layout.addWidget(self.trace_check)
         file_layout.addWidget(QLabel("参与合并的列"))
         col_header = QHBoxLayout()
         self.col_select_all_btn = QPushButton("全选")
@@ -567,8 +697,185 @@ class MainWindow(QMainWindow):
         self.col_hint.setObjectName("HintLabel")
         self.col_hint.setWordWrap(True)
         file_layout.addWidget(self.col_hint)
+        self.token_estimate_label = QLabel("")
+        self.token_estimate_label.setObjectName("HintLabel")
+        self.token_estimate_label.setWordWrap(True)
+        self.token_estimate_label.setToolTip(
+            "按本地近似分词估算：列后数字为该列平均 token 数；\n"
+            "预估 = 当前模板 + 已选列，耗时按当前并发数粗略推算"
+        )
+        file_layout.addWidget(self.token_estimate_label)
         file_box.setLayout(file_layout)
         left_content_layout.addWidget(file_box)
+
+        # 3) 输入预处理
+        pre_box = QGroupBox("输入预处理")
+        pre_layout = QVBoxLayout()
+        pre_layout.setSpacing(6)
+        pre_cfg = load_preprocess_settings()
+        self.normalize_check = QCheckBox("清洗文本（HTML、多余空白、版权声明）")
+        self.normalize_check.setChecked(bool(pre_cfg.get("normalize")))
+        self.normalize_check.setToolTip("发送前去除 HTML 标签与实体、版权等模板化语句，并压缩空白")
+        self.normalize_check.toggled.connect(self._on_preprocess_changed)
+        pre_layout.addWidget(self.normalize_check)
+        lbl_row_budget = QLabel("每行 token 上限")
+        lbl_row_budget.setObjectName("ApiFieldLabel")
+        pre_layout.addWidget(lbl_row_budget)
+        row_budget_row = QHBoxLayout()
+        self.row_budget_spin = QSpinBox()
+        self.row_budget_spin.setRange(0, 200000)
+        self.row_budget_spin.setSingleStep(100)
+        self.row_budget_spin.setValue(int(pre_cfg.get("row_budget") or 0))
+        self.row_budget_spin.setSpecialValueText("不限")
+        self.row_budget_spin.setToolTip("参与合并的列合计超过该 token 数时截断（短列保留完整，长列按比例截断）")
+        self.row_budget_spin.setMinimumWidth(80)
+        self.row_budget_spin.valueChanged.connect(self._on_preprocess_changed)
+        row_budget_row.addWidget(self.row_budget_spin)
+        row_budget_row.addWidget(QLabel("（0 = 不限）"))
+        row_budget_row.addStretch()
+        pre_layout.addLayout(row_budget_row)
+        lbl_col_budget = QLabel("单列 token 上限")
+        lbl_col_budget.setObjectName("ApiFieldLabel")
+        pre_layout.addWidget(lbl_col_budget)
+        self.col_budget_edit = QLineEdit(format_column_budgets(pre_cfg.get("column_budgets")))
+        self.col_budget_edit.setPlaceholderText("如 摘要=800, 标题=100")
+        self.col_budget_edit.setToolTip("按列设置 token 上限，多个用逗号分隔；被截断的行会在 AI_Truncated 列中标记")
+        self.col_budget_edit.setMinimumHeight(24)
+        self.col_budget_edit.editingFinished.connect(self._on_preprocess_changed)
+        pre_layout.addWidget(self.col_budget_edit)
+
+        chunk_cfg = load_chunking_settings()
+        self._chunk_overlap_tokens = int(chunk_cfg.get("overlap_tokens") or 0)
+        self.chunk_check = QCheckBox("超长行分块筛选")
+        self.chunk_check.setChecked(bool(chunk_cfg.get("enabled")))
+        self.chunk_check.setToolTip(
+            "截断后仍超过分块大小的行，切成有重叠的多段并发筛选，再按归并规则合成一个答案"
+        )
+        self.chunk_check.toggled.connect(self._on_chunking_changed)
+        pre_layout.addWidget(self.chunk_check)
+        chunk_row = QHBoxLayout()
+        self.chunk_tokens_spin = QSpinBox()
+        self.chunk_tokens_spin.setRange(100, 200000)
+        self.chunk_tokens_spin.setSingleStep(500)
+        self.chunk_tokens_spin.setValue(int(chunk_cfg.get("chunk_tokens") or 3000))
+        self.chunk_tokens_spin.setSuffix(" tok/段")
+        self.chunk_tokens_spin.setToolTip("{merged_text} 超过该 token 数的行才会分块，每段约为该大小")
+        self.chunk_tokens_spin.valueChanged.connect(self._on_chunking_changed)
+        self.chunk_reducer_combo = QComboBox()
+        for key, label in REDUCERS.items():
+            self.chunk_reducer_combo.addItem(label, key)
+        idx = self.chunk_reducer_combo.findData(chunk_cfg.get("reducer"))
+        self.chunk_reducer_combo.setCurrentIndex(max(0, idx))
+        self.chunk_reducer_combo.setToolTip(
+            "任一段为「是」：任一段首字段为 是/保留 即采用该段答案（多段时取评分最高）\n"
+            "评分最高：采用评分（最后一个数值字段）最高的一段\n"
+            "逐字段多数：每个字段取多数值，数值字段取中位数"
+        )
+        self.chunk_reducer_combo.currentIndexChanged.connect(self._on_chunking_changed)
+        chunk_row.addWidget(self.chunk_tokens_spin)
+        chunk_row.addWidget(self.chunk_reducer_combo, 1)
+        pre_layout.addLayout(chunk_row)
+
+        dedup_cfg = load_dedup_settings()
+        dedup_row = QHBoxLayout()
+        self.dedup_check = QCheckBox("近似重复行复用结果")
+        self.dedup_check.setChecked(bool(dedup_cfg.get("enabled")))
+        self.dedup_check.setToolTip(
+            "合并后的文本仅在空白、标点、大小写或 DOI 上不同，或 MinHash 相似度达到阈值的行，\n"
+            "沿用最先出现的同簇代表行的结果，不再调用 API；AI_DupOf 列记录代表行的 Excel 行号"
+        )
+        self.dedup_check.toggled.connect(self._on_dedup_changed)
+        self.dedup_threshold_spin = QDoubleSpinBox()
+        self.dedup_threshold_spin.setRange(0.5, 1.0)
+        self.dedup_threshold_spin.setSingleStep(0.01)
+        self.dedup_threshold_spin.setDecimals(2)
+        self.dedup_threshold_spin.setValue(float(dedup_cfg.get("threshold") or 0.9))
+        self.dedup_threshold_spin.setToolTip("相似度阈值：越高越严格，1.00 表示只合并归一化后完全相同的行")
+        self.dedup_threshold_spin.valueChanged.connect(self._on_dedup_changed)
+        dedup_row.addWidget(self.dedup_check)
+        dedup_row.addStretch()
+        dedup_row.addWidget(self.dedup_threshold_spin)
+        pre_layout.addLayout(dedup_row)
+
+        learned_cfg = load_learned_settings()
+        learned_row = QHBoxLayout()
+        self.learned_check = QCheckBox("学习型预筛")
+        self.learned_check.setChecked(bool(learned_cfg.get("enabled")))
+        self.learned_check.setToolTip(
+            "需调用模型的行不少于 1000 行时：先随机抽样送模型判定，用其答案训练本地 TF-IDF 分类器，\n"
+            "抽样中留出的行上一致率达标后，分类器置信度高的行直接在本地判定，其余行分轮送模型；\n"
+            "AI_Decided_By 列记录每行由分类器（附置信度）还是模型判定"
+        )
+        self.learned_check.toggled.connect(self._on_learned_changed)
+        self.learned_sample_spin = QSpinBox()
+        self.learned_sample_spin.setRange(50, 5000)
+        self.learned_sample_spin.setSingleStep(50)
+        self.learned_sample_spin.setValue(int(learned_cfg.get("sample_size") or 300))
+        self.learned_sample_spin.setSuffix(" 行抽样")
+        self.learned_sample_spin.setToolTip("首轮随机抽样送模型判定的行数（其中 20% 留作评估）")
+        self.learned_sample_spin.valueChanged.connect(self._on_learned_changed)
+        self.learned_conf_spin = QDoubleSpinBox()
+        self.learned_conf_spin.setRange(0.5, 0.999)
+        self.learned_conf_spin.setSingleStep(0.01)
+        self.learned_conf_spin.setDecimals(3)
+        self.learned_conf_spin.setValue(float(learned_cfg.get("confidence") or 0.95))
+        self.learned_conf_spin.setToolTip("分类器概率达到该值的行在本地判定；越高越保守")
+        self.learned_conf_spin.valueChanged.connect(self._on_learned_changed)
+        learned_row.addWidget(self.learned_check)
+        learned_row.addStretch()
+        learned_row.addWidget(self.learned_sample_spin)
+        learned_row.addWidget(self.learned_conf_spin)
+        pre_layout.addLayout(learned_row)
+        pre_box.setLayout(pre_layout)
+        left_content_layout.addWidget(pre_box)
+
+        # 4) 结果缓存
+        cache_box = QGroupBox("结果缓存")
+        cache_layout = QVBoxLayout()
+        cache_layout.setSpacing(6)
+        self.cache_check = QCheckBox("持久缓存（按行指纹复用历史结果）")
+        self.cache_check.setChecked(bool(load_cache_settings().get("enabled")))
+        self.cache_check.setToolTip(
+            "成功的结果按行指纹（参与列内容 + Prompt、模型与相关设置）保存在本地，\n"
+            "之后任何任务遇到相同的行都直接沿用，不再调用 API"
+        )
+        self.cache_check.toggled.connect(self._on_cache_changed)
+        cache_layout.addWidget(self.cache_check)
+        cache_row = QHBoxLayout()
+        self.cache_import_btn = QPushButton("导入结果…")
+        self.cache_import_btn.setObjectName("SmallBtn")
+        self.cache_import_btn.setToolTip(
+            "把已有输出文件（输入列 + AI_Output）按当前 Prompt、模型与已选列导入缓存，\n"
+            "同事的运行结果或旧版本的输出可直接复用"
+        )
+        self.cache_import_btn.clicked.connect(self.import_cache_results)
+        self.cache_clear_btn = QPushButton("清空")
+        self.cache_clear_btn.setObjectName("SmallBtn")
+        self.cache_clear_btn.setToolTip("删除本地缓存的全部结果")
+        self.cache_clear_btn.clicked.connect(self.clear_cache_results)
+        self.cache_count_label = QLabel("")
+        self.cache_count_label.setObjectName("CountLabel")
+        cache_row.addWidget(self.cache_import_btn)
+        cache_row.addWidget(self.cache_clear_btn)
+        cache_row.addStretch()
+        cache_row.addWidget(self.cache_count_label)
+        cache_layout.addLayout(cache_row)
+        pack_row = QHBoxLayout()
+        self.pack_export_btn = QPushButton("导出缓存包…")
+        self.pack_export_btn.setObjectName("SmallBtn")
+        self.pack_export_btn.setToolTip("将缓存导出为单个压缩文件（附模型、base_url 与 Prompt 指纹清单），可拷贝给同事")
+        self.pack_export_btn.clicked.connect(self.export_cache_pack)
+        self.pack_import_btn = QPushButton("导入缓存包…")
+        self.pack_import_btn.setObjectName("SmallBtn")
+        self.pack_import_btn.setToolTip("合并导入他人导出的缓存包；与本地结果不同的条目计为冲突，保留本地结果")
+        self.pack_import_btn.clicked.connect(self.import_cache_pack)
+        pack_row.addWidget(self.pack_export_btn)
+        pack_row.addWidget(self.pack_import_btn)
+        pack_row.addStretch()
+        cache_layout.addLayout(pack_row)
+        cache_box.setLayout(cache_layout)
+        left_content_layout.addWidget(cache_box)
+        self._update_cache_count()
         left_content_layout.addStretch()
         left_scroll.setWidget(self.left_content)
         left_layout.addWidget(left_scroll, 1)  # 滚动区占满剩余空间
@@ -590,7 +897,7 @@ class MainWindow(QMainWindow):
         p_layout.setSpacing(8)
         prompt_header = QHBoxLayout()
         prompt_header.addWidget(
-            QLabel("Prompt 模板（占位符: {merged_text}、{delimiter}[可选]）")
+            QLabel("Prompt 模板（占位符: {merged_text}、{col:列名}、{delimiter}[可选]）")
         )
         prompt_header.addStretch()
         prompt_header.addWidget(QLabel("输出分隔符"))
@@ -598,7 +905,17 @@ class MainWindow(QMainWindow):
         self.delim_edit.setFixedWidth(48)
         self.delim_edit.setAlignment(Qt.AlignCenter)
         self.delim_edit.setToolTip("AI 返回字段间的分隔符（可选），如 | 或 \\t。留空表示不使用分隔符")
+        self.delim_edit.textChanged.connect(self._update_token_projection)
+        self.delim_edit.textChanged.connect(self._update_output_limit_hint)
         prompt_header.addWidget(self.delim_edit)
+        self.shared_prefix_check = QCheckBox("共享前缀")
+        self.shared_prefix_check.setChecked(True)
+        self.shared_prefix_check.setToolTip(
+            "将模板开头与行无关的说明部分作为 system 消息单独发送，行数据放在最后；\n"
+            "支持 Prompt 缓存的服务可复用相同前缀，降低每行首字延迟与计费输入 token\n"
+            "（建议把 {merged_text} / {col:列名} 放在模板末尾）"
+        )
+        prompt_header.addWidget(self.shared_prefix_check)
         p_layout.addLayout(prompt_header)
 
         template_header = QHBoxLayout()
@@ -631,14 +948,131 @@ class MainWindow(QMainWindow):
         p_layout.addLayout(template_header)
         self.refresh_template_list()
 
+        output_header = QHBoxLayout()
+        output_header.addWidget(QLabel("输出字段"))
+        self.output_fields_edit = QLineEdit(DEFAULT_OUTPUT_FIELDS)
+        self.output_fields_edit.setPlaceholderText("如 是否属于=是/否; 评分=int:0-100; 理由=text:60")
+        self.output_fields_edit.setToolTip(
+            "声明期望输出的字段（随模板保存），用于推算输出长度上限：\n"
+            "名称=值1/值2 为枚举，名称=int:0-100 为整数，名称=number 为数值，名称=text:60 为约 60 token 的短文本\n"
+            "声明字段后会逐行校验输出，并写入 AI_<字段名> 列"
+        )
+        self.output_fields_edit.textChanged.connect(self._update_output_limit_hint)
+        output_header.addWidget(self.output_fields_edit, 1)
+        self.output_format_combo = QComboBox()
+        for key, label in OUTPUT_FORMATS.items():
+            self.output_format_combo.addItem(label, key)
+        self.output_format_combo.setToolTip(
+            "分隔符单行：按分隔符拆分字段\n"
+            "JSON 结构化：以 response_format 约束模型输出 JSON 对象（接口不支持时自动降级）"
+        )
+        self.output_format_combo.currentIndexChanged.connect(self._update_output_limit_hint)
+        output_header.addWidget(self.output_format_combo)
+        self.repair_output_check = QCheckBox("校验修复")
+        self.repair_output_check.setChecked(True)
+        self.repair_output_check.setToolTip(
+            "输出不符合字段定义时，只发送不合格输出与格式要求让模型改写一次，而非整行重试"
+        )
+        output_header.addWidget(self.repair_output_check)
+        self.limit_output_check = QCheckBox("限制输出长度")
+        self.limit_output_check.setChecked(True)
+        self.limit_output_check.setToolTip(
+            "按输出字段推算 max_tokens，并在换行处停止，防止模型输出多余解释\n"
+            "使用会先输出推理过程的模型时请关闭"
+        )
+        self.limit_output_check.toggled.connect(self._update_output_limit_hint)
+        output_header.addWidget(self.limit_output_check)
+        self.max_tokens_spin = QSpinBox()
+        self.max_tokens_spin.setRange(0, 32000)
+        self.max_tokens_spin.setSpecialValueText("自动")
+        self.max_tokens_spin.setToolTip("max_tokens 上限；「自动」表示按输出字段推算")
+        self.max_tokens_spin.setMinimumWidth(72)
+        self.max_tokens_spin.valueChanged.connect(self._update_output_limit_hint)
+        output_header.addWidget(self.max_tokens_spin)
+        self.output_limit_label = QLabel("")
+        self.output_limit_label.setObjectName("HintLabel")
+        output_header.addWidget(self.output_limit_label)
+        p_layout.addLayout(output_header)
+
+        rules_header = QHBoxLayout()
+        self.rules_check = QCheckBox("本地规则预筛")
+        self.rules_check.setToolTip(
+            "命中规则的行直接写入规则给定的输出，不调用 API（随模板保存）\n"
+            "每行一条：名称: 关键词1, 关键词2 => 输出；/.../ 表示正则；关键词不区分大小写，靠前的规则优先"
+        )
+        rules_header.addWidget(self.rules_check)
+        rules_header.addStretch()
+        p_layout.addLayout(rules_header)
+        self.rules_edit = QPlainTextEdit()
+        self.rules_edit.setPlaceholderText(
+            "综述: systematic review, meta-analysis, 综述 => 否|不保留|0\n"
+            "动物实验: /\\b(mice|rats?)\\b/, 小鼠, 大鼠 => 否|不保留|0"
+        )
+        self.rules_edit.setMaximumHeight(64)
+        self.rules_edit.setEnabled(False)
+        self.rules_check.toggled.connect(self.rules_edit.setEnabled)
+        p_layout.addWidget(self.rules_edit)
+
+        cascade_row = QHBoxLayout()
+        self.cascade_check = QCheckBox("模型级联")
+        self.cascade_check.setToolTip(
+            "所有行先由当前（快速）模型作答；格式不合格、评分接近阈值或字段互相矛盾的行\n"
+            "在同一线程池中改由右侧的强模型重答（同一平台与 API Key），AI_Tier 列记录作答级别（随模板保存）"
+        )
+        cascade_row.addWidget(self.cascade_check)
+        self.cascade_model_edit = QLineEdit()
+        self.cascade_model_edit.setPlaceholderText(f"强模型，如 {DEFAULT_CASCADE['strong_model']}")
+        cascade_row.addWidget(self.cascade_model_edit, 1)
+        self.cascade_threshold_spin = QSpinBox()
+        self.cascade_threshold_spin.setRange(0, 1000)
+        self.cascade_threshold_spin.setPrefix("阈值 ")
+        self.cascade_threshold_spin.setToolTip("评分（最后一个数值字段）的判定阈值")
+        cascade_row.addWidget(self.cascade_threshold_spin)
+        self.cascade_margin_spin = QSpinBox()
+        self.cascade_margin_spin.setRange(0, 1000)
+        self.cascade_margin_spin.setPrefix("± ")
+        self.cascade_margin_spin.setToolTip("评分与阈值相差不超过该值时视为不可靠，交给强模型")
+        cascade_row.addWidget(self.cascade_margin_spin)
+        p_layout.addLayout(cascade_row)
+        self._apply_cascade_config({})
+
+        ensemble_row = QHBoxLayout()
+        self.ensemble_check = QCheckBox("多模型投票")
+        self.ensemble_check.setToolTip(
+            "每行同时发给前两个模型，判定（枚举字段）不一致时才调用第三个模型仲裁，按投票规则合并；\n"
+            "AI_Votes 列记录各模型答案，AI_Agreement 列标记一致 / 分歧（随模板保存；启用时模型级联不生效）"
+        )
+        ensemble_row.addWidget(self.ensemble_check)
+        self.ensemble_models_edit = QLineEdit()
+        self.ensemble_models_edit.setPlaceholderText("模型A, 模型B, 仲裁模型（留空表示当前模型）")
+        self.ensemble_models_edit.setToolTip("三个模型名以逗号分隔，需在同一平台、使用同一 API Key；某项留空表示当前模型")
+        ensemble_row.addWidget(self.ensemble_models_edit, 1)
+        self.ensemble_vote_combo = QComboBox()
+        for key, label in VOTE_RULES.items():
+            self.ensemble_vote_combo.addItem(label, key)
+        self.ensemble_vote_combo.setToolTip(
+            "逐字段多数：每个字段取多数值，数值字段取中位数\n"
+            "任一模型为「是」：任一模型首字段为 是/保留 即采用其答案\n"
+            "评分最高：采用评分（最后一个数值字段）最高的答案"
+        )
+        ensemble_row.addWidget(self.ensemble_vote_combo)
+        p_layout.addLayout(ensemble_row)
+        self._apply_ensemble_config({})
+
         self.prompt_edit = QTextEdit()
         self.prompt_edit.setPlaceholderText("在此输入你的 Prompt...")
         self.prompt_edit.setToolTip(
-            "输入 AI Prompt 模板\n使用 {merged_text} 占位符表示合并后的列内容\n使用 {delimiter} 占位符表示输出分隔符（可选）"
+            "输入 AI Prompt 模板\n"
+            "使用 {merged_text} 占位符表示合并后的列内容\n"
+            "使用 {col:列名} 引用单列，可加过滤器，如 {col:摘要|truncate:1500}、{col:关键词|default:无}\n"
+            "使用 {#col:列名}...{/col:列名} 表示该列非空时才输出的段落（{^col:列名} 为空时输出）\n"
+            "使用 {delimiter} 占位符表示输出分隔符（可选）"
         )
         self.prompt_edit.setMinimumHeight(100)
         self.prompt_edit.setPlainText(DEFAULT_PROMPT)
+        self.prompt_edit.textChanged.connect(self._update_token_projection)
         p_layout.addWidget(self.prompt_edit)
+        self._update_output_limit_hint()
 
         log_tab = QWidget()
         l_layout = QVBoxLayout(log_tab)
@@ -669,6 +1103,10 @@ class MainWindow(QMainWindow):
         self.status_label.setToolTip("当前状态与下一步提示")
         info_layout.addWidget(self.status_label)
         info_layout.addStretch()
+        self.usage_label = QLabel("")
+        self.usage_label.setStyleSheet(f"font-family: 'Fira Code', 'Consolas', monospace; font-size: {fs9}px; color: #64748b;")
+        self.usage_label.setToolTip("本次任务的请求数、token 用量与费用（在「用量与价格」中配置价格后显示费用）")
+        info_layout.addWidget(self.usage_label)
         self.eta_label = QLabel("\u2014\u2014:\u2014\u2014")  # --:--
         self.eta_label.setStyleSheet(f"font-family: 'Fira Code', 'Consolas', monospace; font-size: {fs9}px; color: #64748b; min-width: 72px;")
         self.eta_label.setAlignment(Qt.AlignRight | Qt.AlignVCenter)
@@ -687,6 +1125,18 @@ class MainWindow(QMainWindow):
 
         btn_layout = QHBoxLayout()
         btn_layout.setSpacing(8)
+        self.run_mode_combo = QComboBox()
+        for key, label in RUN_MODES.items():
+            self.run_mode_combo.addItem(label, key)
+        self.run_mode_combo.setFixedHeight(30)
+        self.run_mode_combo.setToolTip(
+            "全部处理：处理输入文件的所有行\n"
+            "仅重跑失败行：输入选择之前的输出文件，只重新处理 AI_Output 为空或 FAIL 的行，\n"
+            "其余行原样保留（输出路径可与输入相同，即原地修补）\n"
+            "增量更新：输入选择新版数据表，与输出路径处上次的结果按行指纹比对，\n"
+            "只处理新增或内容变化的行，其余行沿用上次结果"
+        )
+        btn_layout.addWidget(self.run_mode_combo)
         self.start_btn = QPushButton("开始批量处理")
         self.start_btn.setObjectName("SuccessBtn")
         self.start_btn.setFixedHeight(30)
@@ -698,6 +1148,22 @@ class MainWindow(QMainWindow):
         self.stop_btn.setEnabled(False)
         self.stop_btn.setToolTip("停止当前任务")
         self.stop_btn.clicked.connect(self.stop_processing)
+        self.pilot_btn = QPushButton("试运行…")
+        self.pilot_btn.setFixedHeight(30)
+        self.pilot_btn.setToolTip(
+            "按文本长度分层随机抽取少量行，用当前模板与设置真实运行一遍：\n"
+            "报告成功率、格式错误率、延迟 p50/p95、每行 token，并推算全量耗时与 token 总量（不写输出文件）"
+        )
+        self.pilot_btn.clicked.connect(self.start_pilot)
+        btn_layout.addWidget(self.pilot_btn)
+        self.experiment_btn = QPushButton("A/B 实验…")
+        self.experiment_btn.setFixedHeight(30)
+        self.experiment_btn.setToolTip(
+            "选择多个已保存模板和/或模型，在同一输入上一次性并行比较：\n"
+            "每个变体输出一列，另附各变体统计与两两判定一致率"
+        )
+        self.experiment_btn.clicked.connect(self.start_experiment)
+        btn_layout.addWidget(self.experiment_btn)
         btn_layout.addWidget(self.start_btn)
         btn_layout.addWidget(self.stop_btn)
         c_layout.addLayout(btn_layout)
@@ -746,15 +1212,100 @@ class MainWindow(QMainWindow):
                 it.setCheckState(Qt.Unchecked)
         self._on_col_selection_changed()
 
+    def _selected_columns(self):
+        """返回已勾选的列名（列名存于 UserRole，显示文字可能附带 token 估算）。"""
+        cols = []
+        for i in range(self.col_list.count()):
+            item = self.col_list.item(i)
+            if item and item.checkState() == Qt.Checked:
+                cols.append(item.data(Qt.UserRole) or item.text())
+        return cols
+
     def _on_col_selection_changed(self):
-        n = sum(
-            1
-            for i in range(self.col_list.count())
-            if self.col_list.item(i) and self.col_list.item(i).checkState() == Qt.Checked
-        )
+        n = len(self._selected_columns())
         self.col_count_label.setText(f"已选 {n} 列")
         if hasattr(self, "col_hint") and self.col_list.count() > 0:
             self.col_hint.setText("勾选需要参与合并并发送给 AI 的列")
+        self._update_token_projection()
+
+    def _start_column_stats(self, path):
+        """后台统计每列平均 token 数，完成后刷新列表显示。"""
+        if self.col_stats_thread and self.col_stats_thread.isRunning():
+            # 旧统计仍在运行：保留引用直至结束，其结果会因路径不符被丢弃
+            self._retired_threads.append(self.col_stats_thread)
+        self._retired_threads = [t for t in self._retired_threads if t.isRunning()]
+        self._col_token_stats = {}
+        self._col_stats_rows = 0
+        self.token_estimate_label.setText("正在估算各列 token 数...")
+        self.col_stats_thread = ColumnStatsThread(path)
+        self.col_stats_thread.finished.connect(self._on_column_stats_finished)
+        self.col_stats_thread.start()
+
+    def _on_column_stats_finished(self, ok, msg, result):
+        try:
+            if not ok:
+                self.token_estimate_label.setText("")
+                self.append_log(f"[警告] {msg}")
+                return
+            # 统计期间已切换文件则丢弃结果
+            if os.path.normpath(msg) != os.path.normpath(self.input_edit.text().strip()):
+                return
+            self._col_token_stats = result.get("columns", {})
+            self._col_stats_rows = result.get("rows", 0)
+            self.col_list.blockSignals(True)
+            for i in range(self.col_list.count()):
+                item = self.col_list.item(i)
+                if not item:
+                    continue
+                name = item.data(Qt.UserRole) or item.text()
+                if name in self._col_token_stats:
+                    item.setText(f"{name}  · ~{format_tokens(self._col_token_stats[name])} tok")
+                    item.setToolTip(f"「{name}」平均约 {self._col_token_stats[name]:.0f} tokens/行")
+            self.col_list.blockSignals(False)
+            self._update_token_projection()
+        except (AttributeError, RuntimeError):
+            pass
+
+    def _estimate_prompt_tokens(self, cols):
+        """估算单行 Prompt 的 token 数：模板固定部分 + 已选列/模板引用列的平均值。"""
+        source = self.prompt_edit.toPlainText() if hasattr(self, "prompt_edit") else ""
+        delimiter = self.delim_edit.text() if hasattr(self, "delim_edit") else ""
+        try:
+            template = compile_template(source)
+        except TemplateError:
+            return None
+        # 按预处理的单列 / 整行上限封顶
+        pre = self._preprocess_settings()
+        budgets = pre.get("column_budgets") or {}
+        col_tokens = {
+            c: min(n, budgets[c]) if c in budgets else n for c, n in self._col_token_stats.items()
+        }
+        merged = sum(col_tokens.get(c, 0.0) for c in cols)
+        if pre.get("row_budget"):
+            merged = min(merged, pre["row_budget"])
+        return template.estimate_tokens(col_tokens, merged, delimiter)
+
+    def _update_token_projection(self, *args):
+        """根据模板、已选列与并发数刷新 token 与耗时预估。"""
+        if not hasattr(self, "token_estimate_label") or not self._col_token_stats:
+            return
+        cols = self._selected_columns()
+        prompt_tokens = self._estimate_prompt_tokens(cols)
+        if prompt_tokens is None:
+            self.token_estimate_label.setText("Prompt 模板语法有误，无法预估")
+            return
+        if not cols and "{col:" not in self.prompt_edit.toPlainText():
+            self.token_estimate_label.setText(
+                f"共 {self._col_stats_rows} 行 · 勾选列后显示 token 与耗时预估"
+            )
+            return
+        max_workers = self.max_workers_spin.value() if hasattr(self, "max_workers_spin") else 20
+        proj = project_job(self._col_stats_rows, prompt_tokens, max_workers)
+        self.token_estimate_label.setText(
+            f"每行 Prompt ≈ {format_tokens(proj['prompt_tokens'])} tokens · "
+            f"全表 ≈ {format_tokens(proj['total_tokens'])} tokens · "
+            f"预计耗时 {format_duration(proj['seconds'])}（并发 {max_workers}）"
+        )
 
     # ===== API Profile & Client =====
 
@@ -861,6 +1412,11 @@ class MainWindow(QMainWindow):
             "name": name,
             "content": prompt_text,
             "delimiter": self.delim_edit.text(),
+            "output": self._output_config(),
+            "rules": self._rules_config(),
+            "cascade": self._cascade_config(),
+            "ensemble": self._ensemble_config(),
+            "shared_prefix": self.shared_prefix_check.isChecked(),
             "created_time": created_time,
             "updated_time": time.strftime("%Y-%m-%d %H:%M:%S"),
         }
@@ -899,6 +1455,86 @@ class MainWindow(QMainWindow):
             menu.addAction(f"删除「{self._current_template_name}」", self.delete_prompt_template)
         menu.exec_(self.template_btn.mapToGlobal(self.template_btn.rect().bottomLeft()))
 
+    def _output_config(self) -> dict:
+        """从界面读取当前模板的输出配置（字段定义与长度限制）。"""
+        return normalize_output_config({
+            "fields": parse_fields(self.output_fields_edit.text()),
+            "format": self.output_format_combo.currentData(),
+            "limit_length": self.limit_output_check.isChecked(),
+            "max_tokens": self.max_tokens_spin.value(),
+            "repair": self.repair_output_check.isChecked(),
+        })
+
+    def _apply_output_config(self, cfg):
+        """将模板中的输出配置写回界面。"""
+        cfg = normalize_output_config(cfg)
+        self.output_fields_edit.setText(format_fields(cfg["fields"]))
+        self.output_format_combo.setCurrentIndex(max(0, self.output_format_combo.findData(cfg["format"])))
+        self.repair_output_check.setChecked(cfg["repair"])
+        self.limit_output_check.setChecked(cfg["limit_length"])
+        self.max_tokens_spin.setValue(cfg["max_tokens"])
+        self._update_output_limit_hint()
+
+    def _rules_config(self) -> dict:
+        """从界面读取当前模板的本地规则（语法有误的行忽略）。"""
+        rules, _ = parse_rules(self.rules_edit.toPlainText())
+        return normalize_rules_config({"enabled": self.rules_check.isChecked(), "rules": rules})
+
+    def _apply_rules_config(self, cfg):
+        """将模板中的本地规则写回界面。"""
+        cfg = normalize_rules_config(cfg)
+        self.rules_edit.setPlainText(format_rules(cfg["rules"]))
+        self.rules_check.setChecked(cfg["enabled"])
+
+    def _cascade_config(self) -> dict:
+        """从界面读取当前模板的模型级联设置。"""
+        return normalize_cascade_config({
+            "enabled": self.cascade_check.isChecked(),
+            "strong_model": self.cascade_model_edit.text(),
+            "score_threshold": self.cascade_threshold_spin.value(),
+            "margin": self.cascade_margin_spin.value(),
+        })
+
+    def _apply_cascade_config(self, cfg):
+        """将模板中的模型级联设置写回界面。"""
+        cfg = normalize_cascade_config(cfg)
+        self.cascade_model_edit.setText(cfg["strong_model"])
+        self.cascade_threshold_spin.setValue(int(cfg["score_threshold"]))
+        self.cascade_margin_spin.setValue(int(cfg["margin"]))
+        self.cascade_check.setChecked(cfg["enabled"])
+
+    def _ensemble_config(self) -> dict:
+        """从界面读取当前模板的多模型投票设置。"""
+        return normalize_ensemble_config({
+            "enabled": self.ensemble_check.isChecked(),
+            "models": re.split(r"[,，]", self.ensemble_models_edit.text()),
+            "vote": self.ensemble_vote_combo.currentData(),
+        })
+
+    def _apply_ensemble_config(self, cfg):
+        """将模板中的多模型投票设置写回界面。"""
+        cfg = normalize_ensemble_config(cfg)
+        self.ensemble_models_edit.setText(", ".join(cfg["models"]))
+        self.ensemble_vote_combo.setCurrentIndex(max(0, self.ensemble_vote_combo.findData(cfg["vote"])))
+        self.ensemble_check.setChecked(cfg["enabled"])
+
+    def _update_output_limit_hint(self, *args):
+        """显示按输出字段推算出的 max_tokens。"""
+        if not hasattr(self, "output_limit_label"):
+            return
+        if not self.limit_output_check.isChecked():
+            self.output_limit_label.setText("不限")
+            return
+        manual = self.max_tokens_spin.value()
+        if manual:
+            self.output_limit_label.setText(f"上限 {manual}")
+            return
+        delimiter = self.delim_edit.text() if hasattr(self, "delim_edit") else ""
+        auto = estimate_output_tokens(
+            parse_fields(self.output_fields_edit.text()), delimiter, self.output_format_combo.currentData()
+        )
+        self.output_limit_label.setText(f"≈ {auto} tok" if auto else "未声明字段")
+
     def _on_template_chosen(self, template_name):
         """菜单选中某项后加载该模板并更新按钮文字。"""
         self.load_prompt_template(template_name)
@@ -907,6 +1543,11 @@ class MainWindow(QMainWindow):
         """将 Prompt 与分隔符恢复为内置默认模板，并清除当前模板选中。"""
         self.prompt_edit.setPlainText(DEFAULT_PROMPT)
         self.delim_edit.setText("|")
+        self._apply_output_config({"fields": parse_fields(DEFAULT_OUTPUT_FIELDS)})
+        self._apply_rules_config({})
+        self._apply_cascade_config({})
+        self._apply_ensemble_config({})
+        self.shared_prefix_check.setChecked(True)
         self._current_template_name = None
         self.template_btn.setText("-- 选择模板 --")
         self.append_log("已重置为默认模板")
@@ -927,6 +1568,12 @@ class MainWindow(QMainWindow):
             self.prompt_edit.setPlainText(data.get("content", ""))
             if "delimiter" in data:
                 self.delim_edit.setText(data["delimiter"])
+            # 旧模板没有输出字段定义：清空字段，不限制输出长度
+            self._apply_output_config(data.get("output") or {})
+            self._apply_rules_config(data.get("rules") or {})
+            self._apply_cascade_config(data.get("cascade") or {})
+            self._apply_ensemble_config(data.get("ensemble") or {})
+            self.shared_prefix_check.setChecked(bool(data.get("shared_prefix", False)))
             self._current_template_name = name
             self.template_btn.setText(name)
             self.append_log(f"已加载模板: {name}")
@@ -1035,6 +1682,11 @@ class MainWindow(QMainWindow):
             "name": new_name,
             "content": prompt_text,
             "delimiter": self.delim_edit.text(),
+            "output": self._output_config(),
+            "rules": self._rules_config(),
+            "cascade": self._cascade_config(),
+            "ensemble": self._ensemble_config(),
+            "shared_prefix": self.shared_prefix_check.isChecked(),
             "created_time": created_time,
             "updated_time": created_time,
         }
@@ -1139,6 +1791,50 @@ class MainWindow(QMainWindow):
                 QMessageBox.critical(self, "错误", f"清除失败: {e}")
                 self.append_log(f"清除 API Key 失败: {e}")
 
+    def edit_usage_and_pricing(self):
+        """查看当前平台的累计用量，编辑价格表（元 / 百万 tokens）。"""
+        profile_id = self._get_current_profile()["id"]
+        usage = load_profile_usage(profile_id)
+        dialog = QDialog(self)
+        dialog.setWindowTitle("用量与价格")
+        layout = QVBoxLayout(dialog)
+        if usage:
+            lines = [
+                f"{model}：{u.get('requests', 0)} 次请求，输入 {format_tokens(u.get('prompt_tokens', 0))}"
+                f"（缓存命中 {format_tokens(u.get('cached_tokens', 0))}），输出 {format_tokens(u.get('completion_tokens', 0))}"
+                + (f"，¥{u['cost']:.2f}" if u.get("cost") else "")
+                for model, u in usage.items()
+            ]
+            layout.addWidget(QLabel("当前平台累计用量：\n" + "\n".join(lines)))
+        else:
+            layout.addWidget(QLabel("当前平台暂无用量记录"))
+        layout.addWidget(QLabel(f"价格表（每行：模型名 输入价 输出价 [缓存命中价]，单位 {PRICE_UNIT}）："))
+        pricing_edit = QPlainTextEdit()
+        pricing_edit.setPlaceholderText("THUDM/GLM-4-9B-0414 0 0\ndeepseek-ai/DeepSeek-V3 2 8 0.5")
+        pricing_edit.setPlainText(format_pricing(load_profile_pricing(profile_id)))
+        layout.addWidget(pricing_edit)
+        buttons = QDialogButtonBox(QDialogButtonBox.Save | QDialogButtonBox.Cancel)
+        reset_btn = buttons.addButton("清零累计用量", QDialogButtonBox.ResetRole)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        layout.addWidget(buttons)
+
+        def reset_usage():
+            if QMessageBox.question(self, "确认", "确定要清零当前平台的累计用量吗？") == QMessageBox.Yes:
+                save_profile_usage(profile_id, {})
+                self.append_log("已清零当前平台的累计用量")
+                dialog.reject()
+
+        reset_btn.clicked.connect(reset_usage)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        pricing, errors = parse_pricing(pricing_edit.toPlainText())
+        if errors:
+            QMessageBox.warning(self, "提示", "价格表有误，未保存：\n" + "\n".join(errors))
+            return
+        save_profile_pricing(profile_id, pricing)
+        self.append_log(f"价格表已保存（{len(pricing)} 个模型）")
+
     def _on_max_workers_changed(self, value):
         """并发数改变时保存设置"""
         try:
@@ -1147,6 +1843,252 @@ class MainWindow(QMainWindow):
         except Exception as e:
             logging.warning(f"保存并发设置失败: {e}")
 
+    def _preprocess_settings(self) -> dict:
+        """从界面读取输入预处理设置。"""
+        if not hasattr(self, "normalize_check"):
+            return {}
+        return {
+            "normalize": self.normalize_check.isChecked(),
+            "row_budget": self.row_budget_spin.value(),
+            "column_budgets": parse_column_budgets(self.col_budget_edit.text()),
+        }
+
+    def _on_preprocess_changed(self, *args):
+        """预处理设置改变时保存，并刷新 token 预估。"""
+        try:
+            save_preprocess_settings(self._preprocess_settings())
+        except Exception as e:
+            logging.warning(f"保存预处理设置失败: {e}")
+        self._update_token_projection()
+
+    def _chunking_settings(self) -> dict:
+        """从界面读取超长行分块设置。"""
+        if not hasattr(self, "chunk_check"):
+            return {}
+        return {
+            "enabled": self.chunk_check.isChecked(),
+            "chunk_tokens": self.chunk_tokens_spin.value(),
+            "overlap_tokens": self._chunk_overlap_tokens,
+            "reducer": self.chunk_reducer_combo.currentData(),
+        }
+
+    def _on_chunking_changed(self, *args):
+        """分块设置改变时保存。"""
+        try:
+            save_chunking_settings(self._chunking_settings())
+        except Exception as e:
+            logging.warning(f"保存分块设置失败: {e}")
+
+    def _dedup_settings(self) -> dict:
+        """从界面读取近似重复行设置。"""
+        if not hasattr(self, "dedup_check"):
+            return {}
+        return {
+            "enabled": self.dedup_check.isChecked(),
+            "threshold": self.dedup_threshold_spin.value(),
+        }
+
+    def _on_dedup_changed(self, *args):
+        """近似重复行设置改变时保存。"""
+        try:
+            save_dedup_settings(self._dedup_settings())
+        except Exception as e:
+            logging.warning(f"保存近似去重设置失败: {e}")
+
+    def _diagnostics_settings(self) -> dict:
+        """从界面读取诊断输出设置。"""
+        if not hasattr(self, "provenance_check"):
+            return load_diagnostics_settings()
+        return dict(
+            load_diagnostics_settings(),
+            provenance=self.provenance_check.isChecked(),
+            metrics=self.metrics_check.isChecked(),
+            trace=self.trace_check.isChecked(),
+        )
+
+    def _on_diagnostics_changed(self, *args):
+        """诊断输出设置改变时保存。"""
+        try:
+            save_diagnostics_settings(self._diagnostics_settings())
+        except Exception as e:
+            logging.warning(f"保存诊断输出设置失败: {e}")
+
+    def _budget_settings(self) -> dict:
+        """从界面读取任务预算。"""
+        if not hasattr(self, "budget_requests_spin"):
+            return {}
+        return {
+            "max_requests": self.budget_requests_spin.value(),
+            "max_tokens": self.budget_tokens_spin.value() * 10_000,
+            "max_cost": self.budget_cost_spin.value(),
+        }
+
+    def _on_budget_changed(self, *args):
+        """任务预算改变时保存。"""
+        try:
+            save_budget_settings(self._budget_settings())
+        except Exception as e:
+            logging.warning(f"保存任务预算失败: {e}")
+
+    def _learned_settings(self) -> dict:
+        """从界面读取学习型预筛设置。"""
+        if not hasattr(self, "learned_check"):
+            return {}
+        return {
+            "enabled": self.learned_check.isChecked(),
+            "sample_size": self.learned_sample_spin.value(),
+            "confidence": self.learned_conf_spin.value(),
+        }
+
+    def _on_learned_changed(self, *args):
+        """学习型预筛设置改变时保存。"""
+        try:
+            save_learned_settings(self._learned_settings())
+        except Exception as e:
+            logging.warning(f"保存学习型预筛设置失败: {e}")
+
+    def _on_cache_changed(self, checked):
+        """持久缓存开关改变时保存。"""
+        try:
+            save_cache_settings({"enabled": checked})
+        except Exception as e:
+            logging.warning(f"保存缓存设置失败: {e}")
+
+    def _update_cache_count(self):
+        """显示持久缓存中的条目数（缓存文件不存在时不创建）。"""
+        if not os.path.exists(CACHE_PATH):
+            self.cache_count_label.setText("0 条")
+            return
+        try:
+            with ResultCache() as cache:
+                self.cache_count_label.setText(f"{cache.count()} 条")
+        except Exception as e:
+            self.cache_count_label.setText("")
+            logging.warning(f"读取缓存失败: {e}")
+
+    def _job_options(self) -> dict:
+        """影响输出结果的任务设置（同时决定行指纹）。"""
+        return {
+            "preprocess": self._preprocess_settings(),
+            "chunking": self._chunking_settings(),
+            "output": self._output_config(),
+            "shared_prefix": self.shared_prefix_check.isChecked(),
+            "rules": self._rules_config(),
+            "cascade": self._cascade_config(),
+            "ensemble": self._ensemble_config(),
+        }
+
+    def import_cache_results(self):
+        """选择已有输出文件，按当前 Prompt / 模型 / 已选列导入持久缓存。"""
+        if self.cache_import_thread and self.cache_import_thread.isRunning():
+            QMessageBox.information(self, "提示", "正在导入，请稍候")
+            return
+        prompt = self.prompt_edit.toPlainText().strip()
+        cols = self._selected_columns()
+        try:
+            template = compile_template(prompt)
+        except TemplateError as e:
+            QMessageBox.warning(self, "提示", f"Prompt 模板有误: {e}")
+            return
+        if not prompt or (not cols and not template.columns):
+            QMessageBox.warning(self, "提示", "请先填写 Prompt 并勾选参与合并的列（导入的结果按当前设置计算指纹）")
+            return
+        paths, _ = QFileDialog.getOpenFileNames(
+            self, "选择已有输出文件", "", "Excel Files (*.xlsx *.xls)"
+        )
+        if not paths:
+            return
+        input_path = self.input_edit.text().strip()
+        self.cache_import_btn.setEnabled(False)
+        self.append_log(f"开始导入 {len(paths)} 个文件到持久缓存...")
+        self.cache_import_thread = CacheImportThread(
+            paths,
+            input_path if os.path.exists(input_path) else "",
+            cols,
+            self.delim_edit.text().strip(),
+            prompt,
+            self._job_options(),
+        )
+        self.cache_import_thread.log_signal.connect(self.append_log)
+        self.cache_import_thread.finished.connect(self._on_cache_import_finished)
+        self.cache_import_thread.start()
+
+    def _on_cache_import_finished(self, ok, msg):
+        self.cache_import_btn.setEnabled(True)
+        self._update_cache_count()
+        self.append_log(msg if ok else f"[错误] {msg}")
+        if ok:
+            QMessageBox.information(self, "导入完成", msg)
+        else:
+            QMessageBox.critical(self, "错误", msg)
+
+    def export_cache_pack(self):
+        """将持久缓存导出为压缩缓存包。"""
+        if not os.path.exists(CACHE_PATH):
+            QMessageBox.information(self, "提示", "缓存为空，无需导出")
+            return
+        path, _ = QFileDialog.getSaveFileName(
+            self, "导出缓存包", f"autoscreen_cache{PACK_EXTENSION}", f"缓存包 (*{PACK_EXTENSION})"
+        )
+        if not path:
+            return
+        try:
+            with ResultCache() as cache:
+                manifest = export_pack(cache, path)
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"导出缓存包失败: {e}")
+            return
+        msg = (
+            f"已导出 {manifest['entries']} 条结果（去重后 {manifest['distinct_outputs']} 种输出，"
+            f"{len(manifest['jobs'])} 个任务指纹），文件大小 {os.path.getsize(path) / 1024:.1f} KB"
+        )
+        self.append_log(f"{msg}: {path}")
+        QMessageBox.information(self, "导出完成", msg)
+
+    def import_cache_pack(self):
+        """合并导入缓存包，并报告新增、相同与冲突条目数。"""
+        path, _ = QFileDialog.getOpenFileName(
+            self, "导入缓存包", "", f"缓存包 (*{PACK_EXTENSION});;所有文件 (*)"
+        )
+        if not path:
+            return
+        try:
+            manifest = read_pack_manifest(path)
+            for job in manifest.get("jobs", []):
+                self.append_log(
+                    f"缓存包任务：模型 {job.get('model') or '未知'} @ {job.get('base_url') or '未知'}，"
+                    f"指纹 {(job.get('job') or '未知')[:12]}，{job.get('entries', 0)} 条"
+                )
+            with ResultCache() as cache:
+                counts = import_pack(cache, path)
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"导入缓存包失败: {e}")
+            return
+        msg = (
+            f"新增 {counts['added']} 条，已有相同 {counts['identical']} 条，"
+            f"冲突 {counts['conflicts']} 条（保留本地结果）"
+        )
+        self.append_log(f"导入缓存包 {path}: {msg}")
+        self._update_cache_count()
+        QMessageBox.information(self, "导入完成", msg)
+
+    def clear_cache_results(self):
+        reply = QMessageBox.question(
+            self,
+            "确认清空",
+            "确定删除持久缓存中的全部结果吗？",
+            QMessageBox.Yes | QMessageBox.No,
+        )
+        if reply != QMessageBox.Yes or not os.path.exists(CACHE_PATH):
+            return
+        try:
+            with ResultCache() as cache:
+                cache.clear()
+            self.append_log("已清空持久缓存")
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"清空缓存失败: {e}")
+        self._update_cache_count()
+
     def choose_input(self):
         path, _ = QFileDialog.getOpenFileName(
             self, "选择 Excel", "", "Excel Files (*.xlsx *.xls)"
@@ -1194,6 +2136,7 @@ class MainWindow(QMainWindow):
             self.col_list.clear()
             for c in cols:
                 item = QListWidgetItem(str(c))
+                item.setData(Qt.UserRole, str(c))
                 item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
                 item.setCheckState(Qt.Unchecked)
                 self.col_list.addItem(item)
@@ -1205,6 +2148,7 @@ class MainWindow(QMainWindow):
             self.col_list.repaint()
             QApplication.processEvents()
             self.append_log(f"已加载文件列: {len(cols)} 列")
+            self._start_column_stats(path)
         except Exception as e:
             QMessageBox.critical(self, "错误", f"读取文件时发生错误: {e}")
             logging.error(f"加载列时出错: {e}", exc_info=True)
@@ -1215,25 +2159,132 @@ class MainWindow(QMainWindow):
         if hasattr(self, "worker") and self.worker and self.worker.isRunning():
             QMessageBox.warning(self, "提示", "已有任务正在运行，请先停止当前任务")
             return
-        input_path = self.input_edit.text().strip()
+        checked = self._validate_job_inputs()
+        if not checked:
+            return
+        input_path, prompt, delimiter, selected_cols = checked
         output_path = self.output_edit.text().strip()
+        if not output_path and self.run_mode_combo.currentData() == "retry_failures":
+            output_path = input_path  # 原地修补
+        max_workers = self.max_workers_spin.value() if hasattr(self, "max_workers_spin") else 20
+        self._start_worker(
+            Worker(input_path, selected_cols, delimiter, output_path, prompt, max_workers, self._run_options())
+        )
+
+    def _choose_experiment_variants(self):
+        """
+        弹出 A/B 实验设置：勾选参与比较的模板（含当前编辑内容），填写要比较的模型。
+        返回：变体列表；取消时返回 None。
+        """
+        dialog = QDialog(self)
+        dialog.setWindowTitle("A/B 实验")
+        layout = QVBoxLayout(dialog)
+        layout.addWidget(QLabel("参与比较的模板："))
+        template_list = QListWidget()
+        current = QListWidgetItem("（当前编辑的 Prompt）")
+        current.setFlags(current.flags() | Qt.ItemIsUserCheckable)
+        current.setCheckState(Qt.Checked)
+        template_list.addItem(current)
+        self.refresh_template_list()
+        for t in self._template_list:
+            item = QListWidgetItem(t["name"])
+            item.setFlags(item.flags() | Qt.ItemIsUserCheckable)
+            item.setCheckState(Qt.Unchecked)
+            item.setData(Qt.UserRole, t["filename"])
+            template_list.addItem(item)
+        layout.addWidget(template_list)
+        layout.addWidget(QLabel("比较的模型（逗号分隔，留空表示只用当前模型）："))
+        models_edit = QLineEdit()
+        models_edit.setPlaceholderText("如 THUDM/GLM-4-9B-0414, Qwen/Qwen2.5-72B-Instruct")
+        layout.addWidget(models_edit)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        layout.addWidget(buttons)
+        if dialog.exec_() != QDialog.Accepted:
+            return None
+
+        templates = []
+        for i in range(template_list.count()):
+            item = template_list.item(i)
+            if item.checkState() != Qt.Checked:
+                continue
+            if i == 0:
+                templates.append({
+                    "name": self._current_template_name or "当前",
+                    "content": self.prompt_edit.toPlainText().strip(),
+                    "delimiter": self.delim_edit.text().strip(),
+                    "output": self._output_config(),
+                    "shared_prefix": self.shared_prefix_check.isChecked(),
+                })
+                continue
+            try:
+                with open(os.path.join(TEMPLATE_DIR, item.data(Qt.UserRole)), "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (json.JSONDecodeError, OSError) as e:
+                QMessageBox.warning(self, "提示", f"读取模板「{item.text()}」失败: {e}")
+                return None
+            name = item.text()
+            if any(t["name"] == name for t in templates):
+                name = f"{name}(已保存)"
+            templates.append(dict(data, name=name))
+        models = [m.strip() for m in re.split(r"[,，]", models_edit.text()) if m.strip()]
+        return build_variants(templates, models)
+
+    def _run_options(self) -> dict:
+        """开始处理时传给 run_processing 的全部设置。"""
+        diagnostics = self._diagnostics_settings()
+        return dict(
+            self._job_options(),
+            mode=self.run_mode_combo.currentData(),
+            persistent_cache=self.cache_check.isChecked(),
+            dedup=self._dedup_settings(),
+            learned=self._learned_settings(),
+            budget=self._budget_settings(),
+            provenance=diagnostics["provenance"],
+            metrics={
+                "enabled": diagnostics["metrics"],
+                "dir": diagnostics["metrics_dir"],
+                "interval": diagnostics["metrics_interval"],
+            },
+            trace=diagnostics["trace"],
+            profile=self._get_current_profile()["id"],
+            pricing=load_profile_pricing(self._get_current_profile()["id"]),
+            template_name=self._current_template_name or "",
+        )
+
+    def _validate_job_inputs(self):
+        """
+        校验输入文件、Prompt、所选列与本地规则，有误时提示。
+        返回：(输入路径, Prompt, 分隔符, 所选列)；校验失败返回 None。
+        """
+        input_path = self.input_edit.text().strip()
         prompt = self.prompt_edit.toPlainText().strip()
         delimiter = self.delim_edit.text().strip()
-        selected_cols = []
-        for i in range(self.col_list.count()):
-            item = self.col_list.item(i)
-            if item and item.checkState() == Qt.Checked:
-                selected_cols.append(item.text())
+        selected_cols = self._selected_columns()
         if not input_path or not os.path.exists(input_path):
             QMessageBox.warning(self, "提示", "请输入有效的输入文件路径")
-            return
-        if not selected_cols:
-            QMessageBox.warning(self, "提示", "请至少勾选一列数据")
-            return
+            return None
         if not prompt:
             QMessageBox.warning(self, "提示", "Prompt 模板不能为空")
-            return
-
+            return None
+        try:
+            template = compile_template(prompt)
+        except TemplateError as e:
+            QMessageBox.warning(self, "提示", f"Prompt 模板有误: {e}")
+            return None
+        if not selected_cols and not template.columns:
+            QMessageBox.warning(self, "提示", "请至少勾选一列数据，或在模板中使用 {col:列名}")
+            return None
+        if self.rules_check.isChecked():
+            _, rule_errors = parse_rules(self.rules_edit.toPlainText())
+            if rule_errors:
+                QMessageBox.warning(self, "提示", "本地规则有误：\n" + "\n".join(rule_errors))
+                return None
+        return input_path, prompt, delimiter, selected_cols
+
+    def _start_worker(self, worker):
+        """重置进度与日志后启动后台任务线程（Worker / PilotWorker / ExperimentWorker / ConcurrencySweepWorker）。"""
         self.start_btn.setEnabled(False)
         self.stop_btn.setEnabled(True)
         self.progress_bar.setValue(0)
@@ -1242,6 +2293,7 @@ class MainWindow(QMainWindow):
             self.log_console.clear()
         if hasattr(self, "tabs"):
             self.tabs.setCurrentIndex(1)
+        self.usage_label.setText("")
         if hasattr(self, "worker") and self.worker:
             try:
                 self.worker.progress.disconnect()
@@ -1249,15 +2301,110 @@ class MainWindow(QMainWindow):
                 self.worker.finished.disconnect()
             except Exception:
                 pass
-        max_workers = self.max_workers_spin.value() if hasattr(self, "max_workers_spin") else 20
-        self.worker = Worker(
-            input_path, selected_cols, delimiter, output_path, prompt, max_workers
-        )
+        self.worker = worker
+        if hasattr(self.worker, "usage_signal"):
+            self.worker.usage_signal.connect(lambda totals: self.usage_label.setText(format_live(totals)))
         self.worker.progress.connect(self.on_progress)
         self.worker.log_signal.connect(self.append_log)
         self.worker.finished.connect(self.on_worker_finished)
         self.worker.start()
 
+    def start_pilot(self):
+        if not self.get_client():
+            return
+        if hasattr(self, "worker") and self.worker and self.worker.isRunning():
+            QMessageBox.warning(self, "提示", "已有任务正在运行，请先停止当前任务")
+            return
+        checked = self._validate_job_inputs()
+        if not checked:
+            return
+        input_path, prompt, delimiter, selected_cols = checked
+        sample_size, ok = QInputDialog.getInt(
+            self, "试运行", "抽样行数（按文本长度分层随机抽取）：", DEFAULT_PILOT_ROWS, 5, 2000, 5
+        )
+        if not ok:
+            return
+        max_workers = self.max_workers_spin.value() if hasattr(self, "max_workers_spin") else 20
+        self._start_worker(
+            PilotWorker(input_path, selected_cols, delimiter, prompt, sample_size, max_workers, probe_options(self._run_options()))
+        )
+
+    def start_concurrency_sweep(self):
+        if not self.get_client():
+            return
+        if hasattr(self, "worker") and self.worker and self.worker.isRunning():
+            QMessageBox.warning(self, "提示", "已有任务正在运行，请先停止当前任务")
+            return
+        checked = self._validate_job_inputs()
+        if not checked:
+            return
+        input_path, prompt, delimiter, selected_cols = checked
+        text, ok = QInputDialog.getText(
+            self,
+            "并发测速",
+            "并发级别（逗号分隔；每级发送「并发数 × 2」个请求，至少 10 个）：",
+            text=", ".join(map(str, DEFAULT_LEVELS)),
+        )
+        if not ok:
+            return
+        try:
+            levels = parse_levels(text)
+        except ValueError:
+            QMessageBox.warning(self, "提示", "并发级别须为逗号分隔的整数")
+            return
+        if not levels:
+            return
+        self._start_worker(
+            ConcurrencySweepWorker(input_path, selected_cols, delimiter, prompt, levels, probe_options(self._run_options()))
+        )
+
+    def _offer_max_workers(self, recommended, report):
+        """显示测速报告，并可一键把推荐值应用为并发线程数。"""
+        box = QMessageBox(self)
+        box.setWindowTitle("并发测速")
+        box.setIcon(QMessageBox.Information)
+        box.setText(f"推荐并发线程数：{recommended}（当前 {self.max_workers_spin.value()}）")
+        box.setDetailedText(report)
+        apply_btn = box.addButton(f"应用 {recommended}", QMessageBox.AcceptRole)
+        box.addButton("关闭", QMessageBox.RejectRole)
+        box.exec_()
+        if box.clickedButton() is apply_btn:
+            # valueChanged 会保存设置并刷新 token 预估
+            self.max_workers_spin.setValue(recommended)
+
+    def start_experiment(self):
+        if not self.get_client():
+            return
+        if hasattr(self, "worker") and self.worker and self.worker.isRunning():
+            QMessageBox.warning(self, "提示", "已有任务正在运行，请先停止当前任务")
+            return
+        input_path = self.input_edit.text().strip()
+        selected_cols = self._selected_columns()
+        if not input_path or not os.path.exists(input_path):
+            QMessageBox.warning(self, "提示", "请输入有效的输入文件路径")
+            return
+        variants = self._choose_experiment_variants()
+        if variants is None:
+            return
+        if not variants:
+            QMessageBox.warning(self, "提示", "请至少勾选一个模板")
+            return
+        if len(variants) > MAX_VARIANTS:
+            QMessageBox.warning(self, "提示", f"模板 × 模型共 {len(variants)} 个变体，最多 {MAX_VARIANTS} 个")
+            return
+        base = self.output_edit.text().strip() or input_path
+        output_path = f"{os.path.splitext(base)[0]}_实验.xlsx"
+        max_workers = self.max_workers_spin.value() if hasattr(self, "max_workers_spin") else 20
+        self._start_worker(
+            ExperimentWorker(
+                input_path, selected_cols, variants, output_path, max_workers,
+                {
+                    "preprocess": self._preprocess_settings(),
+                    "pricing": load_profile_pricing(self._get_current_profile()["id"]),
+                },
+            )
+        )
+
     def stop_processing(self):
         if hasattr(self, "worker") and self.worker and self.worker.isRunning():
             self.worker.stop()
@@ -1287,6 +2434,7 @@ class MainWindow(QMainWindow):
 
     def on_worker_finished(self, ok, msg):
         try:
+            self._update_cache_count()
             if hasattr(self, "start_btn"):
                 self.start_btn.setEnabled(True)
             if hasattr(self, "stop_btn"):
@@ -1296,11 +2444,15 @@ class MainWindow(QMainWindow):
                 self.status_label.setText("任务结束")
             if hasattr(self, "eta_label"):
                 self.eta_label.setText("--:--")
-            if ok:
+            recommended = getattr(self.worker, "recommended_workers", 0)
+            if ok and recommended:
+                self.append_log(f"[完成] 并发测速结束，推荐并发线程数 {recommended}")
+                self._offer_max_workers(recommended, msg)
+            elif ok:
                 QMessageBox.information(self, "完成", msg)
                 self.append_log(f"[完成] {msg}")
             else:
-                if "用户中断" in msg:
+                if "用户中断" in msg or "预算已用完" in msg:
                     QMessageBox.warning(self, "中断", msg)
                     self.append_log(f"[中断] {msg}")
                 else:
@@ -0,0 +1,228 @@
+"""
+任务运行指标：计数器、仪表与直方图，定期导出为 Prometheus 文本格式与 JSON 快照
+- Prometheus 文件可由 node_exporter 的 textfile collector 采集（把导出目录设为其 --collector.textfile.directory）
+- 所有指标带 job 标签（输出文件名），同一台机器上的多个任务互不覆盖
+- 由 run_processing 的派发与结果收集循环更新；可选在本机 HTTP 端口提供 /metrics 与 /metrics.json（无界面运行时使用）
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+PREFIX = "autoscreen_"
+DEFAULT_INTERVAL = 15  # 秒
+LATENCY_BUCKETS = (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+# 指标名（不含前缀）-> (类型, 说明)
+METRICS = {
+    "requests_total": ("counter", "模型请求数（分块、投票、级联升级各计一次），按模型"),
+    "api_calls_total": ("counter", "实际发出的 API 调用数（含重试、格式修复与降级重发），按模型"),
+    "retries_total": ("counter", "重试与重发的 API 调用数，按模型"),
+    "errors_total": ("counter", "错误数，按类别（API 异常类名，或 empty_response / invalid_output / missing_delimiter）"),
+    "rows_total": ("counter", "已得到结果的行数，按来源（model / persistent_cache / rule 等）"),
+    "tokens_total": ("counter", "token 用量，按类型（prompt / completion / cached）"),
+    "cost_yuan_total": ("counter", "按价格表计算的费用（元）"),
+    "rows_planned": ("gauge", "本次任务需处理的行数"),
+    "in_flight_requests": ("gauge", "已提交、尚未完成的请求数（含线程池排队）"),
+    "job_running": ("gauge", "任务是否正在运行"),
+    "job_start_time_seconds": ("gauge", "任务开始时间（Unix 时间戳）"),
+    "request_latency_seconds": ("histogram", "单次请求耗时（含重试退避）"),
+    "queue_wait_seconds": ("histogram", "请求在线程池中等待空闲线程的时间"),
+}
+
+# 行级错误信息 -> errors_total 的类别
+OUTPUT_ERROR_CLASSES = (
+    ("API 返回空", "empty_response"),
+    ("输出校验失败", "invalid_output"),
+    ("缺少分隔符", "missing_delimiter"),
+)
+
+
+def output_error_class(error_msg: str) -> str:
+    for prefix, cls in OUTPUT_ERROR_CLASSES:
+        if error_msg.startswith(prefix):
+            return cls
+    return "other"
+
+
+def _label_key(labels: Dict[str, str]) -> Tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: Tuple) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in key) + "}" if key else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class JobMetrics:
+    """一个任务的指标集合（线程安全）；enabled 为 False 时各方法直接返回，便于无条件调用。"""
+
+    def __init__(self, job: str, enabled: bool = True):
+        self.job = job
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # 指标名 -> {标签键: 值}；直方图的值为 {"buckets": [...], "sum": x, "count": n}
+        self._values: Dict[str, Dict[Tuple, Any]] = {name: {} for name in METRICS}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return _label_key(dict(labels, job=self.job))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        if not self.enabled or not value:
+            return
+        key = self._key(labels)
+        with self._lock:
+            series = self._values[name]
+            series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[name][key] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            h = self._values[name].setdefault(key, {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    h["buckets"][i] += 1
+            h["sum"] += value
+            h["count"] += 1
+
+    def to_prometheus(self) -> str:
+        """Prometheus 文本格式（exposition format 0.0.4）。"""
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in METRICS.items():
+                series = self._values[name]
+                if not series:
+                    continue
+                full = PREFIX + name
+                lines.append(f"# HELP {full} {help_text}")
+                lines.append(f"# TYPE {full} {kind}")
+                for key, value in sorted(series.items()):
+                    if kind != "histogram":
+                        lines.append(f"{full}{_format_labels(key)} {_format_value(value)}")
+                        continue
+                    for bound, count in zip(LATENCY_BUCKETS, value["buckets"]):
+                        lines.append(f"{full}_bucket{_format_labels(key + (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{full}_bucket{_format_labels(key + (('le', '+Inf'),))} {value['count']}")
+                    lines.append(f"{full}_sum{_format_labels(key)} {_format_value(round(value['sum'], 6))}")
+                    lines.append(f"{full}_count{_format_labels(key)} {value['count']}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, Any]:
+        """JSON 快照：{job, time, metrics: {指标名: [{labels, value}]}}。"""
+        metrics = {}
+        with self._lock:
+            for name, series in self._values.items():
+                if not series:
+                    continue
+                entries = []
+                for key, value in sorted(series.items()):
+                    labels = {k: v for k, v in key if k != "job"}
+                    if isinstance(value, dict):
+                        value = dict(value, bounds=list(LATENCY_BUCKETS))
+                    entries.append({"labels": labels, "value": value})
+                metrics[name] = entries
+        return {"job": self.job, "time": time.time(), "metrics": metrics}
+
+
+def metrics_paths(output_path: str, directory: str = "") -> Tuple[str, str]:
+    """导出文件路径：(Prometheus 文件, JSON 快照)；目录缺省为输出文件所在目录。"""
+    job = re.sub(r"[^\w.-]", "_", os.path.splitext(os.path.basename(output_path))[0])
+    base = os.path.join(directory or os.path.dirname(os.path.abspath(output_path)), PREFIX + job)
+    return f"{base}.prom", f"{base}.json"
+
+
+def _write_atomic(path: str, text: str) -> None:
+    # 先写临时文件再替换，采集方不会读到写了一半的文件
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+class MetricsExporter:
+    """后台线程每 interval 秒写出 Prometheus 文件与 JSON 快照；port 非 0 时同时在 127.0.0.1 提供 HTTP 访问。"""
+
+    def __init__(self, metrics: JobMetrics, prom_path: str, json_path: str, interval: float = DEFAULT_INTERVAL, port: int = 0):
+        self.metrics = metrics
+        self.prom_path = prom_path
+        self.json_path = json_path
+        self.interval = max(1.0, float(interval or DEFAULT_INTERVAL))
+        self.port = int(port or 0)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def write(self) -> None:
+        _write_atomic(self.prom_path, self.metrics.to_prometheus())
+        _write_atomic(self.json_path, json.dumps(self.metrics.snapshot(), ensure_ascii=False, indent=2))
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                logging.warning(f"写出运行指标失败: {e}")
+
+    def start(self) -> None:
+        """创建导出目录并立即写出一次（路径不可写时在此抛出 OSError），再启动定时写出与 HTTP 服务。"""
+        for path in (self.prom_path, self.json_path):
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.write()
+        if self.port:
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.rstrip("/") == "/metrics":
+                        body, ctype = metrics.to_prometheus(), "text/plain; version=0.0.4; charset=utf-8"
+                    elif self.path.rstrip("/") == "/metrics.json":
+                        body, ctype = json.dumps(metrics.snapshot(), ensure_ascii=False), "application/json; charset=utf-8"
+                    else:
+                        self.send_error(404)
+                        return
+                    data = body.encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", ctype)
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+
+                def log_message(self, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer(("127.0.0.1", self.port), Handler)
+            threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止定时导出并写出最终快照；HTTP 服务随之关闭。"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        try:
+            self.write()
+        finally:
+            if self._server:
+                self._server.shutdown()
+                self._server.server_close()
@@ -0,0 +1,420 @@
+"""
+输出字段定义、输出长度控制与结构化校验
+- 模板可声明期望输出的字段：枚举（是/否）、整数（0-100）、数值、短文本
+- 据此推算紧凑的 max_tokens，并以换行作为停止序列，避免模型输出多余解释
+- 输出格式：delimited（分隔符单行）或 json（response_format 约束的 JSON 对象）
+- validate_output 按字段定义快速校验并解析出各字段值；不合格时可用 repair_prompt 重问一次
+- split_output_columns 在写出时一次性（向量化）把 AI_Output 拆成带类型的字段列，summarize_fields 生成日志摘要
+- 字段定义以 JSON 形式随模板保存；界面中使用简写：
+  是否属于=是/否; 是否保留=保留/不保留; 评分=int:0-100; 理由=text:60
+"""
+import json
+import math
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from tokens import estimate_tokens
+
+# 短文本字段未声明长度时的默认 token 上限
+DEFAULT_TEXT_TOKENS = 32
+# 推算 max_tokens 时的放大系数与固定余量（本地估算与真实分词存在偏差）
+MAX_TOKENS_FACTOR = 1.5
+MAX_TOKENS_MARGIN = 4
+
+# 输出格式：键为配置值，值为界面显示名
+OUTPUT_FORMATS = {
+    "delimited": "分隔符单行",
+    "json": "JSON 结构化",
+}
+
+DEFAULT_OUTPUT = {
+    "fields": [],
+    "format": "delimited",
+    "limit_length": True,  # 是否按字段推算 max_tokens 并在换行处停止
+    "max_tokens": 0,  # 0 表示自动推算
+    "repair": True,  # 校验不通过时是否用修复提示重问一次
+}
+
+# JSON 模式下分隔符为空时，AI_Output 汇总列使用的分隔符
+FALLBACK_DELIMITER = "|"
+
+_INT_RE = re.compile(r"^int(?::\s*(-?\d+)\s*-\s*(-?\d+))?$", re.IGNORECASE)
+_TEXT_RE = re.compile(r"^text(?::\s*(\d+))?$", re.IGNORECASE)
+
+
+def parse_fields(spec: str) -> List[Dict[str, Any]]:
+    """
+    解析字段简写，字段间以分号或换行分隔：
+    - 名称=值1/值2      枚举
+    - 名称=int:0-100    整数（可省略范围）
+    - 名称=number       数值
+    - 名称=text:60      短文本（约 60 token，省略时为默认值）
+    - 名称              短文本
+    """
+    fields = []
+    for part in re.split(r"[;；\n]", spec or ""):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, rule = part.partition("=")
+        name, rule = name.strip(), rule.strip()
+        if not name:
+            continue
+        field: Dict[str, Any] = {"name": name, "type": "text"}
+        m_int = _INT_RE.match(rule)
+        m_text = _TEXT_RE.match(rule)
+        if not sep or not rule:
+            pass
+        elif m_int:
+            field["type"] = "int"
+            if m_int.group(1) is not None:
+                field["min"], field["max"] = int(m_int.group(1)), int(m_int.group(2))
+        elif rule.lower() == "number":
+            field["type"] = "number"
+        elif m_text:
+            if m_text.group(1):
+                field["max_tokens"] = int(m_text.group(1))
+        else:
+            values = [v.strip() for v in rule.split("/") if v.strip()]
+            if values:
+                field["type"] = "enum"
+                field["values"] = values
+        fields.append(field)
+    return fields
+
+
+def format_fields(fields: List[Dict[str, Any]]) -> str:
+    """将字段定义还原为界面简写。"""
+    parts = []
+    for f in fields or []:
+        t = f.get("type", "text")
+        if t == "enum":
+            parts.append(f"{f['name']}={'/'.join(f.get('values', []))}")
+        elif t == "int":
+            if "min" in f and "max" in f:
+                parts.append(f"{f['name']}=int:{f['min']}-{f['max']}")
+            else:
+                parts.append(f"{f['name']}=int")
+        elif t == "number":
+            parts.append(f"{f['name']}=number")
+        elif f.get("max_tokens"):
+            parts.append(f"{f['name']}=text:{f['max_tokens']}")
+        else:
+            parts.append(f["name"])
+    return "; ".join(parts)
+
+
+def _field_tokens(field: Dict[str, Any]) -> int:
+    t = field.get("type", "text")
+    if t == "enum":
+        return max((estimate_tokens(v) for v in field.get("values", [])), default=1)
+    if t == "int":
+        # 按每位数字 1 token 计（部分分词器逐位切分），未声明范围时按 6 位
+        if "min" in field and "max" in field:
+            return max(len(str(field["min"])), len(str(field["max"])))
+        return 6
+    if t == "number":
+        return 8
+    return int(field.get("max_tokens") or DEFAULT_TEXT_TOKENS)
+
+
+def estimate_output_tokens(
+    fields: List[Dict[str, Any]], delimiter: str = "", fmt: str = "delimited"
+) -> int:
+    """按字段推算单行输出所需的 max_tokens（含余量）；未声明字段时返回 0。"""
+    if not fields:
+        return 0
+    raw = sum(_field_tokens(f) for f in fields)
+    if fmt == "json":
+        # 字段名、引号、冒号、逗号与花括号
+        raw += sum(estimate_tokens(f["name"]) + 4 for f in fields) + 2
+    else:
+        raw += (len(fields) - 1) * max(1, estimate_tokens(delimiter))
+    return int(math.ceil(raw * MAX_TOKENS_FACTOR)) + MAX_TOKENS_MARGIN
+
+
+def normalize_output_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """补全缺省字段，返回可直接写入模板 JSON 的输出配置。"""
+    out = dict(DEFAULT_OUTPUT)
+    out.update(cfg or {})
+    out["fields"] = list(out.get("fields") or [])
+    out["max_tokens"] = max(0, int(out.get("max_tokens") or 0))
+    out["limit_length"] = bool(out.get("limit_length"))
+    out["repair"] = bool(out.get("repair"))
+    if out.get("format") not in OUTPUT_FORMATS:
+        out["format"] = "delimited"
+    return out
+
+
+def build_request_params(output_cfg: Dict[str, Any], delimiter: str = "") -> Dict[str, Any]:
+    """
+    根据输出配置生成 call_model 的额外参数（max_tokens、stop、response_format）。
+    未开启长度限制，或既未声明字段也未手动指定 max_tokens 时不含长度参数。
+    """
+    cfg = normalize_output_config(output_cfg)
+    params: Dict[str, Any] = {}
+    is_json = cfg["format"] == "json" and bool(cfg["fields"])
+    if is_json:
+        params["response_format"] = response_format(cfg["fields"])
+    if not cfg["limit_length"]:
+        return params
+    max_tokens = cfg["max_tokens"] or estimate_output_tokens(
+        cfg["fields"], delimiter, "json" if is_json else "delimited"
+    )
+    if not max_tokens:
+        return params
+    params["max_tokens"] = max_tokens
+    # JSON 可能跨行输出，只在单行分隔格式下以换行停止
+    if not is_json and delimiter != "\n":
+        params["stop"] = ["\n"]
+    return params
+
+
+# === 结构化输出与校验 ===
+
+def json_schema(fields: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """根据字段定义生成 JSON Schema。"""
+    props = {}
+    for f in fields:
+        t = f.get("type", "text")
+        if t == "enum":
+            props[f["name"]] = {"type": "string", "enum": list(f.get("values", []))}
+        elif t == "int":
+            prop: Dict[str, Any] = {"type": "integer"}
+            if "min" in f and "max" in f:
+                prop["minimum"], prop["maximum"] = f["min"], f["max"]
+            props[f["name"]] = prop
+        elif t == "number":
+            props[f["name"]] = {"type": "number"}
+        else:
+            props[f["name"]] = {"type": "string"}
+    return {
+        "type": "object",
+        "properties": props,
+        "required": [f["name"] for f in fields],
+        "additionalProperties": False,
+    }
+
+
+def response_format(fields: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """OpenAI 兼容的 response_format（json_schema）；服务端不支持时由 call_model 降级。"""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": "screening_result", "strict": True, "schema": json_schema(fields)},
+    }
+
+
+def describe_fields(fields: List[Dict[str, Any]]) -> str:
+    """用于提示词的字段说明，如：是否属于（只能为 是/否）"""
+    parts = []
+    for f in fields:
+        t = f.get("type", "text")
+        if t == "enum":
+            parts.append(f"{f['name']}（只能为 {'/'.join(f.get('values', []))}）")
+        elif t == "int":
+            rng = f"，{f['min']}–{f['max']}" if "min" in f and "max" in f else ""
+            parts.append(f"{f['name']}（整数{rng}）")
+        elif t == "number":
+            parts.append(f"{f['name']}（数值）")
+        else:
+            parts.append(f"{f['name']}（简短文本）")
+    return "；".join(parts)
+
+
+def json_instruction(fields: List[Dict[str, Any]]) -> str:
+    """JSON 模式下附加到 system 消息的输出要求（json_object 模式要求提示中出现 JSON 字样）。"""
+    example = json.dumps({f["name"]: "..." for f in fields}, ensure_ascii=False)
+    return (
+        "【输出格式】只输出一个 JSON 对象，不要输出任何其他内容。"
+        f"字段：{describe_fields(fields)}。示例结构：{example}"
+    )
+
+
+_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$", re.IGNORECASE)
+_INT_VALUE_RE = re.compile(r"^[+-]?\d+(?:\.0+)?$")
+_NUM_VALUE_RE = re.compile(r"^[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?$")
+
+
+def _coerce(field: Dict[str, Any], value) -> Tuple[bool, Any, str]:
+    """按字段类型校验并转换单个值。返回：(是否合格, 转换后的值, 错误说明)"""
+    name, t = field["name"], field.get("type", "text")
+    text = str(value).strip() if value is not None else ""
+    if t == "enum":
+        allowed = field.get("values", [])
+        if text in allowed:
+            return True, text, ""
+        lowered = {v.lower(): v for v in allowed}
+        if text.lower() in lowered:
+            return True, lowered[text.lower()], ""
+        return False, None, f"{name} 取值「{text}」不在 {'/'.join(allowed)} 中"
+    if t == "int":
+        if isinstance(value, bool) or not _INT_VALUE_RE.match(text):
+            return False, None, f"{name} 不是整数：「{text}」"
+        n = int(float(text))
+        if "min" in field and "max" in field and not field["min"] <= n <= field["max"]:
+            return False, None, f"{name} 超出范围 {field['min']}–{field['max']}：{n}"
+        return True, n, ""
+    if t == "number":
+        if isinstance(value, bool) or not _NUM_VALUE_RE.match(text):
+            return False, None, f"{name} 不是数值：「{text}」"
+        return True, float(text), ""
+    if not text:
+        return False, None, f"{name} 为空"
+    return True, text, ""
+
+
+def validate_output(
+    text: str, fields: List[Dict[str, Any]], fmt: str = "delimited", delimiter: str = ""
+) -> Tuple[bool, Optional[Dict[str, Any]], str]:
+    """
+    按字段定义校验模型输出并解析出各字段值。
+    返回：(是否合格, {字段名: 值} 或 None, 错误说明)
+    """
+    text = (text or "").strip()
+    if not text:
+        return False, None, "输出为空"
+    if fmt == "json":
+        body = _FENCE_RE.sub("", text)
+        start, end = body.find("{"), body.rfind("}")
+        if start < 0 or end < start:
+            return False, None, "不是 JSON 对象"
+        try:
+            data = json.loads(body[start:end + 1])
+        except ValueError as e:
+            return False, None, f"JSON 解析失败：{e}"
+        if not isinstance(data, dict):
+            return False, None, "不是 JSON 对象"
+        raw = []
+        for f in fields:
+            if f["name"] not in data:
+                return False, None, f"缺少字段 {f['name']}"
+            raw.append(data[f["name"]])
+    else:
+        if len(fields) > 1 and not delimiter:
+            return False, None, "未设置分隔符，无法拆分多个字段"
+        raw = text.split(delimiter) if delimiter else [text]
+        if len(raw) != len(fields):
+            return False, None, f"字段数应为 {len(fields)}，实际为 {len(raw)}"
+    parsed = {}
+    for f, v in zip(fields, raw):
+        ok, value, err = _coerce(f, v)
+        if not ok:
+            return False, None, err
+        parsed[f["name"]] = value
+    return True, parsed, ""
+
+
+def format_parsed(parsed: Dict[str, Any], fields: List[Dict[str, Any]], delimiter: str) -> str:
+    """将解析后的字段值按分隔符拼回单行（写入 AI_Output 汇总列）。"""
+    return (delimiter or FALLBACK_DELIMITER).join(str(parsed[f["name"]]) for f in fields)
+
+
+def repair_prompt(
+    bad_output: str,
+    error: str,
+    fields: List[Dict[str, Any]],
+    fmt: str = "delimited",
+    delimiter: str = "",
+) -> str:
+    """
+    修复提示：只给出上一轮的不合格输出与格式要求，要求模型改写为合格格式，
+    不重复发送原文，代价远低于整行重试。
+    """
+    if fmt == "json":
+        target = f"只输出一个 JSON 对象，字段：{describe_fields(fields)}。"
+    else:
+        target = (
+            f"只输出一行，依次包含 {len(fields)} 个字段：{describe_fields(fields)}；"
+            f"字段之间使用分隔符 {delimiter}，不要输出其他任何内容。"
+        )
+    return (
+        "下面是一段不符合格式要求的筛选结果，请在不改变其判断结论的前提下，将其改写为合格格式。\n"
+        f"问题：{error}\n"
+        f"要求：{target}\n\n"
+        f"【原输出】\n{bad_output}"
+    )
+
+
+# === 结果拆分与摘要 ===
+
+# 整数字段直方图的分箱数
+HISTOGRAM_BINS = 10
+
+
+def split_output_columns(
+    outputs: pd.Series, fields: List[Dict[str, Any]], delimiter: str = ""
+) -> pd.DataFrame:
+    """
+    按字段定义把 AI_Output 一次性拆成类型列（列名 AI_<字段名>，索引与 outputs 一致）：
+    枚举为 category，整数为 Int64，数值为 Float64，文本为 string；
+    不合格或失败（FAIL）的取值为空值。
+    """
+    outputs = outputs.astype("string").str.strip()
+    if len(fields) > 1:
+        parts = outputs.str.split(delimiter or FALLBACK_DELIMITER, n=len(fields) - 1, expand=True, regex=False)
+        parts = parts.reindex(columns=range(len(fields)))
+    else:
+        parts = outputs.to_frame(0)
+    frame = pd.DataFrame(index=outputs.index)
+    for i, f in enumerate(fields):
+        raw = parts[i].astype("string").str.strip()
+        t = f.get("type", "text")
+        if t == "enum":
+            col = pd.Categorical(raw, categories=f.get("values", []))
+        elif t in ("int", "number"):
+            num = pd.to_numeric(raw, errors="coerce")
+            if t == "int":
+                num = num.where(num == num.round())
+                if "min" in f and "max" in f:
+                    num = num.where(num.between(f["min"], f["max"]))
+                col = num.astype("Int64")
+            else:
+                col = num.astype("Float64")
+        else:
+            col = raw.mask(raw == "FAIL").replace("", pd.NA)
+        frame[f"AI_{f['name']}"] = col
+    return frame
+
+
+def failed_rows_mask(outputs: pd.Series) -> pd.Series:
+    """AI_Output 为空或以 FAIL 开头（失败占位）的行。"""
+    text = outputs.astype("string").str.strip()
+    return (text.isna() | (text == "") | text.str.startswith("FAIL")).fillna(True).astype(bool)
+
+
+def summarize_fields(frame: pd.DataFrame, fields: List[Dict[str, Any]]) -> List[str]:
+    """基于 split_output_columns 的结果生成日志摘要：枚举计数、整数直方图、数值分位数。"""
+    lines = []
+    for f in fields:
+        col = frame[f"AI_{f['name']}"]
+        missing = int(col.isna().sum())
+        tail = f"，无效 {missing}" if missing else ""
+        t = f.get("type", "text")
+        valid = col.dropna()
+        if t == "enum":
+            counts = col.value_counts(sort=False)
+            body = " / ".join(f"{k} {int(v)}" for k, v in counts.items())
+            lines.append(f"{f['name']}：{body}{tail}")
+        elif valid.empty:
+            lines.append(f"{f['name']}：无有效值{tail}")
+        elif t == "int" and "min" in f and "max" in f:
+            lo, hi = f["min"], f["max"]
+            width = max(1, math.ceil((hi - lo) / HISTOGRAM_BINS))
+            last = min(HISTOGRAM_BINS - 1, (hi - lo) // width)
+            bins = ((valid.astype("int64") - lo) // width).clip(upper=last).value_counts().sort_index()
+            labels = []
+            for b, n in bins.items():
+                start, end = lo + int(b) * width, hi if b == last else lo + (int(b) + 1) * width - 1
+                labels.append(f"{start}-{end}:{int(n)}" if end > start else f"{start}:{int(n)}")
+            body = " ".join(labels)
+            lines.append(f"{f['name']}：均值 {valid.mean():.1f}，分布 {body}{tail}")
+        elif t in ("int", "number"):
+            q = valid.astype("float64").quantile([0, 0.5, 1])
+            lines.append(
+                f"{f['name']}：最小 {q[0]:g} / 中位 {q[0.5]:g} / 最大 {q[1]:g}，均值 {valid.mean():.1f}{tail}"
+            )
+        else:
+            lines.append(f"{f['name']}：非空 {len(valid)}{tail}")
+    return lines
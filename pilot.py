@@ -0,0 +1,152 @@
+"""
+试运行：大任务开始前，用当前模板与真实处理流程（run_processing）跑一小批分层随机抽样的行
+- 按参与列合并文本的长度分层（四分位）、按比例抽样，长行与短行都有代表
+- 报告成功率与格式错误率、单次请求延迟 p50/p95、每行 token，并按当前并发数推算全量耗时与 token 总量
+- 试运行结果写入临时文件后丢弃，不影响正式输出；不读写持久缓存，以测得真实调用
+- 不导出运行指标、时间线与行明细，用量不计入 profile 累计（见 probe_options，并发测速同样适用）
+"""
+import math
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from api import run_processing
+from fingerprint import row_texts
+
+DEFAULT_PILOT_ROWS = 50
+LENGTH_STRATA = 4
+# 正式运行才需要的副作用：运行指标、时间线、行明细列、profile 累计用量
+PROBE_EXCLUDED = ("metrics", "trace", "provenance", "profile")
+
+
+def probe_options(options: Dict[str, Any] = None) -> Dict[str, Any]:
+    """试运行 / 测速用的 options 副本：去掉 PROBE_EXCLUDED 中的设置，全量模式运行且不读写持久缓存。"""
+    probe = {k: v for k, v in (options or {}).items() if k not in PROBE_EXCLUDED}
+    probe.update(mode="full", persistent_cache=False)
+    return probe
+
+
+def stratified_sample(df: pd.DataFrame, cols: List[str], n: int, seed: int = 0) -> pd.DataFrame:
+    """按参与列文本长度的分位数分层，各层按比例随机抽样，共 n 行（保持原行顺序）。"""
+    if n >= len(df):
+        return df
+    if not cols:
+        return df.sample(n=n, random_state=seed).sort_index()
+    lengths = row_texts(df, cols).apply(lambda col: col.str.len()).sum(axis=1)
+    strata = pd.qcut(lengths.rank(method="first"), min(LENGTH_STRATA, n), labels=False)
+    # 按比例分配各层行数（最大余数法，合计恰为 n）
+    quotas = strata.value_counts().sort_index() * n / len(df)
+    counts = np.floor(quotas).astype(int)
+    counts[(quotas - counts).sort_values(ascending=False).index[: n - counts.sum()]] += 1
+    picked = [
+        df[strata == k].sample(n=int(c), random_state=seed) for k, c in counts.items() if c > 0
+    ]
+    return pd.concat(picked).sort_index()
+
+
+def _format_duration(seconds: float) -> str:
+    m, s = divmod(int(round(seconds)), 60)
+    h, m = divmod(m, 60)
+    return f"{h}小时{m:02d}分" if h else f"{m}分{s:02d}秒"
+
+
+def summarize_pilot(
+    results: List[Dict[str, Any]],
+    sample_rows: int,
+    total_rows: int,
+    elapsed: float,
+    max_workers: int,
+) -> List[str]:
+    """试运行报告（各行文本）。results 为模型作答各行的最终结果。"""
+    lines = []
+    api_rows = len(results)
+    if not api_rows:
+        return [f"抽样 {sample_rows} 行均未调用模型（由规则、分类器等本地判定），无法推算耗时"]
+    errors = [r for r in results if r["error"]]
+    format_errors = [r for r in errors if r["error_msg"] != "API 返回空"]
+    repaired = sum(1 for r in results if r.get("repaired"))
+    lines.append(
+        f"抽样 {sample_rows} 行，其中 {api_rows} 行调用模型：成功 {api_rows - len(errors)} 行"
+        f"（{1 - len(errors) / api_rows:.1%}），格式错误 {len(format_errors)} 行（{len(format_errors) / api_rows:.1%}），"
+        f"调用失败 {len(errors) - len(format_errors)} 行；经修复提示通过 {repaired} 行"
+    )
+    latencies = np.array([r["latency"] for r in results if "latency" in r])
+    if len(latencies):
+        p50, p95 = np.percentile(latencies, [50, 95])
+        lines.append(f"单行请求延迟：p50 {p50:.2f}s，p95 {p95:.2f}s，最大 {latencies.max():.2f}s")
+    prompt_tokens = np.mean([r.get("usage", {}).get("prompt_tokens", 0) for r in results])
+    completion_tokens = np.mean([r.get("usage", {}).get("completion_tokens", 0) for r in results])
+    lines.append(f"每行 token：输入约 {prompt_tokens:.0f}，输出约 {completion_tokens:.0f}")
+
+    # 全量推算：抽样中调用模型的比例 × 总行数；耗时按并发数分批、每批取平均延迟（另给出按实测吞吐的估计）
+    projected_calls = total_rows * api_rows / sample_rows
+    if len(latencies):
+        by_latency = math.ceil(projected_calls / max(1, max_workers)) * float(latencies.mean())
+        by_throughput = projected_calls / (api_rows / elapsed) if elapsed > 0 else by_latency
+        lines.append(
+            f"全量 {total_rows} 行预计调用模型约 {projected_calls:.0f} 行；并发数 {max_workers} 下预计耗时 "
+            f"{_format_duration(by_latency)}（按平均延迟）～{_format_duration(max(by_latency, by_throughput))}（按试运行实测吞吐）"
+        )
+    lines.append(
+        f"预计 token 总量：输入约 {projected_calls * prompt_tokens:,.0f}，输出约 {projected_calls * completion_tokens:,.0f}"
+    )
+    if format_errors and len(format_errors) / api_rows > 0.05:
+        lines.append("[提示] 格式错误率超过 5%，建议先调整模板的输出要求或输出字段定义")
+    return lines
+
+
+def run_pilot(
+    input_path: str,
+    cols: List[str],
+    delimiter: str,
+    prompt: str,
+    sample_size: int,
+    progress_cb,
+    log_cb,
+    stop_flag,
+    max_workers: int = 20,
+    options: Dict[str, Any] = None,
+) -> Tuple[bool, str]:
+    """对分层抽样的 sample_size 行运行真实处理流程并报告推算结果。返回：(是否成功, 报告)"""
+    try:
+        df = pd.read_excel(input_path)
+    except Exception as e:
+        return False, f"读取 Excel 失败: {e}"
+    missing = [c for c in cols if c not in df.columns]
+    if missing:
+        return False, f"所选列不存在: {', '.join(missing)}"
+    sample = stratified_sample(df, list(cols), int(sample_size))
+    log_cb(f"试运行：从 {len(df)} 行中按文本长度分层抽取 {len(sample)} 行")
+
+    options = probe_options(options)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        sample_path = os.path.join(tmp, "pilot_input.xlsx")
+        sample.to_excel(sample_path, index=False)
+        started = time.perf_counter()
+        ok, msg = run_processing(
+            sample_path,
+            cols,
+            delimiter,
+            os.path.join(tmp, "pilot_output.xlsx"),
+            prompt,
+            progress_cb,
+            log_cb,
+            stop_flag,
+            max_workers,
+            options,
+            result_cb=results.append,
+        )
+        elapsed = time.perf_counter() - started
+    if not ok:
+        return False, f"试运行未完成：{msg}"
+
+    lines = summarize_pilot(results, len(sample), len(df), elapsed, max_workers)
+    log_cb("试运行报告：")
+    for line in lines:
+        log_cb(f"  {line}")
+    return True, "\n".join(lines)
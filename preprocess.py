@@ -0,0 +1,130 @@
+"""
+发送前的输入预处理：文本清洗与按 token 预算截断
+- normalize_text：去除 HTML 标签/实体、版权声明等模板化文字，压缩空白
+- 单列预算：{列名: token 上限}；整行预算：所有参与列合计上限（短列保留完整，长列按比例让出）
+"""
+import html
+import re
+from typing import Dict, List, Tuple
+
+from tokens import estimate_tokens, truncate_tokens
+
+_SCRIPT_STYLE_RE = re.compile(r"<(script|style)\b[^>]*>.*?</\1\s*>", re.IGNORECASE | re.DOTALL)
+# 文献与网页导出中常见的 HTML / JATS 标签名；只删除这些标签，且属性须为 name="value" 形式，
+# 避免把 "P < 0.001"、"<LOQ and >ULOQ"、"18<x and y>65" 等比较符号之间的文字当作标签删除
+_TAG_NAMES = (
+    "a|abbr|abstract|b|big|blockquote|body|bold|br|caption|center|cite|code|col|dd|del|dfn|div|dl|dt|em|font|"
+    "h[1-6]|head|hr|html|i|img|ins|italic|kbd|label|li|link|mark|meta|ol|p|pre|q|s|sc|sec|small|span|strike|"
+    "strong|sub|sup|table|tbody|td|tfoot|th|thead|title|tr|tt|u|ul|underline|wbr"
+)
+_TAG_ATTRS = r"""(?:\s+[\w:-]+\s*=\s*(?:"[^"<>]*"|'[^'<>]*'|[^\s"'<>]+))*\s*/?>"""
+_BLOCK_TAG_RE = re.compile(rf"<(?:br|/(?:[a-z]+:)?(?:p|div|li|h[1-6]|tr|sec|title))\b{_TAG_ATTRS}", re.IGNORECASE)
+_TAG_RE = re.compile(rf"</?(?:[a-z]+:)?(?:{_TAG_NAMES})\b{_TAG_ATTRS}", re.IGNORECASE)
+_COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+_INLINE_SPACE_RE = re.compile(r"[ \t\r\f\v\u00a0\u3000]+")
+_NEWLINES_RE = re.compile(r" *\n[ \n]*")
+
+# 文献导出中常见、对判定无用的模板化语句（按句删除）
+_BOILERPLATE_RE = re.compile(
+    r"(?:"
+    r"(?:©|copyright\s*(?:©|\(c\))?\s*\d{4})[^.\n。]*(?:[.。]|$)"
+    r"|all rights reserved[.。]?"
+    r"|this is an open access article[^.\n。]*(?:[.。]|$)"
+    r"|published by elsevier[^.\n。]*(?:[.。]|$)"
+    r"|版权所有[^。\n]*(?:。|$)"
+    r")",
+    re.IGNORECASE,
+)
+
+
+def normalize_text(text: str) -> str:
+    """清洗单元格文本：HTML → 纯文本、删除版权等模板化语句、压缩空白。"""
+    if not text:
+        return ""
+    if "<" in text and ">" in text:
+        text = _SCRIPT_STYLE_RE.sub(" ", text)
+        text = _COMMENT_RE.sub(" ", text)
+        text = _BLOCK_TAG_RE.sub("\n", text)
+        text = _TAG_RE.sub(" ", text)
+    if "&" in text:
+        text = html.unescape(text)
+    text = _BOILERPLATE_RE.sub(" ", text)
+    text = _INLINE_SPACE_RE.sub(" ", text)
+    text = _NEWLINES_RE.sub("\n", text)
+    return text.strip()
+
+
+def allocate_row_budget(token_counts: Dict[str, int], budget: int) -> Dict[str, int]:
+    """
+    将整行预算分配给各列（注水法）：短列保留完整，剩余预算在长列之间平分。
+    返回需要截断的列及其上限 {列名: 上限}；未超预算时返回空字典。
+    """
+    if budget is None or budget <= 0 or sum(token_counts.values()) <= budget:
+        return {}
+    remaining = budget
+    pending = sorted(token_counts.items(), key=lambda kv: kv[1])
+    limits = {}
+    while pending:
+        share = remaining / len(pending)
+        name, n = pending[0]
+        if n <= share:
+            remaining -= n
+            pending.pop(0)
+            continue
+        for name, n in pending:
+            limits[name] = max(1, int(share))
+        break
+    return limits
+
+
+def preprocess_values(
+    values: Dict[str, str],
+    row_cols: List[str],
+    normalize: bool = False,
+    column_budgets: Dict[str, int] = None,
+    row_budget: int = 0,
+) -> Tuple[Dict[str, str], List[str]]:
+    """
+    对一行的列值做预处理。
+    - row_cols: 计入整行预算的列（即合并进 {merged_text} 的列）
+    返回：(处理后的 values, 被截断的列名列表)
+    """
+    column_budgets = column_budgets or {}
+    out = {}
+    truncated = []
+    for c, v in values.items():
+        if normalize:
+            v = normalize_text(v)
+        limit = column_budgets.get(c)
+        if limit:
+            v, cut = truncate_tokens(v, limit)
+            if cut:
+                truncated.append(c)
+        out[c] = v
+    if row_budget:
+        counts = {c: estimate_tokens(out[c]) for c in row_cols if c in out}
+        for c, limit in allocate_row_budget(counts, row_budget).items():
+            out[c], cut = truncate_tokens(out[c], limit)
+            if cut and c not in truncated:
+                truncated.append(c)
+    return out, truncated
+
+
+def parse_column_budgets(text: str) -> Dict[str, int]:
+    """解析「摘要=800, 标题=100」形式的单列预算设置；格式错误的项忽略。"""
+    budgets = {}
+    for part in re.split(r"[,，;；\n]", text or ""):
+        name, sep, value = part.partition("=")
+        if not sep:
+            continue
+        try:
+            n = int(value.strip())
+        except ValueError:
+            continue
+        if name.strip() and n > 0:
+            budgets[name.strip()] = n
+    return budgets
+
+
+def format_column_budgets(budgets: Dict[str, int]) -> str:
+    return ", ".join(f"{k}={v}" for k, v in (budgets or {}).items())
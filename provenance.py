@@ -0,0 +1,71 @@
+"""
+行明细列：每行结果的来源、作答模型、请求与重试次数、排队等待与请求耗时
+- 与 AI_Prompt_Tokens 等用量列一起，可在运行后直接用 pandas 分析慢行与高开销行
+- 一行涉及多次请求（分块、投票、级联升级）时，次数与耗时为各次请求之和，模型按首次使用的顺序列出
+"""
+from typing import Any, Dict
+
+import pandas as pd
+
+# 结果来源：键为内部值，值为 AI_Source 列的显示名
+SOURCES = {
+    "model": "模型",
+    "run_cache": "任务内重复行",
+    "persistent_cache": "持久缓存",
+    "carried": "沿用上次结果",
+    "dedup": "近似重复",
+    "rule": "规则",
+    "learned": "分类器",
+}
+
+COLUMNS = {
+    "source": "AI_Source",
+    "models": "AI_Model",
+    "requests": "AI_Requests",
+    "attempts": "AI_Attempts",
+    "queue_wait": "AI_Queue_Wait_s",
+    "latency": "AI_Latency_s",
+}
+
+
+def result_source(r: Dict[str, Any]) -> str:
+    """run_processing 结果 dict 的来源（SOURCES 的键）。"""
+    if r.get("source"):
+        return r["source"]
+    if r.get("rule"):
+        return "rule"
+    if r.get("learned") is not None:
+        return "learned"
+    return "model"
+
+
+def new_trace() -> Dict[str, Any]:
+    return {"requests": 0, "attempts": 0, "queue_wait": 0.0, "latency": 0.0, "models": []}
+
+
+def add_request(trace: Dict[str, Any], model: str, r: Dict[str, Any], queue_wait: float) -> None:
+    """把一次 process_row 请求计入该行的明细。"""
+    trace["requests"] += 1
+    trace["attempts"] += int(r.get("attempts", 1))
+    trace["queue_wait"] += max(0.0, queue_wait)
+    trace["latency"] += float(r.get("latency", 0.0))
+    if model not in trace["models"]:
+        trace["models"].append(model)
+
+
+def provenance_frame(sources: Dict[Any, str], traces: Dict[Any, Dict[str, Any]]) -> pd.DataFrame:
+    """按行号生成明细列（sources: 行 -> 来源键；traces: 行 -> 请求明细，仅调用了模型的行）。"""
+    records = {}
+    for idx, source in sources.items():
+        trace = traces.get(idx)
+        record = {COLUMNS["source"]: SOURCES[source]}
+        if trace and source == "model":
+            record.update({
+                COLUMNS["models"]: " + ".join(trace["models"]),
+                COLUMNS["requests"]: trace["requests"],
+                COLUMNS["attempts"]: trace["attempts"],
+                COLUMNS["queue_wait"]: round(trace["queue_wait"], 3),
+                COLUMNS["latency"]: round(trace["latency"], 3),
+            })
+        records[idx] = record
+    return pd.DataFrame.from_dict(records, orient="index", columns=list(COLUMNS.values()))
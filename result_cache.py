@@ -0,0 +1,218 @@
+"""
+持久结果缓存：以行指纹（AI_Fingerprint）为键，保存成功的 AI_Output
+- 行指纹已包含 Prompt、模型与相关设置，修改任一项后旧条目自然不再命中
+- seed_from_workbook：把已有输出文件（输入列 + AI_Output）按当前任务指纹批量导入，
+  同事的运行结果或旧版本工具的输出可以直接复用
+- export_pack / import_pack：导出为单个压缩缓存包（附清单：模型、base_url、任务指纹），
+  在其他电脑上按合并语义导入并统计新增、相同与冲突条目
+"""
+import json
+import sqlite3
+import time
+import zipfile
+from typing import Dict, Iterable, List, Tuple
+
+import pandas as pd
+
+from config import CACHE_PATH
+from fingerprint import row_fingerprints
+from output_schema import failed_rows_mask
+
+# SQLite 单条语句的参数个数上限较低，批量查询时分批
+_QUERY_BATCH = 500
+
+# 缓存包格式标识与版本
+PACK_FORMAT = "autoscreen-cache-pack"
+PACK_VERSION = 1
+PACK_EXTENSION = ".aspack"
+
+
+class ResultCache:
+    """基于 SQLite 的行结果缓存；只应在创建它的线程中使用。"""
+
+    def __init__(self, path: str = CACHE_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "fingerprint TEXT PRIMARY KEY, output TEXT NOT NULL, source TEXT, updated REAL)"
+        )
+        # 旧版本缓存没有任务指纹/模型列，按需补齐
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}
+        for col in ("job", "model", "base_url"):
+            if col not in existing:
+                self._conn.execute(f"ALTER TABLE results ADD COLUMN {col} TEXT DEFAULT ''")
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_many(self, fingerprints: Iterable[str]) -> Dict[str, str]:
+        """批量查询，返回 {指纹: AI_Output}（未命中的指纹不出现在结果中）。"""
+        keys = list(dict.fromkeys(fingerprints))
+        found = {}
+        for i in range(0, len(keys), _QUERY_BATCH):
+            batch = keys[i:i + _QUERY_BATCH]
+            marks = ",".join("?" * len(batch))
+            found.update(self._conn.execute(
+                f"SELECT fingerprint, output FROM results WHERE fingerprint IN ({marks})", batch
+            ).fetchall())
+        return found
+
+    def put_many(
+        self,
+        items: Iterable[Tuple[str, str]],
+        source: str = "",
+        job: str = "",
+        model: str = "",
+        base_url: str = "",
+    ) -> int:
+        """批量写入（已存在的指纹覆盖为新结果），返回写入条数。"""
+        now = time.time()
+        rows = [(fp, out, job, model, base_url, source, now) for fp, out in items]
+        self._insert(rows)
+        return len(rows)
+
+    def _insert(self, rows: List[tuple]) -> None:
+        """rows: (fingerprint, output, job, model, base_url, source, updated)"""
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO results "
+                "(fingerprint, output, job, model, base_url, source, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def all_entries(self) -> List[tuple]:
+        """全部条目：(fingerprint, output, job, model, base_url, source, updated)"""
+        return self._conn.execute(
+            "SELECT fingerprint, output, job, model, base_url, source, updated FROM results"
+        ).fetchall()
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def clear(self) -> None:
+        with self._conn:
+            self._conn.execute("DELETE FROM results")
+        self._conn.execute("VACUUM")
+
+
+def seed_from_workbook(
+    path: str,
+    cols: List[str],
+    job_fp: str,
+    cache: ResultCache,
+    model: str = "",
+    base_url: str = "",
+) -> Tuple[bool, str, pd.Series]:
+    """
+    将已有输出文件中成功的结果按当前任务指纹导入缓存。
+    返回：(是否成功, 说明, 导入条目的行指纹 Series)
+    """
+    try:
+        df = pd.read_excel(path)
+    except Exception as e:
+        return False, f"读取文件失败: {e}", pd.Series(dtype=object)
+    missing = [c for c in list(cols) + ["AI_Output"] if c not in df.columns]
+    if missing:
+        return False, f"文件缺少列: {', '.join(missing)}", pd.Series(dtype=object)
+    df = df[~failed_rows_mask(df["AI_Output"])]
+    fps = row_fingerprints(df, cols, job_fp)
+    outputs = df["AI_Output"].astype(str).str.strip()
+    n = cache.put_many(zip(fps, outputs), source=path, job=job_fp, model=model, base_url=base_url)
+    return True, f"已导入 {n} 条结果", fps
+
+
+def export_pack(cache: ResultCache, path: str) -> Dict:
+    """
+    将缓存导出为压缩包（zip，LZMA 压缩）：
+    - manifest.json：格式版本、条目数，以及各任务指纹对应的模型、base_url 与条目数
+    - entries.json：相同的结果文本只存一份（outputs 列表），条目按下标引用
+    返回清单内容。
+    """
+    entries = cache.all_entries()
+    outputs: Dict[str, int] = {}
+    jobs: Dict[Tuple[str, str, str], int] = {}
+    rows = []
+    for fp, out, job, model, base_url, source, updated in entries:
+        o = outputs.setdefault(out, len(outputs))
+        key = (job or "", model or "", base_url or "")
+        j = jobs.setdefault(key, len(jobs))
+        rows.append([fp, o, j, source or "", updated or 0])
+    job_counts = [0] * len(jobs)
+    for r in rows:
+        job_counts[r[2]] += 1
+    manifest = {
+        "format": PACK_FORMAT,
+        "version": PACK_VERSION,
+        "created": time.time(),
+        "entries": len(rows),
+        "distinct_outputs": len(outputs),
+        "jobs": [
+            {"job": job, "model": model, "base_url": base_url, "entries": job_counts[i]}
+            for (job, model, base_url), i in jobs.items()
+        ],
+    }
+    payload = {"outputs": list(outputs), "entries": rows}
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_LZMA) as zf:
+        zf.writestr("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+        zf.writestr("entries.json", json.dumps(payload, ensure_ascii=False, separators=(",", ":")))
+    return manifest
+
+
+def read_pack_manifest(path: str) -> Dict:
+    """读取缓存包清单；不是有效缓存包时抛出 ValueError。"""
+    try:
+        with zipfile.ZipFile(path) as zf:
+            manifest = json.loads(zf.read("manifest.json").decode("utf-8"))
+    except (zipfile.BadZipFile, KeyError, ValueError) as e:
+        raise ValueError(f"不是有效的缓存包: {e}")
+    if manifest.get("format") != PACK_FORMAT:
+        raise ValueError("不是有效的缓存包")
+    if int(manifest.get("version", 0)) > PACK_VERSION:
+        raise ValueError(f"缓存包版本 {manifest.get('version')} 高于当前程序支持的版本，请升级后再导入")
+    return manifest
+
+
+def import_pack(cache: ResultCache, path: str, prefer_incoming: bool = False) -> Dict[str, int]:
+    """
+    按合并语义导入缓存包：
+    - 本地没有的指纹直接加入（added）
+    - 本地已有且结果相同的跳过（identical）
+    - 本地已有但结果不同的计为冲突（conflicts）；默认保留本地结果，prefer_incoming 时以包内结果覆盖
+    返回各计数。
+    """
+    read_pack_manifest(path)
+    with zipfile.ZipFile(path) as zf:
+        payload = json.loads(zf.read("entries.json").decode("utf-8"))
+        manifest = json.loads(zf.read("manifest.json").decode("utf-8"))
+    outputs = payload["outputs"]
+    jobs = manifest.get("jobs", [])
+    local = cache.get_many(e[0] for e in payload["entries"])
+    counts = {"added": 0, "identical": 0, "conflicts": 0, "replaced": 0}
+    rows = []
+    for fp, o, j, source, updated in payload["entries"]:
+        out = outputs[o]
+        mine = local.get(fp)
+        if mine is not None:
+            if mine == out:
+                counts["identical"] += 1
+                continue
+            counts["conflicts"] += 1
+            if not prefer_incoming:
+                continue
+            counts["replaced"] += 1
+        else:
+            counts["added"] += 1
+        meta = jobs[j] if j < len(jobs) else {}
+        rows.append((
+            fp, out, meta.get("job", ""), meta.get("model", ""), meta.get("base_url", ""),
+            source or path, updated or time.time(),
+        ))
+    cache._insert(rows)
+    return counts
@@ -0,0 +1,150 @@
+"""
+本地关键词 / 正则规则预筛
+- 每个模板可定义若干规则，命中的行直接写入规则给定的输出，不再调用 API
+- 所有规则的关键词合并为一个正则，每行只扫描一遍；/.../ 正则各自单独编译（命名组与反向引用按各自的写法生效）
+- 以字母或数字开头/结尾的关键词按整词匹配（review 不命中 peer-reviewed，rat 不命中 rate），中文关键词按子串匹配
+- 规则简写（每行一条，按顺序优先）：
+  综述: review, systematic review, 综述 => 否|不保留|0
+  动物实验: /\\b(mice|rats?)\\b/ => 否|不保留|0
+  关键词不区分大小写；/.../ 内为正则表达式；=> 后为命中时写入 AI_Output 的结果
+"""
+import re
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+DEFAULT_RULES = {
+    "enabled": False,
+    "rules": [],  # [{"name": str, "patterns": [str], "output": str}]
+}
+
+_RULE_RE = re.compile(r"^(?P<name>[^:：]+)[:：](?P<patterns>.*?)=>(?P<output>.*)$")
+# 关键词以逗号分隔；/.../ 正则内部的逗号不作分隔
+_PATTERN_ITEM_RE = re.compile(r"\s*(/(?:\\.|[^/\\])+/|[^,，]+)")
+
+
+def parse_rules(text: str) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    解析规则简写。
+    返回：(规则列表, 错误说明列表)
+    """
+    rules, errors = [], []
+    for lineno, line in enumerate((text or "").splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        m = _RULE_RE.match(line)
+        if not m:
+            errors.append(f"第 {lineno} 行格式应为「名称: 关键词1, 关键词2 => 输出」")
+            continue
+        patterns = [p.strip() for p in _PATTERN_ITEM_RE.findall(m.group("patterns")) if p.strip()]
+        output = m.group("output").strip()
+        if not patterns or not output:
+            errors.append(f"第 {lineno} 行缺少关键词或输出")
+            continue
+        bad = False
+        for p in patterns:
+            if _is_regex(p):
+                try:
+                    re.compile(p[1:-1])
+                except re.error as e:
+                    errors.append(f"第 {lineno} 行正则有误 {p}: {e}")
+                    bad = True
+        if not bad:
+            rules.append({"name": m.group("name").strip(), "patterns": patterns, "output": output})
+    return rules, errors
+
+
+def format_rules(rules: List[Dict[str, Any]]) -> str:
+    return "\n".join(
+        f"{r['name']}: {', '.join(r.get('patterns', []))} => {r.get('output', '')}" for r in rules or []
+    )
+
+
+def normalize_rules_config(cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """补全缺省字段，返回可直接写入模板 JSON 的规则配置。"""
+    out = dict(DEFAULT_RULES)
+    out.update(cfg or {})
+    out["enabled"] = bool(out.get("enabled"))
+    out["rules"] = [r for r in (out.get("rules") or []) if r.get("patterns") and r.get("output")]
+    return out
+
+
+def _is_regex(pattern: str) -> bool:
+    return len(pattern) >= 2 and pattern.startswith("/") and pattern.endswith("/")
+
+
+# 拉丁字母与数字（含带重音的拉丁字母）；关键词首尾为这些字符时要求词边界
+_LATIN = "A-Za-z0-9\u00c0-\u024f"
+_LATIN_RE = re.compile(f"[{_LATIN}]")
+
+
+def _is_latin(ch: str) -> bool:
+    return bool(_LATIN_RE.match(ch))
+
+
+def _literal_pattern(keyword: str) -> str:
+    """转义关键词；首尾为拉丁字母或数字时加词边界（review 不命中 peer-reviewed），中文关键词不加。"""
+    body = re.escape(keyword)
+    if _is_latin(keyword[0]):
+        body = f"(?<![{_LATIN}])" + body
+    if _is_latin(keyword[-1]):
+        body += f"(?![{_LATIN}])"
+    return body
+
+
+class RuleMatcher:
+    """
+    所有规则的关键词合并为一个正则，每行只扫描一遍，再按查找表（关键词 -> 规则序号）归到各条规则；
+    每个 /正则/ 单独编译，使各正则的命名组与反向引用互不干扰。
+    统计所有命中的规则，多条命中时按规则顺序取第一条。
+    """
+
+    def __init__(self, rules: List[Dict[str, Any]]):
+        """规则中的正则无法编译时抛出 re.error。"""
+        self.rules = list(rules)
+        self.hits: Counter = Counter()
+        owners: Dict[str, set] = {}
+        self._regexes = []
+        for i, rule in enumerate(self.rules):
+            for p in rule["patterns"]:
+                if _is_regex(p):
+                    self._regexes.append((i, re.compile(p[1:-1], re.IGNORECASE)))
+                elif p:
+                    owners.setdefault(p.lower(), set()).add(i)
+        # 同一位置只报告最长的关键词；位于其开头且满足词边界的较短关键词（rat / rat model）一并计入
+        self._owners: Dict[str, set] = {}
+        for keyword, ids in owners.items():
+            ids = set(ids)
+            for other, other_ids in owners.items():
+                if other != keyword and keyword.startswith(other) and not (
+                    _is_latin(other[-1]) and _is_latin(keyword[len(other)])
+                ):
+                    ids |= other_ids
+            self._owners[keyword] = ids
+        literals = sorted(owners, key=len, reverse=True)
+        # 零宽前瞻：每个位置都尝试匹配，重叠的关键词（systematic review 内的 review）也能找到
+        self._literals = (
+            re.compile(f"(?=({'|'.join(_literal_pattern(k) for k in literals)}))", re.IGNORECASE)
+            if literals else None
+        )
+
+    def match(self, text: str) -> Optional[Dict[str, Any]]:
+        """返回优先级最高的命中规则（并计入命中次数）；未命中返回 None。"""
+        if not self.rules or not text:
+            return None
+        found = set()
+        if self._literals is not None:
+            for m in self._literals.finditer(text):
+                found |= self._owners.get(m.group(1).lower(), set())
+        for i, regex in self._regexes:
+            if i not in found and regex.search(text):
+                found.add(i)
+        if not found:
+            return None
+        for i in found:
+            self.hits[self.rules[i]["name"]] += 1
+        return self.rules[min(found)]
+
+    def hit_summary(self) -> List[str]:
+        """各规则的命中次数（一行可同时命中多条规则）。"""
+        return [f"{r['name']}: {self.hits.get(r['name'], 0)}" for r in self.rules]
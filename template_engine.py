@@ -0,0 +1,175 @@
+"""
+Prompt 模板引擎：一次编译、逐行渲染
+- 占位符：{merged_text}、{delimiter}、{col:列名}
+- 过滤器：{col:摘要|truncate:1500}（按字符截断）、{col:关键词|default:无}
+- 条件段：{#col:摘要}...{/col:摘要} 该列非空时输出；{^col:摘要}...{/col:摘要} 该列为空时输出
+- 未识别的花括号内容原样保留（兼容模板中的 JSON 示例等）
+"""
+import re
+from typing import Dict, List, Optional
+
+from tokens import estimate_tokens
+
+_TAG_RE = re.compile(
+    r"\{(?P<sigil>[#^/]?)(?P<name>merged_text|delimiter|col:[^{}|]+?)(?P<filters>(?:\|[^{}|]+)*)\}"
+)
+
+
+class TemplateError(ValueError):
+    """模板语法错误（未闭合的条件段、未知过滤器等）。"""
+
+
+def _make_filter(spec: str):
+    """将 'truncate:1500' 形式的过滤器说明编译为函数。"""
+    name, _, arg = spec.partition(":")
+    name = name.strip()
+    if name == "truncate":
+        try:
+            limit = int(arg)
+        except ValueError:
+            raise TemplateError(f"truncate 需要整数参数: {spec}")
+        if limit < 0:
+            raise TemplateError(f"truncate 参数不能为负: {spec}")
+        return lambda v: v if len(v) <= limit else v[:limit] + "…"
+    if name == "default":
+        return lambda v: v if v.strip() else arg
+    raise TemplateError(f"未知过滤器: {name}")
+
+
+class CompiledTemplate:
+    """
+    编译后的模板。nodes 为节点列表：
+    - ("text", 文本)
+    - ("var", 名称, 过滤器列表, 过滤器说明列表)
+    - ("section", 列名, 是否取反, 子节点)
+    """
+
+    def __init__(self, source: str, nodes: list, columns: List[str], uses_merged_text: bool):
+        self.source = source
+        self.nodes = nodes
+        self.columns = columns
+        self.uses_merged_text = uses_merged_text
+
+    def render(self, merged_text: str = "", delimiter: str = "", values: Optional[Dict[str, str]] = None) -> str:
+        parts = []
+        self._render_nodes(self.nodes, merged_text, delimiter, values or {}, parts)
+        return "".join(parts)
+
+    def _render_nodes(self, nodes, merged_text, delimiter, values, parts):
+        for node in nodes:
+            kind = node[0]
+            if kind == "text":
+                parts.append(node[1])
+            elif kind == "var":
+                name, filters = node[1], node[2]
+                if name == "merged_text":
+                    v = merged_text
+                elif name == "delimiter":
+                    v = delimiter
+                else:
+                    v = values.get(name, "")
+                for f in filters:
+                    v = f(v)
+                parts.append(v)
+            else:
+                _, col, inverted, children = node
+                present = bool(values.get(col, "").strip())
+                if present != inverted:
+                    self._render_nodes(children, merged_text, delimiter, values, parts)
+
+    def split_static_prefix(self, delimiter: str = ""):
+        """
+        拆出模板开头与行无关的静态部分（纯文本与 {delimiter}），用于共享前缀 / Prompt 缓存。
+        返回：(静态前缀文本, 其余部分的 CompiledTemplate)
+        """
+        prefix = []
+        for i, node in enumerate(self.nodes):
+            if node[0] == "text":
+                prefix.append(node[1])
+            elif node[0] == "var" and node[1] == "delimiter":
+                v = delimiter
+                for f in node[2]:
+                    v = f(v)
+                prefix.append(v)
+            else:
+                break
+        else:
+            i = len(self.nodes)
+        rest = CompiledTemplate(self.source, self.nodes[i:], self.columns, self.uses_merged_text)
+        return "".join(prefix), rest
+
+    def estimate_tokens(
+        self,
+        column_tokens: Dict[str, float],
+        merged_tokens: float = 0.0,
+        delimiter: str = "",
+    ) -> float:
+        """
+        按列平均 token 数估算单行 Prompt 的 token 数（条件段按全部输出计，属上限估计）。
+        - column_tokens: {列名: 平均 token 数}
+        - merged_tokens: {merged_text} 的平均 token 数
+        """
+        fixed = []
+        variable = [0.0]
+
+        def walk(nodes):
+            for node in nodes:
+                if node[0] == "text":
+                    fixed.append(node[1])
+                elif node[0] == "var":
+                    name, specs = node[1], node[3]
+                    if name == "delimiter":
+                        fixed.append(delimiter)
+                        continue
+                    est = merged_tokens if name == "merged_text" else column_tokens.get(name, 0.0)
+                    for spec in specs:
+                        fname, _, arg = spec.partition(":")
+                        if fname.strip() == "truncate":
+                            est = min(est, float(arg))
+                    variable[0] += est
+                else:
+                    walk(node[3])
+
+        walk(self.nodes)
+        return estimate_tokens("".join(fixed)) + variable[0]
+
+
+def compile_template(source: str) -> CompiledTemplate:
+    """解析模板为节点树；条件段不匹配或过滤器非法时抛出 TemplateError。"""
+    root: list = []
+    stack = [(None, root)]
+    columns: List[str] = []
+    uses_merged_text = False
+    pos = 0
+
+    for m in _TAG_RE.finditer(source):
+        if m.start() > pos:
+            stack[-1][1].append(("text", source[pos:m.start()]))
+        pos = m.end()
+        sigil, name = m.group("sigil"), m.group("name")
+        col = name[4:].strip() if name.startswith("col:") else None
+        if col is not None and col not in columns:
+            columns.append(col)
+
+        if sigil in ("#", "^"):
+            if col is None:
+                raise TemplateError(f"条件段只支持列占位符: {m.group(0)}")
+            children: list = []
+            stack[-1][1].append(("section", col, sigil == "^", children))
+            stack.append((col, children))
+        elif sigil == "/":
+            if len(stack) == 1 or stack[-1][0] != col:
+                raise TemplateError(f"条件段结束标记不匹配: {m.group(0)}")
+            stack.pop()
+        else:
+            specs = [f.strip() for f in m.group("filters").split("|") if f.strip()]
+            filters = [_make_filter(f) for f in specs]
+            if name == "merged_text":
+                uses_merged_text = True
+            stack[-1][1].append(("var", col if col is not None else name, filters, specs))
+
+    if pos < len(source):
+        stack[-1][1].append(("text", source[pos:]))
+    if len(stack) > 1:
+        raise TemplateError(f"条件段未闭合: {{#col:{stack[-1][0]}}}")
+    return CompiledTemplate(source, root, columns, uses_merged_text)
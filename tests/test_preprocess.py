@@ -0,0 +1,29 @@
+from preprocess import normalize_text
+
+
+def test_comparison_operators_are_kept():
+    text = "Mortality was lower (P < 0.001) in patients aged > 65 years."
+    assert normalize_text(text) == text
+
+
+def test_comparisons_without_spaces_are_kept():
+    assert normalize_text("HbA1c <7% vs >9%, n<50") == "HbA1c <7% vs >9%, n<50"
+
+
+def test_html_tags_and_comments_are_removed():
+    text = '<p>Aged <b class="x">&gt; 65</b><br/>years<!-- note --></p>'
+    assert normalize_text(text) == "Aged > 65\nyears"
+
+
+def test_words_between_comparison_operators_are_kept():
+    text = "Samples <LOQ and >ULOQ were excluded."
+    assert normalize_text(text) == text
+
+
+def test_single_letter_variables_between_operators_are_kept():
+    text = "ages 18<x and y>65"
+    assert normalize_text(text) == text
+
+
+def test_jats_tags_are_removed():
+    assert normalize_text("<jats:p>Aged <jats:italic>n</jats:italic> = 5</jats:p>") == "Aged n = 5"
@@ -0,0 +1,42 @@
+from rules import RuleMatcher, parse_rules
+
+
+def _matcher(text):
+    rules, errors = parse_rules(text)
+    assert not errors
+    return RuleMatcher(rules)
+
+
+def test_rules_may_reuse_group_names():
+    m = _matcher("鼠: /(?P<x>mouse)/ => 否\n大鼠: /(?P<x>rat)/ => 否")
+    assert m.match("a rat model")["name"] == "大鼠"
+
+
+def test_backreferences_refer_to_own_groups():
+    m = _matcher("关键词: review => 否\n重复字母: /(\\w)\\1/ => 是")
+    assert m.match("book")["name"] == "重复字母"
+
+
+def test_all_rules_matching_at_same_position_are_counted():
+    m = _matcher("综述: review => 否\n系统综述: systematic review => 否")
+    assert m.match("A systematic review")["name"] == "综述"
+    assert m.hits == {"综述": 1, "系统综述": 1}
+
+
+def test_latin_keywords_match_whole_words():
+    m = _matcher("综述: review => 否\n大鼠: rat => 否")
+    assert m.match("A peer-reviewed study") is None
+    assert m.match("Heart rate was separate from baseline") is None
+    assert m.match("Review of rat models")["name"] == "综述"
+    assert m.hits == {"综述": 1, "大鼠": 1}
+
+
+def test_shorter_keyword_at_same_start_is_counted():
+    m = _matcher("大鼠: rat => 否\n模型: rat model => 否\n前缀: ra => 否")
+    assert m.match("a rat model")["name"] == "大鼠"
+    assert m.hits == {"大鼠": 1, "模型": 1}
+
+
+def test_chinese_keywords_match_substrings():
+    m = _matcher("综述: 综述 => 否")
+    assert m.match("本文为系统综述与荟萃分析")["name"] == "综述"
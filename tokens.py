@@ -0,0 +1,136 @@
+"""
+本地 Token 估算（不依赖在线分词器）
+- 中日韩字符按约 1 token/字，其余字符按约 4 字符/token 近似
+- 提供按列统计平均 token 数与整批耗时预估，供列选择时参考
+"""
+import bisect
+import math
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+# 中日韩统一表意文字、全角标点等，主流中文模型大多 1 字 ≈ 1 token
+_CJK_PATTERN = r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]"
+_CJK_RE = re.compile(_CJK_PATTERN)
+
+# 非 CJK 文本平均每个 token 的字符数（英文经验值）
+CHARS_PER_TOKEN = 4.0
+
+# 截断后追加的标记
+TRUNCATION_MARK = "…"
+
+# 耗时估算参数（经验值，仅用于界面预估）
+EST_BASE_LATENCY_S = 1.0  # 网络往返与服务端排队
+EST_PREFILL_TOKENS_PER_S = 3000.0  # 输入处理速度
+EST_OUTPUT_TOKENS = 16  # 单行输出（如 是|保留|85）的 token 数
+EST_DECODE_TOKENS_PER_S = 40.0  # 输出生成速度
+
+
+def estimate_tokens(text) -> int:
+    """估算单段文本的 token 数。空值返回 0。"""
+    if text is None:
+        return 0
+    text = str(text)
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / CHARS_PER_TOKEN)
+
+
+def cumulative_tokens(text: str) -> List[float]:
+    """逐字符累计 token 数（与 estimate_tokens 同一口径），result[i] 为前 i 个字符的 token 数。"""
+    out = [0.0]
+    cost = 0.0
+    other = 1.0 / CHARS_PER_TOKEN
+    for ch in text:
+        cost += 1.0 if _CJK_RE.match(ch) else other
+        out.append(cost)
+    return out
+
+
+def snap_to_boundary(text: str, end: int, window: int = 40) -> int:
+    """将截断位置回退到最近的词/句边界（窗口内找不到时保持原位置）。"""
+    head = text[max(0, end - window):end]
+    boundary = max(head.rfind(c) for c in (" ", "\n", "。", ".", "；", ";", "，", ","))
+    if boundary > 0:
+        return end - len(head) + boundary + 1
+    return end
+
+
+def truncate_tokens(text: str, budget: int) -> Tuple[str, bool]:
+    """
+    将文本截断到约 budget 个 token（与 estimate_tokens 同一口径）。
+    尽量在空白或句末标点处截断。返回：(文本, 是否发生截断)
+    """
+    if budget is None or budget <= 0 or estimate_tokens(text) <= budget:
+        return text, False
+    cut = bisect.bisect_right(cumulative_tokens(text), budget) - 1
+    head = text[:snap_to_boundary(text, cut)]
+    return head.rstrip() + TRUNCATION_MARK, True
+
+
+def estimate_series_tokens(series: pd.Series) -> pd.Series:
+    """按列批量估算每个单元格的 token 数（向量化，空值计 0）。"""
+    s = series.fillna("").astype(str)
+    cjk = s.str.count(_CJK_PATTERN)
+    other = s.str.len() - cjk
+    return (cjk + (other + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN).astype(int)
+
+
+def estimate_column_tokens(df: pd.DataFrame, cols: Optional[Iterable] = None) -> Dict[str, float]:
+    """
+    统计每列的平均 token 数（按整表行数平均）。
+    返回：{列名(str): 平均 token 数}
+    """
+    stats = {}
+    if cols is None:
+        cols = df.columns
+    for c in cols:
+        if c not in df.columns:
+            continue
+        tokens = estimate_series_tokens(df[c])
+        stats[str(c)] = float(tokens.mean()) if len(tokens) else 0.0
+    return stats
+
+
+def estimate_request_seconds(prompt_tokens: float, output_tokens: float = EST_OUTPUT_TOKENS) -> float:
+    """估算单次请求耗时（秒）：固定往返 + 输入处理 + 输出生成。"""
+    return (
+        EST_BASE_LATENCY_S
+        + max(0.0, prompt_tokens) / EST_PREFILL_TOKENS_PER_S
+        + max(0.0, output_tokens) / EST_DECODE_TOKENS_PER_S
+    )
+
+
+def project_job(n_rows: int, prompt_tokens: float, max_workers: int) -> Dict[str, float]:
+    """
+    根据每行 Prompt token 数与并发数预估整批任务。
+    返回字段：prompt_tokens, total_tokens, seconds_per_request, seconds
+    """
+    max_workers = max(1, int(max_workers or 1))
+    per_request = estimate_request_seconds(prompt_tokens)
+    n_rows = max(0, int(n_rows or 0))
+    return {
+        "prompt_tokens": float(prompt_tokens),
+        "total_tokens": float((prompt_tokens + EST_OUTPUT_TOKENS) * n_rows),
+        "seconds_per_request": per_request,
+        "seconds": per_request * math.ceil(n_rows / max_workers),
+    }
+
+
+def format_tokens(n: float) -> str:
+    """将 token 数格式化为 1.2k / 3.4M 形式。"""
+    n = float(n or 0)
+    if n >= 1_000_000:
+        return f"{n / 1_000_000:.1f}M"
+    if n >= 1_000:
+        return f"{n / 1_000:.1f}k"
+    return f"{int(round(n))}"
+
+
+def format_duration(seconds: float) -> str:
+    """将秒数格式化为 HH:MM:SS。"""
+    m, s = divmod(int(max(0, seconds)), 60)
+    h, m = divmod(m, 60)
+    return f"{h:02d}:{m:02d}:{s:02d}"
@@ -0,0 +1,125 @@
+"""
+运行时间线：记录 run_processing 各阶段与每行请求的时间段，导出为 Chrome Trace / Perfetto 可打开的 JSON
+- 同步时间段（读取 Excel、构建行、等待结果、保存 Excel，以及工作线程中的 process_row、每次 API 调用与重试等待）
+  按线程分轨显示，可看出线程池是否占满、重试是否集中爆发、最后的 to_excel 是否卡住
+- 排队等待与每行从派发到得到最终结果的全过程跨线程，记为异步时间段（单独成轨）
+- 在途请求数记为计数器轨道
+- 用 chrome://tracing 或 https://ui.perfetto.dev 打开 <输出文件名>_trace.json
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional, Tuple
+
+PID = 1
+
+
+def trace_path(output_path: str) -> str:
+    return f"{os.path.splitext(output_path)[0]}_trace.json"
+
+
+class Tracer:
+    """时间线事件收集（线程安全）；enabled 为 False 时各方法直接返回，便于无条件调用。"""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._events: List[Dict[str, Any]] = []
+        # 线程 ident -> (轨道号, 线程名)
+        self._threads: Dict[int, Tuple[int, str]] = {}
+        self._async_ids = 0
+
+    def _ts(self, t: float) -> float:
+        """perf_counter 时刻 -> 相对开始的微秒数。"""
+        return round((t - self.origin) * 1e6, 1)
+
+    def _tid(self) -> int:
+        ident = threading.get_ident()
+        entry = self._threads.get(ident)
+        if entry is None:
+            with self._lock:
+                entry = self._threads.setdefault(ident, (len(self._threads) + 1, threading.current_thread().name))
+        return entry[0]
+
+    def _add(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            self._events.append(event)
+
+    def complete(self, name: str, cat: str, start: float, end: float, **args) -> None:
+        """在当前线程的轨道上记录 [start, end]（perf_counter 时刻）的时间段。"""
+        if not self.enabled:
+            return
+        self._add({
+            "name": name, "cat": cat, "ph": "X", "pid": PID, "tid": self._tid(),
+            "ts": self._ts(start), "dur": round(max(0.0, end - start) * 1e6, 1), "args": args,
+        })
+
+    def span(self, name: str, cat: str = "phase", **args):
+        """with tracer.span(...)：记录代码块的耗时；未启用时为空上下文。"""
+        if not self.enabled:
+            return nullcontext()
+        return self._span(name, cat, args)
+
+    @contextmanager
+    def _span(self, name: str, cat: str, args: Dict[str, Any]):
+        start = time.perf_counter()
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = type(e).__name__
+            raise
+        finally:
+            self.complete(name, cat, start, time.perf_counter(), **args)
+
+    def async_span(self, name: str, cat: str, start: float, end: float, **args) -> None:
+        """跨线程的时间段（如排队等待、一行的全过程），在独立的异步轨道上显示。"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._async_ids += 1
+            span_id = self._async_ids
+        base = {"name": name, "cat": cat, "pid": PID, "tid": self._tid(), "id": span_id}
+        self._add(dict(base, ph="b", ts=self._ts(start), args=args))
+        self._add(dict(base, ph="e", ts=self._ts(max(start, end))))
+
+    def instant(self, name: str, cat: str = "event", **args) -> None:
+        if not self.enabled:
+            return
+        self._add({
+            "name": name, "cat": cat, "ph": "i", "s": "p", "pid": PID, "tid": self._tid(),
+            "ts": self._ts(time.perf_counter()), "args": args,
+        })
+
+    def counter(self, name: str, value: float) -> None:
+        if not self.enabled:
+            return
+        self._add({
+            "name": name, "ph": "C", "pid": PID, "tid": self._tid(),
+            "ts": self._ts(time.perf_counter()), "args": {name: value},
+        })
+
+    def to_dict(self, metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Chrome Trace Event 格式（JSON Object Format）。"""
+        with self._lock:
+            events = [{"name": "process_name", "ph": "M", "pid": PID, "args": {"name": "run_processing"}}]
+            for tid, name in self._threads.values():
+                events.append({"name": "thread_name", "ph": "M", "pid": PID, "tid": tid, "args": {"name": name}})
+                events.append({"name": "thread_sort_index", "ph": "M", "pid": PID, "tid": tid, "args": {"sort_index": tid}})
+            events += sorted(self._events, key=lambda e: e["ts"])
+        return {"traceEvents": events, "displayTimeUnit": "ms", "otherData": metadata or {}}
+
+    def write(self, path: str, metadata: Optional[Dict[str, Any]] = None) -> Tuple[bool, str]:
+        """写出时间线文件。返回：(是否成功, 路径或错误说明)"""
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.to_dict(metadata), f, ensure_ascii=False)
+        except Exception as e:
+            return False, f"写入时间线失败: {e}"
+        return True, path
+
+
+# 未启用时间线时的默认实例（call_model_detailed / process_row 的 tracer 参数缺省值）
+NULL_TRACER = Tracer(enabled=False)
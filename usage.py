@@ -0,0 +1,183 @@
+"""
+Token 用量与费用统计
+- 每次请求的输入 / 输出 / 缓存命中 token 按模型累计，得到每行、每个任务与每个平台（profile）的合计
+- 价格表按模型配置（元 / 百万 tokens，保存在 profile 配置中）；未配置价格的模型只统计 token，不计费用
+- 任务结束时把合计写入输出文件旁的用量摘要（<输出文件名>_用量.json），便于比较各模板的开销
+"""
+import json
+import os
+from typing import Any, Dict, List, Optional, Tuple
+
+from tokens import format_tokens
+
+USAGE_KEYS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+# 价格项：键为配置值，值为显示名；单位均为「元 / 百万 tokens」
+PRICE_KEYS = {
+    "input": "输入",
+    "output": "输出",
+    "cached_input": "缓存命中输入",
+}
+PRICE_UNIT = "元/百万 tokens"
+
+# 每行的用量列（AI_Cost 只在配置了价格时写出）
+ROW_COLUMNS = {
+    "prompt_tokens": "AI_Prompt_Tokens",
+    "completion_tokens": "AI_Completion_Tokens",
+    "cached_tokens": "AI_Cached_Tokens",
+}
+COST_COLUMN = "AI_Cost"
+
+
+def normalize_pricing(pricing: Dict[str, Any]) -> Dict[str, Dict[str, float]]:
+    """{模型: {input, output[, cached_input]}}；缺少输入或输出价格的模型被忽略。"""
+    out = {}
+    for model, prices in (pricing or {}).items():
+        if not isinstance(prices, dict) or not str(model).strip():
+            continue
+        try:
+            entry = {k: float(prices[k]) for k in PRICE_KEYS if prices.get(k) not in (None, "")}
+        except (TypeError, ValueError):
+            continue
+        if "input" in entry and "output" in entry:
+            out[str(model).strip()] = entry
+    return out
+
+
+def parse_pricing(text: str) -> Tuple[Dict[str, Dict[str, float]], List[str]]:
+    """
+    解析价格表简写，每行一个模型：
+        模型名  输入价  输出价  [缓存命中输入价]
+    价格单位为 元 / 百万 tokens；# 开头的行为注释。返回：(价格表, 错误列表)
+    """
+    pricing, errors = {}, []
+    for n, line in enumerate(str(text).splitlines(), 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split()
+        if len(parts) not in (3, 4):
+            errors.append(f"第 {n} 行应为「模型名 输入价 输出价 [缓存命中价]」: {line}")
+            continue
+        try:
+            prices = [float(p) for p in parts[1:]]
+        except ValueError:
+            errors.append(f"第 {n} 行价格不是数字: {line}")
+            continue
+        if any(p < 0 for p in prices):
+            errors.append(f"第 {n} 行价格不能为负数: {line}")
+            continue
+        pricing[parts[0]] = dict(zip(PRICE_KEYS, prices))
+    return pricing, errors
+
+
+def format_pricing(pricing: Dict[str, Dict[str, float]]) -> str:
+    """价格表的简写文本（parse_pricing 的逆操作）。"""
+    lines = []
+    for model, prices in normalize_pricing(pricing).items():
+        values = [prices["input"], prices["output"]] + ([prices["cached_input"]] if "cached_input" in prices else [])
+        lines.append(" ".join([model] + [f"{v:g}" for v in values]))
+    return "\n".join(lines)
+
+
+def request_cost(model: str, usage: Dict[str, int], pricing: Dict[str, Dict[str, float]]) -> Optional[float]:
+    """单次请求的费用（元）；模型未配置价格时为 None。缓存命中的输入 token 按缓存价计费（未配置时按输入价）。"""
+    prices = pricing.get(model)
+    if not prices:
+        return None
+    prompt = usage.get("prompt_tokens", 0)
+    cached = min(usage.get("cached_tokens", 0), prompt)
+    return (
+        (prompt - cached) * prices["input"]
+        + cached * prices.get("cached_input", prices["input"])
+        + usage.get("completion_tokens", 0) * prices["output"]
+    ) / 1e6
+
+
+def _empty() -> Dict[str, Any]:
+    return dict({k: 0 for k in USAGE_KEYS}, requests=0, cost=0.0)
+
+
+class UsageMeter:
+    """按模型累计 token 与费用（单线程使用：由 run_processing 的结果收集循环调用）。"""
+
+    def __init__(self, pricing: Dict[str, Any] = None):
+        self.pricing = normalize_pricing(pricing)
+        self.by_model: Dict[str, Dict[str, Any]] = {}
+        self.unpriced = set()
+
+    def add(self, model: str, usage: Dict[str, int]) -> Optional[float]:
+        """登记一次请求，返回其费用（未配置价格时为 None）。"""
+        entry = self.by_model.setdefault(model, _empty())
+        for k in USAGE_KEYS:
+            entry[k] += int(usage.get(k, 0) or 0)
+        entry["requests"] += 1
+        cost = request_cost(model, usage, self.pricing)
+        if cost is None:
+            self.unpriced.add(model)
+        else:
+            entry["cost"] += cost
+        return cost
+
+    def totals(self) -> Dict[str, Any]:
+        """全部模型的合计；priced 表示所有用到的模型都配置了价格（费用完整）。"""
+        out = _empty()
+        for entry in self.by_model.values():
+            for k in out:
+                out[k] += entry[k]
+        out["priced"] = bool(self.by_model) and not self.unpriced
+        return out
+
+    def summary_lines(self) -> List[str]:
+        lines = []
+        for model, e in self.by_model.items():
+            cost = f"，费用 ¥{e['cost']:.4f}" if model not in self.unpriced else "（未配置价格）"
+            hit = f"（缓存命中 {e['cached_tokens'] / e['prompt_tokens']:.0%}）" if e["prompt_tokens"] else ""
+            lines.append(
+                f"{model}：{e['requests']} 次请求，输入 {e['prompt_tokens']}{hit}，"
+                f"输出 {e['completion_tokens']}{cost}"
+            )
+        return lines
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "totals": self.totals(),
+            "by_model": {m: dict(e, priced=m not in self.unpriced) for m, e in self.by_model.items()},
+            "pricing": self.pricing,
+            "price_unit": PRICE_UNIT,
+        }
+
+
+def format_live(totals: Dict[str, Any]) -> str:
+    """进度条旁的实时用量文本。"""
+    text = (
+        f"{totals.get('requests', 0)} 次请求 · 输入 {format_tokens(totals.get('prompt_tokens', 0))}"
+        f" · 输出 {format_tokens(totals.get('completion_tokens', 0))}"
+    )
+    if totals.get("cost"):
+        text += f" · ¥{totals['cost']:.2f}" + ("" if totals.get("priced") else "+")
+    return text
+
+
+def merge_usage(stored: Dict[str, Any], by_model: Dict[str, Dict[str, Any]]) -> Dict[str, Any]:
+    """把一次任务的分模型用量累加到已保存的分模型合计上（用于 profile 累计用量）。"""
+    merged = {m: dict(e) for m, e in (stored or {}).items() if isinstance(e, dict)}
+    for model, e in by_model.items():
+        target = merged.setdefault(model, _empty())
+        for k in list(USAGE_KEYS) + ["requests", "cost"]:
+            target[k] = target.get(k, 0) + e.get(k, 0)
+    return merged
+
+
+def summary_path(output_path: str) -> str:
+    return f"{os.path.splitext(output_path)[0]}_用量.json"
+
+
+def write_job_summary(path: str, summary: Dict[str, Any]) -> Tuple[bool, str]:
+    """写出任务用量摘要（JSON）。返回：(是否成功, 说明)"""
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+    except Exception as e:
+        return False, f"写入用量摘要失败: {e}"
+    return True, path
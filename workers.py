@@ -1,26 +1,37 @@
 """
-后台工作线程：批处理 Worker 与 API 测试线程
+后台工作线程：批处理 Worker、试运行线程、A/B 实验线程、并发测速线程、API 测试线程、列 token 统计线程与缓存导入线程
 """
 import time
+from abc import ABCMeta, abstractmethod
 
+import pandas as pd
 from PyQt5.QtCore import QThread, pyqtSignal
 
-from api import run_processing, get_current_model
+from api import run_processing, get_current_model, get_current_base_url, current_job_fingerprint
+from benchmark import DEFAULT_LEVELS, run_sweep
+from experiment import run_experiment
+from fingerprint import row_fingerprints
+from pilot import run_pilot
+from result_cache import ResultCache, seed_from_workbook
+from template_engine import compile_template
+from tokens import estimate_column_tokens
 
 
-class Worker(QThread):
+class _TaskThreadMeta(type(QThread), ABCMeta):
+    """QThread 的元类与 ABCMeta 合并，使 TaskThread 可声明抽象方法。"""
+
+
+class TaskThread(QThread, metaclass=_TaskThreadMeta):
+    """
+    批处理类任务线程的公共部分：进度（含剩余时间估计）、日志与完成信号，以及停止标志。
+    子类实现 _run(prog_cb, log_cb)，返回 (是否成功, 说明)；主窗口对各任务复用同一套进度、日志与停止逻辑。
+    """
     progress = pyqtSignal(int, int, float)
     log_signal = pyqtSignal(str)
     finished = pyqtSignal(bool, str)
 
-    def __init__(self, input_path, cols, delimiter, output_path, prompt, max_workers=20):
+    def __init__(self):
         super().__init__()
-        self.input_path = input_path
-        self.cols = cols
-        self.delimiter = delimiter
-        self.output_path = output_path
-        self.prompt = prompt
-        self.max_workers = max_workers
         self._stop_flag = False
         self._start_time = None
 
@@ -41,7 +52,29 @@ class Worker(QThread):
         def log_cb(msg):
             self.log_signal.emit(msg)
 
-        ok, msg = run_processing(
+        ok, msg = self._run(prog_cb, log_cb)
+        self.finished.emit(ok, msg)
+
+    @abstractmethod
+    def _run(self, prog_cb, log_cb):
+        """执行任务，返回 (是否成功, 说明)。"""
+
+
+class Worker(TaskThread):
+    usage_signal = pyqtSignal(dict)
+
+    def __init__(self, input_path, cols, delimiter, output_path, prompt, max_workers=20, options=None):
+        super().__init__()
+        self.input_path = input_path
+        self.cols = cols
+        self.delimiter = delimiter
+        self.output_path = output_path
+        self.prompt = prompt
+        self.max_workers = max_workers
+        self.options = options or {}
+
+    def _run(self, prog_cb, log_cb):
+        return run_processing(
             self.input_path,
             self.cols,
             self.delimiter,
@@ -51,8 +84,91 @@ class Worker(QThread):
             log_cb,
             self.is_stopped,
             self.max_workers,
+            self.options,
+            usage_cb=self.usage_signal.emit,
         )
-        self.finished.emit(ok, msg)
+
+
+class PilotWorker(TaskThread):
+    """试运行线程。"""
+
+    def __init__(self, input_path, cols, delimiter, prompt, sample_size, max_workers=20, options=None):
+        super().__init__()
+        self.input_path = input_path
+        self.cols = cols
+        self.delimiter = delimiter
+        self.prompt = prompt
+        self.sample_size = sample_size
+        self.max_workers = max_workers
+        self.options = options or {}
+
+    def _run(self, prog_cb, log_cb):
+        return run_pilot(
+            self.input_path,
+            self.cols,
+            self.delimiter,
+            self.prompt,
+            self.sample_size,
+            prog_cb,
+            log_cb,
+            self.is_stopped,
+            self.max_workers,
+            self.options,
+        )
+
+
+class ExperimentWorker(TaskThread):
+    """A/B 实验线程。"""
+
+    def __init__(self, input_path, cols, variants, output_path, max_workers=20, options=None):
+        super().__init__()
+        self.input_path = input_path
+        self.cols = cols
+        self.variants = variants
+        self.output_path = output_path
+        self.max_workers = max_workers
+        self.options = options or {}
+
+    def _run(self, prog_cb, log_cb):
+        return run_experiment(
+            self.input_path,
+            self.cols,
+            self.variants,
+            self.output_path,
+            prog_cb,
+            log_cb,
+            self.is_stopped,
+            self.max_workers,
+            self.options,
+        )
+
+
+class ConcurrencySweepWorker(TaskThread):
+    """并发测速线程；完成后 recommended_workers 为推荐的并发线程数。"""
+
+    def __init__(self, input_path, cols, delimiter, prompt, levels=DEFAULT_LEVELS, options=None):
+        super().__init__()
+        self.input_path = input_path
+        self.cols = cols
+        self.delimiter = delimiter
+        self.prompt = prompt
+        self.levels = list(levels)
+        self.options = options or {}
+        self.recommended_workers = 0
+
+    def _run(self, prog_cb, log_cb):
+        ok, msg, self.recommended_workers = run_sweep(
+            self.input_path,
+            self.cols,
+            self.delimiter,
+            self.prompt,
+            prog_cb,
+            log_cb,
+            self.is_stopped,
+            self.levels,
+            self.options,
+        )
+        return ok, msg
 
 
 class ApiTestThread(QThread):
@@ -64,14 +180,80 @@ class ApiTestThread(QThread):
 
     def run(self):
         try:
+            started = time.perf_counter()
             resp = self.client.chat.completions.create(
                 model=get_current_model(),
                 messages=[{"role": "user", "content": "Hi"}],
                 temperature=0,
             )
             if resp:
-                self.finished.emit(True, "API 连接成功！延迟正常。")
+                self.finished.emit(
+                    True, f"API 连接成功！延迟 {time.perf_counter() - started:.2f}s（并发能力可用「并发测速」测量）。"
+                )
             else:
                 self.finished.emit(False, "API 返回内容为空。")
         except Exception as e:
             self.finished.emit(False, f"API 连接异常: {str(e)}")
+
+
+class ColumnStatsThread(QThread):
+    """后台读取整表，估算每列平均 token 数，避免大文件阻塞界面。"""
+    finished = pyqtSignal(bool, str, dict)
+
+    def __init__(self, input_path):
+        super().__init__()
+        self.input_path = input_path
+
+    def run(self):
+        try:
+            df = pd.read_excel(self.input_path)
+            stats = estimate_column_tokens(df)
+            self.finished.emit(True, self.input_path, {"rows": len(df), "columns": stats})
+        except Exception as e:
+            self.finished.emit(False, f"统计列 token 失败: {e}", {})
+
+
+class CacheImportThread(QThread):
+    """
+    后台把已有输出文件按当前任务指纹导入持久缓存，
+    并统计当前输入文件中可直接命中缓存、无需调用 API 的行数。
+    """
+    log_signal = pyqtSignal(str)
+    finished = pyqtSignal(bool, str)
+
+    def __init__(self, paths, input_path, cols, delimiter, prompt, options=None):
+        super().__init__()
+        self.paths = list(paths)
+        self.input_path = input_path
+        self.cols = cols
+        self.delimiter = delimiter
+        self.prompt = prompt
+        self.options = options or {}
+
+    def run(self):
+        try:
+            template = compile_template(self.prompt)
+            extra_cols = [c for c in template.columns if c not in self.cols]
+            all_cols = list(self.cols) + extra_cols
+            job_fp = current_job_fingerprint(self.prompt, self.delimiter, self.cols, extra_cols, self.options)
+            imported = 0
+            with ResultCache() as cache:
+                for path in self.paths:
+                    ok, msg, fps = seed_from_workbook(
+                        path, all_cols, job_fp, cache, get_current_model(), get_current_base_url()
+                    )
+                    self.log_signal.emit(f"导入 {path}: {msg}")
+                    if ok:
+                        imported += len(fps)
+                summary = f"共导入 {imported} 条结果，缓存现有 {cache.count()} 条"
+                if self.input_path:
+                    df = pd.read_excel(self.input_path)
+                    fps = row_fingerprints(df, all_cols, job_fp)
+                    hits = fps.isin(cache.get_many(fps).keys())
+                    summary += (
+                        f"；当前输入 {len(df)} 行中 {int(hits.sum())} 行可直接命中缓存，"
+                        f"将节省 {fps[hits].nunique()} 次 API 调用"
+                    )
+            self.finished.emit(True, summary)
+        except Exception as e:
+            self.finished.emit(False, f"导入缓存失败: {e}")